@@ -0,0 +1,83 @@
+'''Throughput of NGC job status polling: serial `ngc_job_status` calls vs `AsyncNGCClient.poll_jobs`.
+
+Starts a local aiohttp mock of the authn token and job status endpoints (each status call takes
+--latency-ms to answer, like a remote API) and checks --jobs simulated jobs both ways.
+
+    python benchmarks/bench_async_poll.py --jobs 1000 --concurrency 50
+'''
+
+import os, sys, json, time, base64, asyncio, argparse, threading
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STATUSES = ['QUEUED', 'RUNNING', 'FINISHED_SUCCESS', 'FAILED']
+
+
+def fake_token():
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': time.time() + 3600}).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+def make_app(latency):
+    async def token(request):
+        return web.json_response({'token': fake_token()})
+
+    async def job(request):
+        await asyncio.sleep(latency)
+        job_id = int(request.match_info['job_id'])
+        return web.json_response({'job': {'id': job_id, 'jobStatus': {'status': STATUSES[job_id % len(STATUSES)]}}})
+
+    app = web.Application()
+    app.router.add_get('/token', token)
+    app.router.add_get('/v2/org/{org}/jobs/{job_id}', job)
+    return app
+
+
+def start_server(latency):
+    '''Runs the mock server on its own event loop thread and returns its base URL'''
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(make_app(latency))
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f'http://127.0.0.1:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    base_url = start_server(args.latency_ms / 1000)
+    os.environ['NGC_API_URL'] = os.environ['NGC_AUTHN_URL'] = base_url
+    #measure raw HTTP throughput, not the client-side rate limit
+    os.environ.setdefault('NGC_RATE_LIMIT', '0')
+
+    from ngc_requests import ngc_job_status
+    from ngc_async import poll_jobs
+
+    job_ids = list(range(args.jobs))
+    api_key, org = 'bench-key', 'bench-org'
+
+    start = time.perf_counter()
+    serial = {job_id: ngc_job_status(None, api_key, org, job_id) for job_id in job_ids}
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    concurrent = asyncio.run(poll_jobs(api_key, org, job_ids, concurrency=args.concurrency))
+    async_time = time.perf_counter() - start
+
+    assert serial == concurrent
+    print(f'{args.jobs} jobs, {args.latency_ms:.0f} ms simulated API latency')
+    print(f'serial ngc_job_status   {serial_time:7.2f} s   {args.jobs / serial_time:8.1f} jobs/s')
+    print(f'async poll_jobs (x{args.concurrency:<3})  {async_time:7.2f} s   {args.jobs / async_time:8.1f} jobs/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''Parse-time cost of nemo_workflow_dag.py: import time, Variable.get calls and metadata-DB queries.
+
+The scheduler re-imports every DAG file on each parse loop, so anything done at module level is
+paid again and again. This executes the DAG file the way the DagBag does (a fresh module per
+parse) --parses times and compares the working tree against an earlier revision, by default the
+baseline commit whose module level read nine Airflow Variables.
+
+Needs an Airflow installation with an initialised metadata DB. Missing Variables are created
+with placeholder values so the old revision can be imported.
+
+    python benchmarks/bench_dag_parse.py --parses 50
+    python benchmarks/bench_dag_parse.py --rev HEAD~1
+'''
+
+import os, sys, json, argparse, tempfile, subprocess, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAG_FILE = 'nemo_workflow_dag.py'
+
+#Variables read by the DAG (and their placeholder values when missing)
+VARIABLES = {
+    'key_v': 'bench-api-key',
+    'org_v': 'bench-org',
+    'team_v': 'bench-team',
+    'ace_v': 'bench-ace',
+    'nemo_ckpt_v': 'nemo_gpt5B_bf16_tp1.nemo',
+    'pretrain_decision_v': 'False',
+    'tuning_method_v': 'lora',
+    'interactive_inference_v': 'False',
+    'unique_name_v': 'bench',
+}
+
+
+def seed_variables():
+    from airflow.models import Variable
+    for name, value in VARIABLES.items():
+        if Variable.get(name, default_var=None) is None:
+            print(f'Creating placeholder Variable {name}')
+            Variable.set(name, value, serialize_json=True)
+
+
+def child(path, parses):
+    '''Runs in a subprocess: imports Airflow once, then executes the DAG file *parses* times'''
+    import time, importlib.util
+    from sqlalchemy import event
+    from airflow import settings
+    from airflow.models import Variable
+
+    counts = {'variable_gets': 0, 'queries': 0}
+    get = Variable.get.__func__
+
+    def counting_get(cls, *args, **kwargs):
+        counts['variable_gets'] += 1
+        return get(cls, *args, **kwargs)
+    Variable.get = classmethod(counting_get)
+
+    def count_query(*args):
+        counts['queries'] += 1
+    event.listen(settings.engine, 'before_cursor_execute', count_query)
+
+    sys.path.insert(0, ROOT)
+    timings = []
+    for parse in range(parses):
+        spec = importlib.util.spec_from_file_location(f'nemo_workflow_dag_{parse}', path)
+        module = importlib.util.module_from_spec(spec)
+        start = time.perf_counter()
+        spec.loader.exec_module(module)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    print(json.dumps({
+        'timings': timings,
+        'variable_gets': counts['variable_gets'] / parses,
+        'queries': counts['queries'] / parses,
+    }))
+
+
+def measure(path, parses):
+    output = subprocess.run([sys.executable, __file__, '--child', path, '--parses', str(parses)],
+                            check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(label, result):
+    #the first parse also pays for importing the task modules, so it is reported separately
+    first, rest = result['timings'][0], result['timings'][1:] or result['timings']
+    print(f'{label:<16} first {first:8.2f} ms   median {statistics.median(rest):8.2f} ms   '
+          f'Variable.get {result["variable_gets"]:4.1f}   DB queries {result["queries"]:5.1f}  (per parse)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parses', type=int, default=20)
+    parser.add_argument('--rev', default=None, help='revision to compare against (default: the root commit)')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child, args.parses)
+
+    seed_variables()
+    rev = args.rev or subprocess.run(['git', 'rev-list', '--max-parents=0', 'HEAD'], check=True,
+                                     capture_output=True, text=True, cwd=ROOT).stdout.split()[0]
+    old_source = subprocess.run(['git', 'show', f'{rev}:{DAG_FILE}'], check=True,
+                                capture_output=True, text=True, cwd=ROOT).stdout
+
+    #the old file is run from the repo root so it imports the current task modules
+    with tempfile.NamedTemporaryFile('w', suffix='.py', dir=ROOT, prefix='.bench_dag_') as old_file:
+        old_file.write(old_source)
+        old_file.flush()
+        before = measure(old_file.name, args.parses)
+    after = measure(os.path.join(ROOT, DAG_FILE), args.parses)
+
+    report(f'{rev[:10]}', before)
+    report('working tree', after)
+    speedup = statistics.median(before['timings'][1:] or before['timings']) / \
+        statistics.median(after['timings'][1:] or after['timings'])
+    print(f'parse speed-up {speedup:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
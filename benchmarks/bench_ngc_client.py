@@ -0,0 +1,71 @@
+'''Measures per-call latency of NGC-style REST calls with and without the pooled NGCClient.
+
+Runs a local stub HTTP/1.1 server that answers like the NGC job status endpoint, then issues the
+same number of GET requests through module-level `requests.request` (new connection per call)
+and through a shared NGCClient session (keep-alive). Against the real API each avoided handshake
+is a TLS handshake, so the gap is larger than on loopback.
+
+    python benchmarks/bench_ngc_client.py --calls 500
+'''
+
+import os, sys, json, time, argparse, statistics, threading, requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ngc_client import NGCClient
+
+STATUS_BODY = json.dumps({'job': {'id': 1, 'jobStatus': {'status': 'RUNNING'}}}).encode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(STATUS_BODY)))
+        self.end_headers()
+        self.wfile.write(STATUS_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def time_calls(do_request, url, calls):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        response = do_request('GET', url)
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f'{label:<22} mean {statistics.mean(latencies):7.3f} ms   '
+          f'p50 {statistics.median(latencies):7.3f} ms   p95 {p95:7.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/v2/org/bench/jobs/1'
+
+    client = NGCClient()
+    try:
+        report('requests.request', time_calls(requests.request, url, args.calls))
+        report('NGCClient (pooled)', time_calls(client.request, url, args.calls))
+    finally:
+        client.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+'''Shard-level Pile data preparation (pile_shards.py) against the local NGC emulator.
+
+Runs the mapped prepare_pile_shards tasks of nemo_workflow_dag.py over --shards shards, at most
+--pool of them at once, with Airflow-style task retries, then verify_pile_dataset. Jobs fail at
+random (--failure-rate); each retry must only prepare the shards its group still lacks. Reports
+the simulated wall time, the jobs submitted and how many shard preparations they covered. A
+second run then checks that everything is skipped without submitting a job.
+
+A group job's simulated run time is that of its pipeline: the first shard's download, then one
+preprocessing per shard (downloads of later shards overlap the preprocessing before them).
+
+    python benchmarks/bench_pile_shards.py
+    python benchmarks/bench_pile_shards.py --failure-rate 0.3 --shards-per-job 5 --pool 2
+'''
+
+import os, sys, json, time, argparse, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ngc_emulator import NGCEmulator
+from dag_harness import FakeTaskInstance
+
+JOB_PREFIX = 'airflow_prepare_pile_'
+
+
+class GroupDurations(dict):
+    '''Simulated run time of a group job from the shards in its name'''
+
+    def __init__(self, download, preprocess):
+        super().__init__()
+        self.download, self.preprocess = download, preprocess
+
+    def __bool__(self):
+        return True
+
+    def get(self, name, default=None):
+        if not name.startswith(JOB_PREFIX):
+            return default
+        shards = len(name[len(JOB_PREFIX):].split('_'))
+        return self.download + shards * max(self.preprocess, self.download)
+
+
+def shard_files(spec):
+    '''The outputs a successful group job leaves behind besides the redirects the emulator sees'''
+    if not spec['name'].startswith(JOB_PREFIX):
+        return []
+    from pile_shards import shard_outputs, DATA_MOUNT
+    return [f'{DATA_MOUNT}/{path}' for shard in spec['name'][len(JOB_PREFIX):].split('_')
+            for path in shard_outputs(int(shard))]
+
+
+def run_tasks(groups, xcoms, conf, pool, retries, run_id):
+    '''Mapped prepare_pile_shards tasks, *pool* at a time, each retried up to *retries* times.
+    Returns the final state of each task.'''
+    from pile_shards import prepare_pile_shards
+
+    def run(map_index, shards):
+        for attempt in range(retries + 1):
+            ti = FakeTaskInstance(f'{run_id}_try_{attempt}', 'prepare_pile_shards', xcoms)
+            ti.map_index = map_index
+            try:
+                prepare_pile_shards(ti, conf['key'], conf['org'], conf['ace'], shards, team=conf['team'])
+                return 'success'
+            except Exception as error:
+                print(f'prepare_pile_shards[{map_index}] try {attempt + 1}: {error}')
+        return 'failed'
+
+    with ThreadPoolExecutor(pool) as executor:
+        return list(executor.map(run, range(len(groups)), groups))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=30)
+    parser.add_argument('--shards-per-job', type=int, default=3)
+    parser.add_argument('--pool', type=int, default=4, help='slots of the pile_data_prep pool')
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--failure-rate', type=float, default=0.2)
+    parser.add_argument('--download-time', type=float, default=1200, help='simulated seconds per shard')
+    parser.add_argument('--preprocess-time', type=float, default=3600, help='simulated seconds per shard')
+    parser.add_argument('--queue-time', type=float, default=120)
+    parser.add_argument('--time-scale', type=float, default=0.0005, help='real seconds per simulated second')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    emulator = NGCEmulator(queue_time=args.queue_time, job_durations=GroupDurations(args.download_time,
+                                                                                    args.preprocess_time),
+                           failure_rate=args.failure_rate, time_scale=args.time_scale, outputs=shard_files,
+                           seed=args.seed).start()
+    os.environ['NGC_API_URL'] = os.environ['NGC_AUTHN_URL'] = emulator.url
+    os.environ['NGC_POLL_TIME_SCALE'] = str(args.time_scale)
+    os.environ['NGC_TOKEN_CACHE_DIR'] = tempfile.mkdtemp(prefix='bench_pile_tokens_')
+    os.environ.setdefault('NGC_RATE_LIMIT', '0')
+
+    from job_result import JobResult
+    from stage_manifest import stage_hash
+    from pile_shards import shard_groups, verify_pile_dataset
+
+    conf = {'key': 'bench-key', 'org': 'bench-org', 'team': 'bench-team', 'ace': 'bench-ace'}
+    workspace_id = emulator.create_workspace('airflow_gpt_nemo_workspace_bench')['id']
+    #the BPE vocabulary comes from the HuggingFace hub, which the benchmark does not download
+    xcoms = {('create_gpt_workspace', 'return_value'): workspace_id,
+             ('download_pile_dataset', 'return_value'): JobResult.skipped(memo_hash=stage_hash({'vocab': 'bench'}))}
+    groups = shard_groups(f'0-{args.shards - 1}', args.shards_per_job)
+
+    for run in range(2):
+        jobs_before = len(emulator.jobs)
+        start = time.time()
+        states = run_tasks(groups, xcoms, conf, args.pool, args.retries, f'bench_run_{run}')
+        elapsed = (time.time() - start) / args.time_scale
+
+        jobs = [job for job in list(emulator.jobs.values())[jobs_before:]]
+        prepared = sum(len(job['spec']['name'][len(JOB_PREFIX):].split('_')) for job in jobs)
+        failed_jobs = sum(job['final_status'] == 'FAILED' for job in jobs)
+        try:
+            verified = verify_pile_dataset(FakeTaskInstance(f'bench_run_{run}', 'verify_pile_dataset', xcoms),
+                                           conf['key'], conf['org'], f'0-{args.shards - 1}')
+            verdict = f'all shards prepared ({verified.memo_hash})'
+        except Exception as error:
+            verdict = str(error)
+
+        print(f"run {run + 1}: {elapsed / 3600:.2f} h simulated, {len(jobs)} jobs ({failed_jobs} failed), "
+              f"{prepared} shard preparations for {args.shards} shards, tasks "
+              f"{json.dumps({state: states.count(state) for state in set(states)})}")
+        print(f'  verify: {verdict}')
+
+    serial = args.shards * (args.download_time + args.preprocess_time)
+    print(f'one job preparing every shard in turn without failures: {serial / 3600:.2f} h of job time')
+    emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''Packing efficiency of sequence_packing.py on SQuAD: the share of token slots holding real tokens
+when squad_train.jsonl is bin-packed first-fit-decreasing into sequences of each length, against
+padding every example to that length (one example per sequence, what training does today).
+
+Builds squad_train.jsonl from a synthetic SQuAD v1.1 (see bench_squad_preprocess.py), packs it at
+each --seq-lengths and checks every pack: no sequence over the length, every example exactly
+once, and boundaries and loss masks that give back the original examples.
+
+    python benchmarks/bench_sequence_packing.py
+    python benchmarks/bench_sequence_packing.py --tokenizer bytes --seq-lengths 4096 8192
+'''
+
+import os, sys, time, argparse, tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from squad_preprocess import TRAIN_FILE, DEV_FILE, preprocess_squad
+from sequence_packing import tokenize_examples, pack_examples, packing_stats
+from bench_squad_preprocess import synthetic_squad
+from bench_token_cache import ByteTokenizer
+
+
+class ByteTokenizerWithEOS(ByteTokenizer):
+    eos_token_id = 0
+
+
+def check_packs(examples, packs, bins, max_seq_length):
+    '''Exits if the packs are not exactly the examples, laid out as seq_start_id says'''
+    if sorted(item for members in bins for item in members) != list(range(len(examples))):
+        sys.exit('Examples are missing from the packs or packed twice')
+    for pack, members in zip(packs, bins):
+        if len(pack['input_ids']) > max_seq_length or len(pack['loss_mask']) != len(pack['input_ids']):
+            sys.exit(f"A pack of {len(pack['input_ids'])} tokens does not fit {max_seq_length}")
+        bounds = pack['seq_start_id'] + [len(pack['input_ids'])]
+        for item, start, end in zip(members, bounds, bounds[1:]):
+            ids, answer_start = examples[item]
+            if pack['input_ids'][start:end] != ids.tolist() or \
+               pack['loss_mask'][start:end] != [0] * answer_start + [1] * (len(ids) - answer_start):
+                sys.exit('A packed example differs from the tokenized example')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokenizer', choices=['gpt2', 'bytes'], default='gpt2')
+    parser.add_argument('--scale', type=float, default=1.0, help='dataset size relative to SQuAD v1.1')
+    parser.add_argument('--seq-lengths', type=int, nargs='+', default=[1024, 2048, 4096])
+    args = parser.parse_args()
+
+    if args.tokenizer == 'gpt2':
+        from triton_inference.utils.tokenizer import get_tokenizer
+        tokenizer, _ = get_tokenizer(use_nemo=False, num_virtual_tokens=0)
+    else:
+        tokenizer = ByteTokenizerWithEOS()
+
+    with tempfile.TemporaryDirectory(prefix='bench_sequence_packing_') as data_dir:
+        with open(os.path.join(data_dir, TRAIN_FILE), 'wb') as f:
+            f.write(synthetic_squad(int(442 * args.scale), seed=1))
+        with open(os.path.join(data_dir, DEV_FILE), 'wb') as f:
+            f.write(synthetic_squad(1, answers=3, seed=2))
+        preprocess_squad(data_dir, sft_format=True, workers=0)
+        train_file = os.path.join(data_dir, 'squad_train.jsonl')
+
+        print(f"{'length':>7} {'examples':>9} {'truncated':>10} {'sequences':>10} {'per seq':>8} {'padded':>8} "
+              f"{'packed':>8} {'steps saved':>12} {'pack s':>8}")
+        for max_seq_length in args.seq_lengths:
+            examples, truncated = tokenize_examples(train_file, tokenizer, max_seq_length)
+            start = time.perf_counter()
+            packs, bins = pack_examples(examples, max_seq_length)
+            seconds = time.perf_counter() - start
+            check_packs(examples, packs, bins, max_seq_length)
+
+            stats = packing_stats(examples, bins, max_seq_length, truncated)
+            lengths = np.array([len(ids) for ids, _ in examples])
+            print(f"{max_seq_length:>7} {stats['examples']:>9} {truncated:>10} {stats['packed_sequences']:>10} "
+                  f"{stats['examples_per_sequence']:>8.2f} {stats['padded_efficiency']:>8.1%} "
+                  f"{stats['packing_efficiency']:>8.1%} {1 - len(bins) / len(examples):>12.1%} {seconds:>8.2f}")
+        print(f'example length: median {int(np.median(lengths))}, p99 {int(np.percentile(lengths, 99))}, '
+              f'max {lengths.max()} tokens')
+
+
+if __name__ == '__main__':
+    main()
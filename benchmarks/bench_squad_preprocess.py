@@ -0,0 +1,126 @@
+'''CPU time and peak memory of SQuAD preprocessing: squad_preprocess.py with 0..N worker processes
+against the load-everything approach of NeMo's upstream script, on a synthetic SQuAD v1.1 of the
+real dataset's size (442 train topics with ~87.6k questions, 48 dev topics with ~10.6k).
+
+Every variant runs in a fresh subprocess so peak RSS is its own. The outputs of every variant are
+compared by SHA-256; a mismatch fails the benchmark.
+
+    python benchmarks/bench_squad_preprocess.py
+    python benchmarks/bench_squad_preprocess.py --workers 0 2 4 --scale 4 --sft-format
+'''
+
+import os, sys, json, time, random, argparse, tempfile, resource, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from squad_preprocess import TRAIN_FILE, DEV_FILE, SPLITS, output_files, file_checksum
+
+_WORDS = ('the of and to in a is was for on as by with he that at from his it an were are which '
+          'this be also has had first one their its new after who they have her she two been other when '
+          'there all during into school time may years more most only over city some world would where').split()
+
+
+def synthetic_squad(topics, paragraphs=40, questions=5, answers=1, seed=0):
+    '''Bytes of a SQuAD v1.1 style file: *topics* x *paragraphs* contexts of ~120 words, each with
+    *questions* questions of *answers* answers taken from the context'''
+    rng = random.Random(seed)
+    data = []
+    for topic in range(topics):
+        topic_paragraphs = []
+        for _ in range(paragraphs):
+            words = [rng.choice(_WORDS) for _ in range(120)]
+            context = ' '.join(words).capitalize() + '.'
+            qas = []
+            for _ in range(questions):
+                spans = []
+                for _ in range(answers):
+                    start = rng.randrange(100)
+                    text = ' '.join(words[start:start + rng.randint(1, 5)])
+                    spans.append({'answer_start': context.lower().find(text), 'text': text})
+                question = ' '.join(rng.choice(_WORDS) for _ in range(10)).capitalize() + '?'
+                qas.append({'answers': spans, 'question': question, 'id': f'{seed}{topic:04d}{len(qas)}'})
+            topic_paragraphs.append({'context': context, 'qas': qas})
+        data.append({'title': f'Topic_{topic}', 'paragraphs': topic_paragraphs})
+    return json.dumps({'data': data, 'version': '1.1'}).encode('utf-8')
+
+
+def load_all(data_dir, sft_format):
+    '''The upstream script's shape: json.load both files and build every split as a list first'''
+    from squad_preprocess import iter_lines
+    for input_file, splits in SPLITS.items():
+        with open(os.path.join(data_dir, input_file)) as f:
+            topics = json.load(f)['data']
+        split_lines = {split: list(iter_lines(topics, split, sft_format)) for split in splits}
+        for split, lines in split_lines.items():
+            with open(os.path.join(data_dir, f'squad_{split}.jsonl'), 'w') as f:
+                f.writelines(lines)
+
+
+def generate(data_dir, scale):
+    with open(os.path.join(data_dir, TRAIN_FILE), 'wb') as f:
+        f.write(synthetic_squad(int(442 * scale), seed=1))
+    with open(os.path.join(data_dir, DEV_FILE), 'wb') as f:
+        f.write(synthetic_squad(int(48 * scale), questions=5, answers=3, seed=2))
+
+
+def child(variant, data_dir, sft_format):
+    start = time.perf_counter()
+    if variant == 'load_all':
+        load_all(data_dir, sft_format)
+    else:
+        from squad_preprocess import preprocess_squad
+        preprocess_squad(data_dir, sft_format=sft_format, workers=int(variant))
+    seconds = time.perf_counter() - start
+    #the workers' peak is reported separately: they hold one shard each, the parent the writers
+    print(json.dumps({
+        'seconds': seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'children_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'checksums': {name: file_checksum(os.path.join(data_dir, name)) for name in output_files()},
+    }))
+
+
+def measure(variant, data_dir, sft_format, scale=1.0):
+    command = [sys.executable, __file__, '--child', variant, '--data-dir', data_dir, '--scale', str(scale)]
+    if sft_format:
+        command.append('--sft-format')
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--scale', type=float, default=1.0, help='dataset size relative to SQuAD v1.1')
+    parser.add_argument('--sft-format', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'generate':
+        return generate(args.data_dir, args.scale)
+    if args.child:
+        return child(args.child, args.data_dir, args.sft_format)
+
+    with tempfile.TemporaryDirectory(prefix='bench_squad_') as data_dir:
+        #peak RSS carries over from parent to child processes, so this one stays small
+        subprocess.run([sys.executable, __file__, '--child', 'generate', '--data-dir', data_dir,
+                        '--scale', str(args.scale)], check=True, cwd=ROOT)
+        size = sum(os.path.getsize(os.path.join(data_dir, name)) for name in (TRAIN_FILE, DEV_FILE)) / 2 ** 20
+        print(f'synthetic SQuAD: {size:.1f} MB, {os.cpu_count()} CPUs')
+
+        reference = None
+        for variant in ['load_all'] + [str(workers) for workers in args.workers]:
+            result = measure(variant, data_dir, args.sft_format, args.scale)
+            reference = reference or result['checksums']
+            label = 'json.load (upstream)' if variant == 'load_all' else f'streaming, {variant} workers'
+            print(f"{label:<24} {result['seconds']:7.2f} s   peak RSS {result['peak_rss_mb']:7.1f} MB   "
+                  f"workers' peak RSS {result['children_peak_rss_mb']:6.1f} MB")
+            if result['checksums'] != reference:
+                sys.exit(f'{label}: outputs differ from json.load (upstream)')
+        print('outputs identical across variants')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''Load time of tokenized SQuAD: parsing and tokenizing the JSONL file (what every NeMo job does
+today) against opening the memory-mapped token cache of token_cache.py.
+
+Builds squad_*.jsonl from a synthetic SQuAD v1.1 (see bench_squad_preprocess.py), caches each
+file once and then times, per file:
+
+    jsonl parse        json.loads of every line
+    jsonl + tokenize   json.loads and tokenizing every text field
+    cache open         TokenCache() on the cache directory
+    cache full scan    touching every record's token ids
+    cache random 1k    1000 random records (what a shuffled data loader does)
+
+The GPT2 tokenizer needs `transformers` and the gpt2 files from the HuggingFace hub. --tokenizer
+bytes uses UTF-8 bytes as token ids instead; it measures the cache and parsing side only, since
+BPE tokenization is far slower than encoding bytes.
+
+    python benchmarks/bench_token_cache.py
+    python benchmarks/bench_token_cache.py --tokenizer bytes --scale 2
+'''
+
+import os, sys, json, time, random, argparse, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from squad_preprocess import TRAIN_FILE, DEV_FILE, preprocess_squad, output_files
+from token_cache import TokenCache, ensure_token_cache, text_fields, encode
+from bench_squad_preprocess import synthetic_squad
+
+
+class ByteTokenizer:
+    '''UTF-8 bytes as token ids, for machines without the GPT2 vocabulary'''
+
+    def encode(self, text):
+        return list(text.encode('utf-8'))
+
+    def get_vocab(self):
+        return {bytes([byte]).decode('latin-1'): byte for byte in range(256)}
+
+
+def timed(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def parse_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def parse_and_tokenize(path, tokenizer, fields):
+    return [[encode(tokenizer, record.get(field) or '') for field in fields] for record in parse_jsonl(path)]
+
+
+def full_scan(cache_dir):
+    cache = TokenCache(cache_dir)
+    return sum(int(ids[-1]) if len(ids) else 0 for index in range(len(cache)) for ids in cache[index].values())
+
+
+def random_access(cache_dir, samples=1000):
+    cache = TokenCache(cache_dir)
+    rng = random.Random(0)
+    return sum(len(ids) for _ in range(samples) for ids in cache[rng.randrange(len(cache))].values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokenizer', choices=['gpt2', 'bytes'], default='gpt2')
+    parser.add_argument('--scale', type=float, default=1.0, help='dataset size relative to SQuAD v1.1')
+    parser.add_argument('--sft-format', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3, help='best of this many runs per measurement')
+    args = parser.parse_args()
+
+    if args.tokenizer == 'gpt2':
+        from triton_inference.utils.tokenizer import get_tokenizer
+        tokenizer, _ = get_tokenizer(use_nemo=False, num_virtual_tokens=0)
+    else:
+        tokenizer = ByteTokenizer()
+
+    with tempfile.TemporaryDirectory(prefix='bench_token_cache_') as data_dir:
+        with open(os.path.join(data_dir, TRAIN_FILE), 'wb') as f:
+            f.write(synthetic_squad(int(442 * args.scale), seed=1))
+        with open(os.path.join(data_dir, DEV_FILE), 'wb') as f:
+            f.write(synthetic_squad(int(48 * args.scale), answers=3, seed=2))
+        preprocess_squad(data_dir, sft_format=args.sft_format, workers=0)
+
+        print(f"{'file':<32} {'records':>8} {'build':>8} {'parse':>8} {'+tokenize':>10} {'open':>8} "
+              f"{'scan':>8} {'random 1k':>10}   (seconds)")
+        for name in output_files():
+            path = os.path.join(data_dir, name)
+            fields = text_fields(path)
+            start = time.perf_counter()
+            cache_dir = ensure_token_cache(path, os.path.join(data_dir, 'token_cache'), tokenizer, fields)
+            build = time.perf_counter() - start
+
+            parse = timed(lambda: parse_jsonl(path), args.repeat)
+            tokenize = timed(lambda: parse_and_tokenize(path, tokenizer, fields), args.repeat)
+            open_cache = timed(lambda: TokenCache(cache_dir), args.repeat)
+            scan = timed(lambda: full_scan(cache_dir), args.repeat)
+            sample = timed(lambda: random_access(cache_dir), args.repeat)
+
+            #the cache must hold exactly what tokenizing the file gives
+            cache = TokenCache(cache_dir)
+            expected = parse_and_tokenize(path, tokenizer, fields)
+            if len(cache) != len(expected) or any(list(map(int, cache.field(index, field))) != ids
+                                                  for index, record in enumerate(expected)
+                                                  for field, ids in zip(fields, record)):
+                sys.exit(f'{name}: cached tokens differ from tokenizing the file')
+
+            print(f'{name:<32} {len(cache):>8} {build:>8.2f} {parse:>8.3f} {tokenize:>10.3f} {open_cache:>8.4f} '
+                  f'{scan:>8.3f} {sample:>10.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+'''Runs the task callables of nemo_workflow_dag.py against the local NGC emulator and reports
+control-plane cost: API calls per endpoint, wall time and polling overhead for every task.
+
+Tasks run in threads following the DAG's dependencies for one tuning method / inference path,
+with a fake task instance standing in for Airflow's XCom. Job durations and poll intervals are
+compressed by --time-scale; every time in the report is converted back to simulated seconds.
+
+    python benchmarks/dag_harness.py --method lora
+    python benchmarks/dag_harness.py --method sft --interactive --failure-rate 0.1 --json report.json
+    python benchmarks/dag_harness.py --method lora --layout both   # critical path before/after overlap
+    python benchmarks/dag_harness.py --method lora --executor      # short stages on a warm executor
+    python benchmarks/dag_harness.py --method lora --profile-dir /tmp/profiles  # Gantt chart per run
+'''
+
+import os, re, sys, json, time, argparse, tempfile, threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ngc_emulator import NGCEmulator
+
+#simulated run time (seconds) of each NGC job launched by the pipeline
+JOB_DURATIONS = {
+    'airflow_download_gpt3_5b_nemo_ckpt': 600,
+    'airflow_download_squad': 120,
+    'airflow_preprocess_squad': 60,
+    'airflow_cache_squad_tokens': 120,
+    'airflow_pack_squad': 120,
+    'airflow_lora_gpt3_5b_train': 3600,
+    'airflow_p_tuning_gpt3_5b_train': 3600,
+    'airflow_sft_gpt3_5b_train': 3600,
+    'airflow_lora_gpt3_5b_inference': 900,
+    'airflow_p_tuning_gpt3_5b_inference': 900,
+    'airflow_sft_gpt3_5b_inference': 900,
+    'airflow_lora_gpt3_5b_merge_weights': 600,
+    'airflow_warm_executor': 24 * 3600, #until stopped
+}
+
+#artifacts each job leaves in its workspaces, so skip checks see them on the next run
+JOB_OUTPUTS = {
+    'airflow_download_gpt3_5b_nemo_ckpt': ['/mount/gpt_workspace/gpt_models/{nemo_ckpt}'],
+    'airflow_download_squad': ['/mount/tuning_workspace/SQuAD/v1.1/train-v1.1.json',
+                               '/mount/tuning_workspace/SQuAD/v1.1/dev-v1.1.json'],
+    'airflow_preprocess_squad': ['/mount/tuning_workspace/SQuAD/v1.1/squad_train.jsonl',
+                                 '/mount/tuning_workspace/SQuAD/v1.1/squad_val.jsonl',
+                                 '/mount/tuning_workspace/SQuAD/v1.1/squad_test_ground_truth.jsonl',
+                                 '/mount/tuning_workspace/SQuAD/v1.1/squad_test.jsonl',
+                                 '/mount/tuning_workspace/SQuAD/v1.1/squad_checksums.json'],
+    'airflow_cache_squad_tokens': ['/mount/tuning_workspace/SQuAD/v1.1/token_cache/index.json'],
+    'airflow_lora_gpt3_5b_train': ['/mount/tuning_workspace/training_info/checkpoints/lora_gpt3_5b.nemo'],
+    'airflow_lora_gpt3_5b_inference': ['/mount/tuning_workspace/training_info/lora_gpt3_5b_inference.txt'],
+    'airflow_p_tuning_gpt3_5b_train': ['/mount/tuning_workspace/p_tuning_results/gpt3_5b/prompt_learning_squad/results/p_tuned_gpt3_5b.nemo'],
+    'airflow_p_tuning_gpt3_5b_inference': ['/mount/tuning_workspace/p_tuning_results/gpt3_5b/prompt_learning_squad/results/p_tuned_gpt3_5b_inference.txt'],
+    'airflow_sft_gpt3_5b_train': ['/mount/tuning_workspace/sft_launcher_results/gpt3_5b_sft/squad/results/checkpoints/megatron_gpt3_squad.nemo'],
+    'airflow_sft_gpt3_5b_inference': ['/mount/tuning_workspace/sft_launcher_results/gpt3_5b_sft/squad/results/sft_gpt3_5b_inference.jsonl'],
+    #the file named after the scores (see squad_scores.py); the emulator cannot run the job that names it
+    'airflow_lora_gpt3_5b_squad_metric_eval': ['/mount/tuning_workspace/squad_metrics/lora_scores/exact_match=80.0,f1=87.5'],
+    'airflow_p_tuning_gpt3_5b_squad_metric_eval': ['/mount/tuning_workspace/squad_metrics/p_tuning_scores/exact_match=72.0,f1=80.5'],
+    'airflow_sft_gpt3_5b_squad_metric_eval': ['/mount/tuning_workspace/squad_metrics/sft_scores/exact_match=78.0,f1=85.0'],
+    'airflow_lora_gpt3_5b_merge_weights': ['/mount/tuning_workspace/training_info/checkpoints/lora_gpt_5B_merged.nemo'],
+    'airflow_create_triton_model_repository_lora': ['/mount/tuning_workspace/model_repository/lora_gpt3_5B/config.pbtxt'],
+    'airflow_create_triton_model_repository_p_tuning': ['/mount/tuning_workspace/model_repository/gpt3_5B/config.pbtxt'],
+    'airflow_create_triton_model_repository_sft': ['/mount/tuning_workspace/model_repository/sft_gpt3_5B/config.pbtxt'],
+}
+
+NEMO_CKPT = 'nemo_gpt5B_bf16_tp2.nemo'
+
+_ENDPOINTS = [
+    ('token', re.compile(r'/token$')),
+    ('list_files', re.compile(r'/listFiles$')),
+    ('job_status', re.compile(r'/jobs/\d+$')),
+    ('jobs', re.compile(r'/jobs/?$')),
+    ('workspace', re.compile(r'/workspaces/')),
+]
+
+
+class Task:
+    def __init__(self, task_id, python_callable, op_kwargs=None, upstream=()):
+        self.task_id = task_id
+        self.python_callable = python_callable
+        self.op_kwargs = op_kwargs or {}
+        self.upstream = list(upstream)
+        self.state = None
+        self.start = self.end = None
+        self.calls = {}
+        self.job_ids = []
+        self.detected = {}
+        self.result = None
+        self.error = None
+
+
+class FakeTaskInstance:
+    '''Just enough of Airflow's TaskInstance for the callables: ids and XCom'''
+
+    def __init__(self, run_id, task_id, xcoms):
+        self.dag_id = 'NeMo_LLM_Workflow_DGX_Cloud'
+        self.run_id = run_id
+        self.task_id = task_id
+        self.map_index = -1
+        self._xcoms = xcoms
+
+    def xcom_pull(self, task_ids=None, key='return_value'):
+        return self._xcoms.get((task_ids, key))
+
+    def xcom_push(self, key, value):
+        self._xcoms[(self.task_id, key)] = value
+
+
+def build_pipeline(method, interactive, conf, layout='overlapped', executor=False):
+    '''Tasks on one path through nemo_workflow_dag.py, with the same ids and dependencies. The
+    'serial' layout is the DAG's earlier shape, where the SQuAD download waited for the checkpoint
+    download and both workspaces gated the branching task. With *executor*, a warm executor job
+    runs the short stages, as in dag_factory.py DAGs of profiles with `warm_executor`.'''
+    from task_workspace import create_task_workspace, name_tuning_workspace
+    from branching import choose_tuning_method, get_base_model, choose_inference
+    from nemo_checkpoint import download_nemo_checkpoint
+    from download_squad import get_squad_dataset
+    from p_tuning import p_tuning_training_bcp, p_tuning_inference_bcp
+    from lora import lora_training_bcp, lora_inference_bcp
+    from sft import sft_training_bcp, sft_inference_bcp
+    from triton import create_triton_model_repository, launch_triton_server
+    from squad_eval import squad_metric_eval
+    from warm_executor import start_executor, stop_executor, EXECUTOR_TASK_ID
+
+    ngc = {'ngc_api_key': conf['key'], 'org': conf['org'], 'ace': conf['ace']}
+    with_team = dict(ngc, team=conf['team'])
+    train_task_id, train_callable = {
+        'lora': ('LoRA_train', lora_training_bcp),
+        'p_tuning': ('p_tuning_train', p_tuning_training_bcp),
+        'sft': ('SFT_train', sft_training_bcp),
+    }[method]
+
+    tasks = [
+        Task('create_gpt_workspace', create_task_workspace,
+             dict(ngc, workspace_name=f"airflow_gpt_nemo_workspace_{conf['unique_name']}")),
+        Task('create_tuning_workspace', create_task_workspace,
+             dict(ngc, workspace_name=name_tuning_workspace(method, conf['unique_name']))),
+        Task('get_base_model', get_base_model, {'pretrain_decision': 'False'},
+             ['create_gpt_workspace', 'create_tuning_workspace'] if layout == 'serial' else ['create_gpt_workspace']),
+        Task('download_nemo_checkpoint', download_nemo_checkpoint, dict(with_team, nemo_ckpt_file=NEMO_CKPT),
+             ['get_base_model']),
+        Task('download_squad_dataset', get_squad_dataset, dict(with_team, tuning_method=method),
+             ['download_nemo_checkpoint'] if layout == 'serial' else ['create_tuning_workspace']),
+        Task('choose_tuning_method', choose_tuning_method, {'method': method},
+             ['download_squad_dataset'] if layout == 'serial' else ['download_nemo_checkpoint', 'download_squad_dataset']),
+        Task(train_task_id, train_callable, with_team, ['choose_tuning_method']),
+        Task('choose_inference_method', choose_inference, {'interactive': interactive, 'method': method},
+             [train_task_id]),
+    ]
+
+    if interactive:
+        tasks += [
+            Task('triton_inference.create_triton_model_repository', create_triton_model_repository,
+                 dict(with_team, method=method), ['choose_inference_method']),
+            Task('triton_inference.launch_triton_server', launch_triton_server, dict(with_team, method=method),
+                 ['triton_inference.create_triton_model_repository']),
+        ]
+    else:
+        inference_task_id, inference_callable = {
+            'lora': ('nemo_script_inference.LoRA_inference_script', lora_inference_bcp),
+            'p_tuning': ('nemo_script_inference.p_tuning_inference_script', p_tuning_inference_bcp),
+            'sft': ('nemo_script_inference.SFT_inference_script', sft_inference_bcp),
+        }[method]
+        tasks += [
+            Task(inference_task_id, inference_callable, with_team, ['choose_inference_method']),
+            Task('squad_metric_eval', squad_metric_eval, dict(with_team, tuning_method=method), [inference_task_id]),
+        ]
+
+    if executor:
+        squad_task = next(task for task in tasks if task.task_id == 'download_squad_dataset')
+        squad_task.upstream = squad_task.upstream + [EXECUTOR_TASK_ID]
+        #tasks stay in dependency order
+        tasks.insert(2, Task(EXECUTOR_TASK_ID, start_executor,
+                             dict(with_team, eval_method=None if interactive else method),
+                             ['create_gpt_workspace', 'create_tuning_workspace']))
+        tasks.append(Task('stop_warm_executor', stop_executor, {'ngc_api_key': conf['key'], 'org': conf['org']},
+                          [tasks[-1].task_id]))
+    return tasks
+
+
+def make_counting_client(current_task):
+    '''NGCClient that attributes every call (and every submitted job) to the task running on the thread'''
+    from ngc_client import NGCClient
+    from ngc_rate_limit import get_rate_limiter
+    from job_polling import is_terminal
+
+    class CountingClient(NGCClient):
+        def request(self, method, url, **kwargs):
+            response = super().request(method, url, **kwargs)
+            task = getattr(current_task, 'task', None)
+            if task is not None:
+                endpoint = next((name for name, pattern in _ENDPOINTS if pattern.search(url.split('?')[0])), 'other')
+                if method == 'POST' and endpoint == 'jobs':
+                    endpoint = 'submit_job'
+                    task.job_ids.append(response.json()['job']['id'])
+                elif endpoint == 'job_status' and response.status_code == 200:
+                    job = response.json()['job']
+                    if is_terminal(job['jobStatus']['status']):
+                        task.detected.setdefault(job['id'], time.time())
+                task.calls[endpoint] = task.calls.get(endpoint, 0) + 1
+            return response
+
+    return CountingClient(rate_limiter=get_rate_limiter())
+
+
+def run_pipeline(tasks, run_id, current_task, set_task_label):
+    '''Runs every task once all of its upstream tasks succeeded, like Airflow's scheduler would.
+    *set_task_label* attributes each task's NGC calls to it in ngc_metrics.'''
+    by_id = {task.task_id: task for task in tasks}
+    done = {task.task_id: threading.Event() for task in tasks}
+    xcoms = {}
+
+    def run(task):
+        for upstream_id in task.upstream:
+            done[upstream_id].wait()
+        if any(by_id[upstream_id].state != 'success' for upstream_id in task.upstream):
+            task.state = 'upstream_failed'
+            done[task.task_id].set()
+            return
+
+        current_task.task = task
+        set_task_label(task.task_id)
+        task.start = time.time()
+        try:
+            ti = FakeTaskInstance(run_id, task.task_id, xcoms)
+            task.result = xcoms[(task.task_id, 'return_value')] = task.python_callable(ti, **task.op_kwargs)
+            task.state = 'success'
+        except Exception as e:
+            task.state, task.error = 'failed', repr(e)
+        finally:
+            task.end = time.time()
+            current_task.task = None
+            set_task_label(None)
+            done[task.task_id].set()
+
+    threads = [threading.Thread(target=run, args=(task,), daemon=True) for task in tasks]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return start, time.time()
+
+
+def build_profile(tasks, time_scale):
+    '''pipeline_profile.py profile of a harness run, in simulated seconds'''
+    from pipeline_profile import build_profile as build_run_profile
+    records = [{'task_id': task.task_id, 'state': task.state, 'start': task.start, 'end': task.end,
+                'upstream': task.upstream, 'result': task.result} for task in tasks]
+    return build_run_profile(records, time_scale)
+
+
+def build_report(tasks, emulator, run_start, run_end, time_scale):
+    to_sim = lambda seconds: round(seconds / time_scale, 1)
+    report = {'tasks': [], 'api_calls': {}}
+    for task in tasks:
+        detection_lag = 0.0
+        for job_id in task.job_ids:
+            #time between the job finishing on the emulator and the task seeing a terminal status
+            detected = task.detected.get(job_id, task.end)
+            detection_lag += max(0.0, detected - emulator.jobs[job_id]['ended'])
+        for endpoint, count in task.calls.items():
+            report['api_calls'][endpoint] = report['api_calls'].get(endpoint, 0) + count
+        report['tasks'].append({
+            'task_id': task.task_id,
+            'state': task.state,
+            'start': to_sim(task.start - run_start) if task.start else None,
+            'wall_time': to_sim(task.end - task.start) if task.start else None,
+            'jobs': len(task.job_ids),
+            'api_calls': dict(task.calls),
+            'status_polls': task.calls.get('job_status', 0),
+            'detection_lag': to_sim(detection_lag),
+            'error': task.error,
+        })
+    report['wall_time'] = to_sim(run_end - run_start)
+    report['profile'] = build_profile(tasks, time_scale)
+    report['critical_path'] = report['profile']['critical_path']
+    report['total_api_calls'] = sum(report['api_calls'].values())
+    report['total_detection_lag'] = round(sum(task['detection_lag'] for task in report['tasks']), 1)
+    report['emulator_calls'] = emulator.call_counts()
+    return report
+
+
+def print_report(report, title):
+    print(f'\n== {title} ==')
+    print(f"{'task':<52} {'state':<16} {'start':>8} {'wall':>8} {'jobs':>4} {'calls':>5} {'polls':>5} {'lag':>7}")
+    for task in report['tasks']:
+        print(f"{task['task_id']:<52} {task['state'] or '-':<16} {task['start'] or 0:>8} {task['wall_time'] or 0:>8} "
+              f"{task['jobs']:>4} {sum(task['api_calls'].values()):>5} {task['status_polls']:>5} {task['detection_lag']:>7}")
+        if task['error']:
+            print(f"    error: {task['error']}")
+    print(f"pipeline wall time {report['wall_time']} s (simulated), {report['total_api_calls']} API calls "
+          f"{report['api_calls']}, detection lag {report['total_detection_lag']} s")
+    print(f"critical path {report['critical_path']['length']} s: {' -> '.join(report['critical_path']['tasks'])}")
+    print('  ' + ', '.join(f'{phase} {seconds} s' for phase, seconds in report['critical_path']['phases'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', choices=['lora', 'p_tuning', 'sft'], default='lora')
+    parser.add_argument('--interactive', action='store_true', help='take the Triton inference path')
+    parser.add_argument('--time-scale', type=float, default=0.002, help='real seconds per simulated second')
+    parser.add_argument('--queue-time', type=float, default=120, help='simulated ACE queue time per job')
+    parser.add_argument('--job-duration', type=float, default=300, help='simulated run time of unlisted jobs')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added latency of every API call')
+    parser.add_argument('--rerun', action='store_true', help='run the pipeline a second time to measure skip checks')
+    parser.add_argument('--layout', choices=['overlapped', 'serial', 'both'], default='overlapped',
+                        help="task dependencies to run: the DAG's current ones, its earlier serial ones, or both")
+    parser.add_argument('--executor', action='store_true', help='run short stages on a warm executor job')
+    parser.add_argument('--json', help='write the report(s) to this file')
+    parser.add_argument('--profile-dir', help='write each run\'s profile (JSON and HTML Gantt chart) to this directory')
+    args = parser.parse_args()
+
+    outputs = lambda spec: [path.format(nemo_ckpt=NEMO_CKPT) for name in spec['name'].split('__')
+                            for path in JOB_OUTPUTS.get(name, [])]
+    emulator = NGCEmulator(queue_time=args.queue_time, job_duration=args.job_duration, job_durations=JOB_DURATIONS,
+                           failure_rate=args.failure_rate, latency=args.latency_ms / 1000,
+                           time_scale=args.time_scale, outputs=outputs).start()
+
+    #must be set before the pipeline modules are imported
+    os.environ['NGC_API_URL'] = os.environ['NGC_AUTHN_URL'] = emulator.url
+    os.environ['NGC_POLL_TIME_SCALE'] = str(args.time_scale)
+    os.environ['NGC_TOKEN_CACHE_DIR'] = tempfile.mkdtemp(prefix='ngc_harness_tokens_')
+    os.environ.setdefault('NGC_RATE_LIMIT', '0')
+
+    import ngc_client
+    from ngc_metrics import set_task_label, metrics_summary
+    from workspace_index import invalidate_workspace_index
+    current_task = threading.local()
+    ngc_client.set_client(make_counting_client(current_task))
+
+    conf = {'key': 'harness-key', 'org': 'harness-org', 'team': 'harness-team', 'ace': 'harness-ace',
+            'unique_name': 'harness'}
+    reports = {}
+    layouts = ['serial', 'overlapped'] if args.layout == 'both' else [args.layout]
+    for layout in layouts:
+        #each layout starts from empty workspaces so neither benefits from the other's outputs
+        emulator.reset_storage()
+        invalidate_workspace_index()
+        for run in range(2 if args.rerun else 1):
+            tasks = build_pipeline(args.method, args.interactive, conf, layout, args.executor)
+            start, end = run_pipeline(tasks, f'harness_{layout}_run_{run}', current_task, set_task_label)
+            title = f"{args.method}{' interactive' if args.interactive else ''} {layout} run {run + 1}"
+            reports[title] = build_report(tasks, emulator, start, end, args.time_scale)
+            print_report(reports[title], title)
+            if args.profile_dir:
+                from pipeline_profile import write_profile
+                paths = write_profile(reports[title]['profile'], args.profile_dir, title.replace(' ', '_'), title)
+                print(f"profile written to {' and '.join(paths)}")
+
+    if args.layout == 'both':
+        prefix = f"{args.method}{' interactive' if args.interactive else ''}"
+        serial, overlapped = reports[f'{prefix} serial run 1'], reports[f'{prefix} overlapped run 1']
+        reduction = serial['critical_path']['length'] - overlapped['critical_path']['length']
+        print(f"\ncritical path {serial['critical_path']['length']} s -> {overlapped['critical_path']['length']} s "
+              f"({reduction:.1f} s, {100 * reduction / serial['critical_path']['length']:.1f}% shorter); "
+              f"wall time {serial['wall_time']} s -> {overlapped['wall_time']} s")
+
+    #the client's own instrumentation, labelled by task, should agree with the harness' counts
+    print('\nngc_metrics:', {endpoint: entry['calls'] for endpoint, entry in metrics_summary().items()})
+    emulator.stop()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+'''Local emulator of the NGC endpoints used by ngc_requests: authn token, workspaces, listFiles,
+workspace file downloads and uploads, and jobs.
+
+Jobs move through QUEUED -> STARTING -> RUNNING -> FINISHED_SUCCESS/FAILED on a wall-clock
+schedule (configurable queue time, per-job durations and failure rate), every request can be
+delayed by a fixed latency, and each endpoint's calls are counted. When a job succeeds, the files
+it writes are added to its mounted workspaces so skip checks behave like on BCP: by default
+these are the targets of `>`/`>>` redirects, `touch` and `wget -O` under a mount point, plus
+whatever the *outputs* callback returns for the job.
+
+A job whose command runs the warm executor loop (warm_executor.py) is emulated as well: command
+files uploaded to its queue complete one after another while the job runs, each taking the
+duration of the job name in its file name, and `stop` ends the job.
+
+`inject_errors` makes the next calls of an endpoint fail with given HTTP statuses, e.g. a job
+status endpoint that answers 503 for a while.
+
+    emulator = NGCEmulator(queue_time=2, job_duration=5).start()
+    os.environ['NGC_API_URL'] = os.environ['NGC_AUTHN_URL'] = emulator.url
+'''
+
+import re, json, time, base64, random, threading, itertools
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#files written by a job command: redirects, touch and `wget -O`, under a workspace mount point
+_OUTPUT_PATTERN = re.compile(r'(?:>>?|\btouch|-O)\s*(/mount[^\s;&|\'")]*)')
+_STARTING_SECONDS = 1.0
+#command file uploaded to a warm executor queue: <dir>/queue/<sequence>-<job name>.sh
+_EXECUTOR_QUEUE = re.compile(r'^/(.+)/queue/\d+-(.+)\.sh$')
+_EXECUTOR_STOP = re.compile(r'^/(.+)/stop$')
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _fake_jwt(lifetime):
+    claims = json.dumps({'exp': time.time() + lifetime, 'iss': 'ngc-emulator'}).encode('utf-8')
+    return 'eyJhbGciOiJub25lIn0.' + base64.urlsafe_b64encode(claims).decode('utf-8').rstrip('=') + '.emulated'
+
+
+def command_outputs(command):
+    '''Absolute paths a job command writes to, as far as can be told from the command line'''
+    return _OUTPUT_PATTERN.findall(command or '')
+
+
+class NGCEmulator:
+    '''In-process HTTP server that emulates NGC. All times are wall-clock seconds multiplied by
+    *time_scale*, so a harness can run a multi-hour pipeline in seconds.'''
+
+    def __init__(self, queue_time=30, job_duration=60, job_durations=None, failure_rate=0.0, latency=0.0,
+                 time_scale=1.0, outputs=None, page_size_limit=1000, seed=0):
+        self.queue_time = queue_time
+        self.job_duration = job_duration
+        self.job_durations = job_durations or {}
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.time_scale = time_scale
+        self.outputs = outputs
+        self.page_size_limit = page_size_limit
+        #False emulates a job list that ignores the user-labels filter
+        self.filter_labels = True
+        #False emulates an NGC without the workspace file endpoint, which answers 404
+        self.file_endpoint = True
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1000)
+        self.workspaces = {}
+        self.contents = {}
+        self.jobs = {}
+        self.executor_queue = []
+        self.calls = {}
+        self.injected_errors = {}
+        self._server = None
+
+    #lifecycle
+
+    def start(self):
+        emulator = self
+
+        class Handler(_Handler):
+            pass
+        Handler.emulator = emulator
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def call_counts(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def inject_errors(self, endpoint, *statuses):
+        '''Answers the next calls of *endpoint* (only 'job_status' so far) with these HTTP statuses,
+        one per call'''
+        with self._lock:
+            self.injected_errors.setdefault(endpoint, []).extend(statuses)
+
+    def _injected_error(self, endpoint):
+        with self._lock:
+            statuses = self.injected_errors.get(endpoint)
+            return statuses.pop(0) if statuses else None
+
+    #workspaces
+
+    def create_workspace(self, name):
+        with self._lock:
+            workspace_id = f'ws-{next(self._ids)}'
+            self.workspaces[workspace_id] = {'id': workspace_id, 'name': name, 'files': {}}
+            return self.workspaces[workspace_id]
+
+    def find_workspace(self, name_or_id):
+        with self._lock:
+            for workspace in self.workspaces.values():
+                if name_or_id in (workspace['id'], workspace['name']):
+                    return workspace
+        return None
+
+    def add_file(self, workspace_id, path, size=1024, content=None):
+        path = '/' + path.lstrip('/')
+        with self._lock:
+            self.workspaces[workspace_id]['files'][path] = {
+                'name': path.rsplit('/', 1)[-1],
+                'path': path,
+                'size': len(content) if content is not None else size,
+                'lastModified': _iso(time.time()),
+            }
+            if content is not None:
+                self.contents[(workspace_id, path)] = content
+
+    def file_content(self, workspace_id, path):
+        '''Contents of a workspace file: what add_file was given, or zero bytes of its size'''
+        self._advance_executors()
+        path = '/' + path.lstrip('/')
+        with self._lock:
+            item = self.workspaces[workspace_id]['files'].get(path)
+            if item is None:
+                return None
+            return self.contents.get((workspace_id, path), b'\0' * item['size'])
+
+    def put_file(self, workspace_id, path, content):
+        '''Upload of a workspace file; queues commands for (or stops) an emulated warm executor'''
+        path = '/' + path.lstrip('/')
+        self.add_file(workspace_id, path, content=content)
+        queued, stop = _EXECUTOR_QUEUE.match(path), _EXECUTOR_STOP.match(path)
+        now = time.time()
+        with self._lock:
+            if queued:
+                self.executor_queue.append({'workspace_id': workspace_id, 'path': path, 'dir': queued.group(1),
+                                            'job_name': queued.group(2), 'command': content.decode('utf-8'),
+                                            'queued': now, 'done': None})
+            elif stop:
+                for job in self.jobs.values():
+                    if f"{stop.group(1)};" in job['spec'].get('command', '') and job['ended'] > now:
+                        job['ended'] = max(now, job['running'])
+
+    def _executor_job(self, directory):
+        return next((job for job in self.jobs.values() if f'{directory};' in job['spec'].get('command', '')), None)
+
+    def _advance_executors(self):
+        '''Completes queued executor commands whose emulated run time has passed'''
+        now = time.time()
+        with self._lock:
+            queue = list(self.executor_queue)
+        #each executor runs one command at a time, in queue order, once its job is running
+        free_at = {}
+        for item in queue:
+            if item['done'] is not None:
+                free_at[item['dir']] = max(free_at.get(item['dir'], 0), item['done'])
+                continue
+            job = self._executor_job(item['dir'])
+            if job is None:
+                continue
+            duration = sum(self.job_durations.get(name, self.job_duration) for name in item['job_name'].split('__'))
+            finished = max(item['queued'], job['running'], free_at.get(item['dir'], 0)) + duration * self.time_scale
+            free_at[item['dir']] = finished
+            if finished > min(now, job['ended']):
+                continue
+
+            item['done'] = finished
+            failed = self._random.random() < self.failure_rate
+            name = item['path'].rsplit('/', 1)[-1][:-len('.sh')]
+            if not failed:
+                self._write_outputs({'spec': dict(job['spec'], name=item['job_name'], command=item['command'])})
+            self.add_file(item['workspace_id'], f"/{item['dir']}/done/{name}.log", content=b'emulated\n')
+            self.add_file(item['workspace_id'], f"/{item['dir']}/done/{name}.status",
+                          content=b'1\n' if failed else b'0\n')
+
+    def reset_storage(self):
+        '''Forgets every workspace and file, keeping jobs and call counts'''
+        with self._lock:
+            self.workspaces.clear()
+            self.contents.clear()
+
+    def list_files(self, workspace_id, page_size, page_token, path):
+        self._advance_executors()
+        with self._lock:
+            files = sorted(self.workspaces[workspace_id]['files'].values(), key=lambda item: item['path'])
+        if path:
+            files = [item for item in files if item['path'].lstrip('/').startswith(path.lstrip('/'))]
+        start = int(page_token or 0)
+        page_size = min(page_size, self.page_size_limit)
+        page = {'storageObjects': files[start:start + page_size]}
+        if start + page_size < len(files):
+            page['nextPageToken'] = str(start + page_size)
+        return page
+
+    #jobs
+
+    def submit_job(self, spec):
+        now = time.time()
+        #a fused job (stage job names joined by `__`, see stage_fusion.py) runs its stages back to back
+        duration = sum(self.job_durations.get(name, self.job_duration) for name in spec['name'].split('__'))
+        with self._lock:
+            job_id = next(self._ids)
+            failed = self._random.random() < self.failure_rate
+            self.jobs[job_id] = {
+                'id': job_id,
+                'spec': spec,
+                'submitted': now,
+                'started': now + self.queue_time * self.time_scale,
+                'running': now + (self.queue_time + _STARTING_SECONDS) * self.time_scale,
+                'ended': now + (self.queue_time + _STARTING_SECONDS + duration) * self.time_scale,
+                'final_status': 'FAILED' if failed else 'FINISHED_SUCCESS',
+                'outputs_written': False,
+            }
+        return self.job_view(job_id)
+
+    def _job_status(self, job, now):
+        if now < job['started']:
+            return 'QUEUED'
+        if now < job['running']:
+            return 'STARTING'
+        if now < job['ended']:
+            return 'RUNNING'
+        return job['final_status']
+
+    def _status_history(self, job, now):
+        history = [('CREATED', job['submitted']), ('QUEUED', job['submitted']), ('STARTING', job['started']),
+                   ('RUNNING', job['running']), (job['final_status'], job['ended'])]
+        return [{'status': status, 'statusChangeTime': _iso(changed)} for status, changed in history if changed <= now]
+
+    def _write_outputs(self, job):
+        spec = job['spec']
+        mounts = {mount['containerMountPoint'].rstrip('/'): mount['id'] for mount in spec.get('workspaceMounts', [])}
+        paths = command_outputs(spec.get('command'))
+        if self.outputs:
+            paths += list(self.outputs(spec))
+        for output in paths:
+            #*outputs* may give (path, content) pairs for files a later task reads
+            path, content = output if isinstance(output, tuple) else (output, None)
+            for mount_point, workspace_id in mounts.items():
+                if path.startswith(mount_point + '/'):
+                    self.add_file(workspace_id, path[len(mount_point):], content=content)
+        job['outputs_written'] = True
+
+    def job_view(self, job_id):
+        now = time.time()
+        job = self.jobs[job_id]
+        job_status = self._job_status(job, now)
+        if job_status == 'FINISHED_SUCCESS' and not job['outputs_written']:
+            self._write_outputs(job)
+        return {
+            'id': job_id,
+            'jobDefinition': job['spec'],
+            'jobStatus': {'status': job_status, 'statusType': 'OK'},
+            'jobStatusHistory': self._status_history(job, now),
+        }
+
+    def list_jobs(self, label=None, page_size=100, page_token=None):
+        with self._lock:
+            job_ids = sorted(self.jobs, reverse=True)
+        jobs = [self.job_view(job_id) for job_id in job_ids]
+        if label and self.filter_labels:
+            jobs = [job for job in jobs if label in job['jobDefinition'].get('userLabels', [])]
+        start = int(page_token or 0)
+        page_size = min(page_size, self.page_size_limit)
+        page = {'jobs': jobs[start:start + page_size]}
+        if start + page_size < len(jobs):
+            page['nextPageToken'] = str(start + page_size)
+        return page
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    emulator = None
+
+    _WORKSPACES = re.compile(r'^/v2/org/[^/]+/workspaces/?$')
+    _WORKSPACE = re.compile(r'^/v2/org/[^/]+/workspaces/([^/]+)$')
+    _LIST_FILES = re.compile(r'^/v2/org/[^/]+/workspaces/([^/]+)/listFiles$')
+    _WORKSPACE_FILE = re.compile(r'^/v2/org/[^/]+/workspaces/([^/]+)/file/(.+)$')
+    _JOBS = re.compile(r'^/v2/org/[^/]+(?:/team/[^/]+)?/jobs/?$')
+    _JOB = re.compile(r'^/v2/org/[^/]+(?:/team/[^/]+)?/jobs/(\d+)$')
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, endpoint, status, body):
+        self.emulator._count(endpoint)
+        if self.emulator.latency:
+            time.sleep(self.emulator.latency)
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _reply_bytes(self, endpoint, payload):
+        self.emulator._count(endpoint)
+        if self.emulator.latency:
+            time.sleep(self.emulator.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        emulator = self.emulator
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/token':
+            return self._reply('token', 200, {'token': _fake_jwt(3600)})
+
+        match = self._LIST_FILES.match(url.path)
+        if match:
+            if not emulator.find_workspace(match.group(1)):
+                return self._reply('list_files', 404, {'requestStatus': {'statusCode': 'NOT_FOUND'}})
+            page = emulator.list_files(match.group(1), int(query.get('page-size', 25)),
+                                       query.get('page-token'), query.get('path'))
+            return self._reply('list_files', 200, page)
+
+        match = self._WORKSPACE_FILE.match(url.path)
+        if match:
+            workspace = emulator.find_workspace(match.group(1)) if emulator.file_endpoint else None
+            content = emulator.file_content(workspace['id'], match.group(2)) if workspace else None
+            if content is None:
+                return self._reply('get_workspace_file', 404, {'requestStatus': {'statusCode': 'NOT_FOUND'}})
+            return self._reply_bytes('get_workspace_file', content)
+
+        match = self._WORKSPACE.match(url.path)
+        if match:
+            workspace = emulator.find_workspace(match.group(1))
+            if workspace is None:
+                return self._reply('get_workspace', 404, {'requestStatus': {'statusCode': 'NOT_FOUND'}})
+            return self._reply('get_workspace', 200, {
+                'workspace': {'id': workspace['id'], 'name': workspace['name']},
+                'requestStatus': {'statusCode': 'SUCCESS'},
+            })
+
+        match = self._JOB.match(url.path)
+        if match:
+            job_id = int(match.group(1))
+            error = emulator._injected_error('job_status')
+            if error:
+                return self._reply('job_status', error, {'requestStatus': {'statusCode': 'UNAVAILABLE'}})
+            if job_id not in emulator.jobs:
+                return self._reply('job_status', 404, {'requestStatus': {'statusCode': 'NOT_FOUND'}})
+            return self._reply('job_status', 200, {'job': emulator.job_view(job_id)})
+
+        if self._JOBS.match(url.path):
+            return self._reply('list_jobs', 200, emulator.list_jobs(query.get('user-labels'),
+                                                                    int(query.get('page-size', 100)),
+                                                                    query.get('page-token')))
+
+        self._reply('unknown', 404, {'requestStatus': {'statusCode': 'NOT_FOUND'}})
+
+    def do_PUT(self):
+        emulator = self.emulator
+        match = self._WORKSPACE_FILE.match(urlparse(self.path).path)
+        workspace = emulator.find_workspace(match.group(1)) if match and emulator.file_endpoint else None
+        if workspace is None:
+            return self._reply('put_workspace_file', 404, {'requestStatus': {'statusCode': 'NOT_FOUND'}})
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        emulator.put_file(workspace['id'], match.group(2), content)
+        return self._reply('put_workspace_file', 200, {'requestStatus': {'statusCode': 'SUCCESS'}})
+
+    def do_POST(self):
+        emulator = self.emulator
+        path = urlparse(self.path).path
+
+        if self._WORKSPACES.match(path):
+            workspace = emulator.create_workspace(self._body()['name'])
+            return self._reply('create_workspace', 200, {
+                'workspace': {'id': workspace['id'], 'name': workspace['name']},
+                'requestStatus': {'statusCode': 'SUCCESS'},
+            })
+
+        if self._JOBS.match(path):
+            return self._reply('submit_job', 200, {'job': emulator.submit_job(self._body())})
+
+        self._reply('unknown', 404, {'requestStatus': {'statusCode': 'NOT_FOUND'}})
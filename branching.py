@@ -23,9 +23,11 @@ def choose_tuning_method(ti, method):
 def choose_inference(ti, interactive, method):
     '''Branching decision for selecting inference strategy to run on tuned model in Airflow'''
     
+    interactive = str(interactive) == 'True' #templated op_kwargs arrive as 'True'/'False'
     if method == 'lora':
+        #LoRA weights are merged by the model repository task, in the same job as the conversion
         if interactive:
-            return 'triton_inference.merge_lora_adapter_weights'
+            return 'triton_inference.create_triton_model_repository'
         else:
             return 'nemo_script_inference.LoRA_inference_script'
     elif method == 'p_tuning':
@@ -0,0 +1,44 @@
+'''Collects the results of tuning methods that ran side by side in one DAG run'''
+
+from squad_eval import get_squad_metrics
+from job_result import JobResult
+
+
+def compare_tuning_methods(ti, ngc_api_key, org, methods):
+    '''Builds one comparison record from the task group of each tuning method: its SQuAD exact_match
+    and F1 scores, the wall-clock time from its first task starting to its last task ending, and
+    the status of its metric evaluation. A method counts as succeeded only if squad_metric_eval
+    returned a successful JobResult: a task whose NGC job failed can still end in Airflow state
+    success, and the metrics file of a failed method may be left over from an earlier run. The
+    record is returned to XCom and printed.'''
+
+    task_instances = ti.get_dagrun().get_task_instances()
+    comparison = {}
+    for method in methods:
+        group = [task_instance for task_instance in task_instances if task_instance.task_id.startswith(f'{method}.')]
+        starts = [task_instance.start_date for task_instance in group if task_instance.start_date]
+        ends = [task_instance.end_date for task_instance in group if task_instance.end_date]
+        evaluation = ti.xcom_pull(task_ids=f'{method}.squad_metric_eval')
+        succeeded = isinstance(evaluation, JobResult) and evaluation.succeeded
+
+        workspace_id = ti.xcom_pull(task_ids=f'{method}.create_tuning_workspace')
+        metrics = get_squad_metrics(ngc_api_key, org, workspace_id, method) if workspace_id and succeeded else None
+
+        comparison[method] = {
+            'state': 'success' if succeeded else 'failed',
+            'eval_status': evaluation.status if isinstance(evaluation, JobResult) else None,
+            'exact_match': (metrics or {}).get('exact_match'),
+            'f1': (metrics or {}).get('f1'),
+            'wall_clock_seconds': (max(ends) - min(starts)).total_seconds() if starts and ends else None,
+        }
+
+    print(f"{'method':<10} {'state':<8} {'exact_match':>12} {'f1':>8} {'wall clock (h)':>15}")
+    for method, result in comparison.items():
+        hours = result['wall_clock_seconds'] / 3600 if result['wall_clock_seconds'] is not None else None
+        print(f"{method:<10} {result['state']:<8} {_format(result['exact_match']):>12} {_format(result['f1']):>8} "
+              f"{_format(hours):>15}")
+    return comparison
+
+
+def _format(value):
+    return '-' if value is None else f'{value:.2f}'
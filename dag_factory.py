@@ -0,0 +1,328 @@
+'''Generates one lean NeMo workflow DAG per model profile and tuning method from dag_profiles.yaml.
+
+Where nemo_workflow_dag.py wires every branch into a single DAG and picks one at runtime, each
+generated DAG holds only the tasks its profile needs: no branching operators, no pretraining path
+and only the chosen inference path. Different profiles and methods run as separate, concurrent
+DAGs, each tuning in its own workspace; the GPT workspace holding the checkpoints is shared.
+
+Profiles with `compare: true` also get a NeMo_<profile>_compare DAG that runs all of their tuning
+methods side by side in one run and ends with a task comparing their scores and wall-clock times.
+Profiles with a `sweep` section get NeMo_<profile>_lora_sweep, a mapped LoRA hyperparameter sweep.
+Profiles with `warm_executor: true` (or a mapping of start_executor settings such as idle_timeout)
+run the short stages of their per-method DAGs on one long-lived executor job, see warm_executor.py.
+The executor holds an instance while idle: by default it exits during training, so only stages
+a few minutes apart share it; a longer idle_timeout trades an idle instance for a warm evaluation.
+Profiles with `profile_report: true` end every DAG with a task writing the run's critical-path
+profile and Gantt chart, see pipeline_profile.py. Profiles with `token_cache: true` also tokenize
+the preprocessed SQuAD files into memory-mapped caches in the tuning workspace, see token_cache.py.
+Profiles with `packed_sequence` train LoRA and SFT on the SQuAD training set packed into sequences
+of that many tokens, see sequence_packing.py.
+
+The catalogue is read from the file next to this one, or from NEMO_DAG_PROFILES (YAML or JSON).
+'''
+
+import os, json
+from datetime import datetime
+from airflow import DAG
+from airflow.utils.task_group import TaskGroup
+from airflow.utils.trigger_rule import TriggerRule
+from airflow.operators.python import PythonOperator
+
+from dag_settings import key_, org_, team_, ace_, unique_name_, gpt_workspace_name
+from task_workspace import create_task_workspace, name_tuning_workspace
+from nemo_checkpoint import download_nemo_checkpoint, CHECKPOINT_URL
+from download_squad import get_squad_dataset
+from p_tuning import plan_p_tuning_training, plan_p_tuning_inference
+from lora import plan_lora_training, plan_lora_inference, lora_training_bcp
+from sft import plan_sft_training, plan_sft_inference
+from ngc_operator import NGCStageOperator
+from triton import create_triton_model_repository, launch_triton_server
+from squad_eval import squad_metric_eval
+from compare_methods import compare_tuning_methods
+from sweep import sweep_points, summarize_sweep
+from warm_executor import start_executor, stop_executor, EXECUTOR_TASK_ID
+from pipeline_profile import profile_pipeline
+
+PROFILES_PATH = os.environ.get('NEMO_DAG_PROFILES',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dag_profiles.yaml'))
+
+#training and script inference task of each tuning method, and the callable planning its stage;
+#these jobs run for hours, so they are NGCStageOperator tasks watched by the triggerer
+TUNING_TASKS = {
+    'lora': (('LoRA_train', plan_lora_training), ('LoRA_inference_script', plan_lora_inference)),
+    'p_tuning': (('p_tuning_train', plan_p_tuning_training), ('p_tuning_inference_script', plan_p_tuning_inference)),
+    'sft': (('SFT_train', plan_sft_training), ('SFT_inference_script', plan_sft_inference)),
+}
+
+PROFILE_DEFAULTS = {
+    'checkpoint_url': CHECKPOINT_URL,
+    'tensor_parallel': 2,
+    'pipeline_parallel': 1,
+    'ace_instance': 'dgxa100.80g.2.norm',
+    'tuning_methods': ['lora'],
+    'interactive': False,
+    'compare': False,
+    'sweep': None,
+    'warm_executor': False,
+    'profile_report': False,
+    'token_cache': False,
+    'packed_sequence': False,
+}
+
+#sequence length of `packed_sequence: true`
+PACKED_SEQ_LENGTH = 2048
+
+#tuning methods that train on the SFT-format dataset, and so can train on it packed
+PACKED_METHODS = ('lora', 'sft')
+
+
+def load_profiles(path=PROFILES_PATH):
+    '''Reads the profile catalogue: {profile name: settings}, with defaults filled in'''
+    with open(path) as f:
+        if path.endswith('.json'):
+            catalogue = json.load(f)
+        else:
+            import yaml
+            catalogue = yaml.safe_load(f)
+
+    profiles = {}
+    for name, settings in (catalogue.get('profiles') or {}).items():
+        profile = dict(PROFILE_DEFAULTS, **settings)
+        if 'nemo_ckpt' not in profile:
+            raise ValueError(f'Profile {name} does not name a .nemo checkpoint (nemo_ckpt)')
+        unknown = set(profile['tuning_methods']) - set(TUNING_TASKS)
+        if unknown:
+            raise ValueError(f'Profile {name} has unknown tuning methods {sorted(unknown)}')
+        if profile['packed_sequence'] is True:
+            profile['packed_sequence'] = PACKED_SEQ_LENGTH
+        profiles[name] = profile
+    return profiles
+
+
+def model_kwargs(profile):
+    '''op_kwargs of the tasks that launch GPU jobs for the profile's model'''
+    return {"ngc_api_key": key_, "org": org_, "ace": ace_, "team": team_, "ace_instance": profile['ace_instance'],
+            "tensor_parallel": profile['tensor_parallel'], "pipeline_parallel": profile['pipeline_parallel']}
+
+
+def add_dataset_tasks(profile_name, profile, method, workspace_suffix=''):
+    '''Adds the tuning workspace and SQuAD download tasks for *method*; returns both'''
+    ngc = {"ngc_api_key": key_, "org": org_, "ace": ace_}
+    tuning_workspace_name = f'{name_tuning_workspace(method, unique_name_)}_{profile_name}{workspace_suffix}'
+
+    create_tuning_workspace_task = PythonOperator(
+            task_id = 'create_tuning_workspace',
+            python_callable= create_task_workspace,
+            op_kwargs= dict(ngc, workspace_name=tuning_workspace_name))
+
+    download_squad_task = PythonOperator(
+            task_id = 'download_squad_dataset',
+            python_callable= get_squad_dataset,
+            op_kwargs= dict(ngc, team=team_, tuning_method=method, token_cache=profile['token_cache'],
+                            packed_sequence=profile['packed_sequence']))
+
+    create_tuning_workspace_task >> download_squad_task
+    return create_tuning_workspace_task, download_squad_task
+
+
+def add_tuning_tasks(profile_name, profile, method, interactive, workspace_suffix=''):
+    '''Adds the tasks that tune the profile's checkpoint with *method* and run its inference path to the
+    current DAG or task group. Returns the tuning workspace task, the training task (the first one
+    that needs the base checkpoint, so the checkpoint download should join it) and the last task.'''
+    with_team = {"ngc_api_key": key_, "org": org_, "ace": ace_, "team": team_}
+    model = model_kwargs(profile)
+    (train_task_id, train_callable), (inference_task_id, inference_callable) = TUNING_TASKS[method]
+    create_tuning_workspace_task, download_squad_task = add_dataset_tasks(profile_name, profile, method,
+                                                                          workspace_suffix)
+
+    train_task = NGCStageOperator(
+            task_id = train_task_id,
+            python_callable= train_callable,
+            op_kwargs= dict(model, packed_sequence=profile['packed_sequence']) if method in PACKED_METHODS else model)
+
+    download_squad_task >> train_task
+
+    if interactive:
+        #for LoRA this also merges the adapter weights, fused into the same NGC job as the conversion
+        create_triton_model_repo_task = PythonOperator(
+                task_id = 'create_triton_model_repository',
+                python_callable= create_triton_model_repository,
+                op_kwargs= dict(model, method=method))
+
+        launch_triton_task = PythonOperator(
+                task_id = 'launch_triton_server',
+                python_callable= launch_triton_server,
+                op_kwargs= dict(model, method=method))
+
+        train_task >> create_triton_model_repo_task >> launch_triton_task
+        return create_tuning_workspace_task, train_task, launch_triton_task
+
+    inference_task = NGCStageOperator(
+            task_id = inference_task_id,
+            python_callable= inference_callable,
+            op_kwargs= model)
+
+    squad_eval_task = PythonOperator(
+            task_id = 'squad_metric_eval',
+            python_callable= squad_metric_eval,
+            op_kwargs= dict(with_team, tuning_method=method))
+
+    train_task >> inference_task >> squad_eval_task
+    return create_tuning_workspace_task, train_task, squad_eval_task
+
+
+def add_checkpoint_tasks(profile):
+    '''Adds the GPT workspace and checkpoint download tasks; returns the download task'''
+    ngc = {"ngc_api_key": key_, "org": org_, "ace": ace_}
+
+    create_gpt_workspace_task = PythonOperator(
+            task_id = 'create_gpt_workspace',
+            python_callable= create_task_workspace,
+            op_kwargs= dict(ngc, workspace_name=gpt_workspace_name))
+
+    download_checkpoint_task = PythonOperator(
+            task_id = 'download_nemo_checkpoint',
+            python_callable= download_nemo_checkpoint,
+            op_kwargs= dict(ngc, team=team_, nemo_ckpt_file=profile['nemo_ckpt'],
+                            checkpoint_url=profile['checkpoint_url']))
+
+    create_gpt_workspace_task >> download_checkpoint_task
+    return download_checkpoint_task
+
+
+def add_profile_task(dag, profile):
+    '''Ends *dag* with a task profiling the run, if the profile asks for it. It runs whatever
+    state the other tasks end in, since failed runs are the ones worth looking at.'''
+    if not profile['profile_report']:
+        return
+    leaves = dag.leaves
+    profile_task = PythonOperator(
+            task_id = 'profile_pipeline',
+            python_callable= profile_pipeline,
+            trigger_rule=TriggerRule.ALL_DONE)
+    leaves >> profile_task
+
+
+def build_dag(profile_name, profile, method):
+    '''DAG that tunes the profile's checkpoint with *method* and runs its inference path'''
+    with DAG(
+             f"NeMo_{profile_name}_{method}",
+             schedule_interval='@once',
+             start_date=datetime(2022, 1, 1),
+             catchup=False,
+             tags=['nemo', profile_name, method]
+        ) as dag:
+
+        download_checkpoint_task = add_checkpoint_tasks(profile)
+        create_tuning_workspace_task, train_task, last_task = add_tuning_tasks(profile_name, profile, method,
+                                                                               profile['interactive'])
+        download_checkpoint_task >> train_task
+
+        if profile['warm_executor']:
+            executor_settings = profile['warm_executor'] if isinstance(profile['warm_executor'], dict) else {}
+            start_executor_task = PythonOperator(
+                    task_id = EXECUTOR_TASK_ID,
+                    python_callable= start_executor,
+                    op_kwargs= {"ngc_api_key": key_, "org": org_, "ace": ace_, "team": team_,
+                                "eval_method": None if profile['interactive'] else method, **executor_settings})
+
+            stop_executor_task = PythonOperator(
+                    task_id = 'stop_warm_executor',
+                    python_callable= stop_executor,
+                    op_kwargs= {"ngc_api_key": key_, "org": org_},
+                    trigger_rule=TriggerRule.ALL_DONE)
+
+            #the dataset stages wait for the executor job to be submitted, not for it to start
+            [dag.get_task('create_gpt_workspace'), create_tuning_workspace_task] >> start_executor_task
+            start_executor_task >> dag.get_task('download_squad_dataset')
+            last_task >> stop_executor_task
+
+        add_profile_task(dag, profile)
+
+    return dag
+
+
+def build_compare_dag(profile_name, profile):
+    '''DAG that tunes the profile's checkpoint with all of its methods at once, one task group and
+    one tuning workspace per method, then compares their SQuAD scores and wall-clock times'''
+    methods = profile['tuning_methods']
+    with DAG(
+             f"NeMo_{profile_name}_compare",
+             schedule_interval='@once',
+             start_date=datetime(2022, 1, 1),
+             catchup=False,
+             tags=['nemo', profile_name, 'compare']
+        ) as dag:
+
+        download_checkpoint_task = add_checkpoint_tasks(profile)
+
+        last_tasks = []
+        for method in methods:
+            with TaskGroup(group_id=method):
+                _, train_task, squad_eval_task = add_tuning_tasks(profile_name, profile, method, interactive=False,
+                                                                  workspace_suffix='_compare')
+            download_checkpoint_task >> train_task
+            last_tasks.append(squad_eval_task)
+
+        compare_task = PythonOperator(
+                task_id = 'compare_tuning_methods',
+                python_callable= compare_tuning_methods,
+                op_kwargs= {"ngc_api_key": key_, "org": org_, "methods": methods},
+                trigger_rule=TriggerRule.ALL_DONE)
+
+        last_tasks >> compare_task
+        add_profile_task(dag, profile)
+
+    return dag
+
+
+def build_sweep_dag(profile_name, profile):
+    '''DAG that trains one LoRA model per point of the profile's sweep through dynamic task mapping,
+    then ranks the points. Concurrent training jobs are capped by the sweep's Airflow pool, which is
+    sized in GPUs: each job takes TP x PP slots. The training tasks wait for their jobs in the task
+    process rather than deferring, so they keep their slots (and a worker slot) until the job ends.
+    The pool is not created here; see dag_profiles.yaml.'''
+    sweep = profile['sweep']
+    points = sweep_points(sweep)
+    with DAG(
+             f"NeMo_{profile_name}_lora_sweep",
+             schedule_interval='@once',
+             start_date=datetime(2022, 1, 1),
+             catchup=False,
+             tags=['nemo', profile_name, 'lora', 'sweep']
+        ) as dag:
+
+        download_checkpoint_task = add_checkpoint_tasks(profile)
+        _, download_squad_task = add_dataset_tasks(profile_name, profile, 'lora', '_sweep')
+
+        #a blocking task: a deferred task hands its pool slot back, which would let every point run at once
+        train_task = PythonOperator.partial(
+                task_id = 'LoRA_sweep_train',
+                python_callable= lora_training_bcp,
+                pool= sweep.get('pool', 'ngc_gpu_jobs'),
+                pool_slots= profile['tensor_parallel'] * profile['pipeline_parallel'],
+            ).expand(op_kwargs=[dict(model_kwargs(profile), hparams=point, packed_sequence=profile['packed_sequence'])
+                                for point in points])
+
+        summarize_task = PythonOperator(
+                task_id = 'summarize_sweep',
+                python_callable= summarize_sweep,
+                op_kwargs= {"ngc_api_key": key_, "org": org_, "points": points},
+                trigger_rule=TriggerRule.ALL_DONE)
+
+        [download_checkpoint_task, download_squad_task] >> train_task >> summarize_task
+        add_profile_task(dag, profile)
+
+    return dag
+
+
+for _profile_name, _profile in load_profiles().items():
+    for _method in _profile['tuning_methods']:
+        _dag = build_dag(_profile_name, _profile, _method)
+        globals()[_dag.dag_id] = _dag
+    if _profile['compare']:
+        _dag = build_compare_dag(_profile_name, _profile)
+        globals()[_dag.dag_id] = _dag
+    if _profile['sweep']:
+        _dag = build_sweep_dag(_profile_name, _profile)
+        globals()[_dag.dag_id] = _dag
@@ -0,0 +1,31 @@
+'''Settings shared by the NeMo DAG files, as Jinja templates for templated operator fields.
+
+Variables from the Airflow UI are resolved when each task is rendered, not when the scheduler
+parses a DAG file: a value in the run's conf takes precedence over the JSON Airflow Variable.'''
+
+
+def setting(name):
+    '''Jinja expression for setting *name*: dag_run.conf first, then the JSON Airflow Variable'''
+    return f'((dag_run.conf or {{}})["{name}"] if "{name}" in (dag_run.conf or {{}}) else var.json.{name})'
+
+
+def template(expression):
+    return '{{ ' + expression + ' }}'
+
+
+key_ = template(setting("key_v"))
+org_ = template(setting("org_v"))
+team_ = template(setting("team_v"))
+ace_ = template(setting("ace_v"))
+nemo_ckpt_ = template(setting("nemo_ckpt_v"))
+pretrain_decision_ = template(setting("pretrain_decision_v"))
+tuning_method_ = template(setting("tuning_method_v"))
+interactive_ = template(setting("interactive_inference_v")) #rendered as 'True'/'False'
+unique_name_ = template(setting("unique_name_v"))
+#only read from the run's conf, e.g. {"prepare_pile_only_v": true}: prepare The Pile although GPT pretraining
+#is not implemented yet (see pretrain_gpt.py)
+prepare_pile_only_ = template('(dag_run.conf or {}).get("prepare_pile_only_v", False)')
+
+#name_tuning_workspace has to be registered as a user-defined macro of the DAG
+tuning_workspace_name = template(f'name_tuning_workspace({setting("tuning_method_v")}, {setting("unique_name_v")})')
+gpt_workspace_name = f"airflow_gpt_nemo_workspace_{unique_name_}"
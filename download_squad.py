@@ -1,9 +1,32 @@
-import time
-from ngc_requests import ngc_job_request, wait_for_job_completion, find_file_in_workspace
+from stage_manifest import plan_stage, run_stages
+from task_workspace import get_workspace_id
+from job_bundle import bundled_command
+from squad_preprocess import output_files, TRAIN_FILE, DEV_FILE, CHECKSUM_FILE
 
+SQUAD_DIR = 'SQuAD/v1.1'
+SQUAD_FILES = output_files()
+#directory of the tokenized SQuAD caches, relative to SQUAD_DIR
+TOKEN_CACHE_DIR = 'token_cache'
+#repository files the tokenizing stages ship into their jobs (see job_bundle.py)
+TOKENIZER_FILES = ['token_cache.py', 'triton_inference/utils/__init__.py', 'triton_inference/utils/tokenizer.py']
 
-def download(ti, ngc_api_key, org, ace, team, workspace_id):
-    '''Launch a job on BCP to download the SQuAD dataset (v1.1) using the NeMo Framework Training container'''
+
+def packed_squad_file(max_seq_length):
+    '''Workspace path of squad_train.jsonl packed into sequences of *max_seq_length* tokens'''
+    return f'{SQUAD_DIR}/packed/squad_train_packed_{max_seq_length}.npy'
+
+def packed_global_batch_size(max_seq_length, global_batch_size, mount='/mount/tuning_workspace'):
+    '''Shell expression for the global batch size, in packed sequences, holding about as many examples
+    as *global_batch_size* unpacked ones. The training job evaluates it from the packing statistics
+    `plan_packing` left next to the packed file in the workspace mounted at *mount*.'''
+    from sequence_packing import metadata_path
+
+    metadata = f'{mount}/{metadata_path(packed_squad_file(max_seq_length))}'
+    return f"$(python3 -c \"import json; print(max(1, round({global_batch_size} / \
+json.load(open('{metadata}'))['examples_per_sequence'])))\")"
+
+def plan_download(ti, ngc_api_key, org, ace, workspace_id):
+    '''Plan a job on BCP to download the SQuAD dataset (v1.1) using the NeMo Framework Training container'''
     
     #ngc job parameters
     job_name = "airflow_download_squad"
@@ -21,68 +44,81 @@ def download(ti, ngc_api_key, org, ace, team, workspace_id):
     job_command = "python3 -c \"from nemo_launcher.utils.data_utils.prepare_squad import prepare_squad_for_fine_tuning; \
                 prepare_squad_for_fine_tuning( '/mount/tuning_workspace/SQuAD')\""
     
-    #send ngc job request
-    job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                    replica_count, workspaces, job_command, team=team)
+    #skipped when the raw dataset is already in the workspace
+    return plan_stage(ti, ngc_api_key, org, 'squad_download', workspace_id, job_name, ace_instance, \
+                      ace_name, docker_image, replica_count, workspaces, job_command, wait_time=60, \
+                      outputs=[f'{SQUAD_DIR}/{TRAIN_FILE}', f'{SQUAD_DIR}/{DEV_FILE}'])
 
-    #wait for job to complete on BCP before allowing airflow to "finish" task
-    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=60, team=team)
+def _plan_squad_job(ti, ngc_api_key, org, ace, workspace_id, stage, job_name, job_command, inputs, outputs):
+    '''Plans a stage in the container of `plan_download`, so consecutive SQuAD stages fuse into its job'''
+    workspaces=[{'id': workspace_id, 'mount': '/mount/tuning_workspace'}]
+    return plan_stage(ti, ngc_api_key, org, stage, workspace_id, job_name, "dgxa100.80g.1.norm", ace, \
+                      f"{org}/nemofw-training:23.07-py3", 1, workspaces, job_command, wait_time=60, \
+                      inputs=inputs, outputs=outputs)
 
-    return job_response
+def plan_preprocess(ti, ngc_api_key, org, ace, workspace_id, tuning_method, download_hash):
+    '''Plans preprocessing the SQuAD dataset (v1.1) into train, test, and val files, with their checksums,
+    by running the vendored preprocessor (squad_preprocess.py) in a job that mounts the workspace'''
 
-def preprocess(ti, ngc_api_key, org, ace, team, workspace_id, tuning_method):
-    '''Launch a job on BCP to preprocess the SQuAD dataset (v1.1) into
-     train, test, and val files using the NeMo Framework Training container'''
-
-    #ngc job parameters
-    job_name = "airflow_preprocess_squad"
-    ace_instance = "dgxa100.80g.1.norm"
-    ace_name = ace
-    docker_image = f"{org}/nemofw-training:23.07-py3"
-    replica_count = 1
-    workspaces=[
-        {
-            'id': workspace_id, 
-            'mount': '/mount/tuning_workspace'
-        }
-    ]
-    
     #preprocess files according to sft/lora (same) or p-tuning format
-    if tuning_method.lower() in ['sft', 'lora']:
-        job_command = "wget --directory-prefix=/mount/tuning_workspace https://raw.githubusercontent.com/NVIDIA/NeMo/main/scripts/dataset_processing/nlp/squad/prompt_learning_squad_preprocessing.py; \
-                python3 /mount/tuning_workspace/prompt_learning_squad_preprocessing.py --sft-format --data-dir /mount/tuning_workspace/SQuAD/v1.1"
-    else: 
-        #format for p-tuning
-        job_command = "wget --directory-prefix=/mount/tuning_workspace https://raw.githubusercontent.com/NVIDIA/NeMo/main/scripts/dataset_processing/nlp/squad/prompt_learning_squad_preprocessing.py; \
-                python3 /mount/tuning_workspace/prompt_learning_squad_preprocessing.py --data-dir /mount/tuning_workspace/SQuAD/v1.1"
-    
-    #send ngc job request
-    job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                    replica_count, workspaces, job_command, team=team)
+    sft_format = tuning_method.lower() in ['sft', 'lora']
+    job_command = bundled_command(['squad_preprocess.py'], 'squad_preprocess.py', \
+                                  f"--data-dir /mount/tuning_workspace/{SQUAD_DIR}{' --sft-format' if sft_format else ''}")
+
+    #skipped when the files were already preprocessed from the same download in the same format
+    return _plan_squad_job(ti, ngc_api_key, org, ace, workspace_id, 'squad_preprocess', 'airflow_preprocess_squad', \
+                           job_command, inputs={'download': download_hash}, \
+                           outputs=[f'{SQUAD_DIR}/{squad_file}' for squad_file in SQUAD_FILES + [CHECKSUM_FILE]])
+
+def plan_token_cache(ti, ngc_api_key, org, ace, workspace_id, preprocess_hash):
+    '''Plans tokenizing the preprocessed SQuAD files once with the GPT2 BPE tokenizer into memory-mapped
+    caches (see token_cache.py) under SQuAD/v1.1/token_cache/<key>/ of the workspace. The key comes
+    from the tokenizer's hash and the file's content, so a file whose cache is already there is not
+    tokenized again even when the stage reruns.'''
+    from token_cache import INDEX_FILE
+
+    cache_root = f'/mount/tuning_workspace/{SQUAD_DIR}/{TOKEN_CACHE_DIR}'
+    inputs = ' '.join(f'/mount/tuning_workspace/{SQUAD_DIR}/{squad_file}' for squad_file in SQUAD_FILES)
+    job_command = bundled_command(TOKENIZER_FILES, 'token_cache.py', f'--input {inputs} --cache-root {cache_root}')
+    return _plan_squad_job(ti, ngc_api_key, org, ace, workspace_id, 'squad_token_cache', 'airflow_cache_squad_tokens', \
+                           job_command, inputs={'preprocess': preprocess_hash}, \
+                           outputs=[f'{SQUAD_DIR}/{TOKEN_CACHE_DIR}/{INDEX_FILE}'])
 
-    #wait for job to complete on BCP before allowing airflow to "finish" task
-    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=60, team=team)
+def plan_packing(ti, ngc_api_key, org, ace, workspace_id, max_seq_length, preprocess_hash):
+    '''Plans packing the SFT-format squad_train.jsonl into sequences of *max_seq_length* tokens (see
+    sequence_packing.py) under SQuAD/v1.1/packed/ of the workspace, for training with `packed_sequence`
+    on. The packing statistics are written next to the packed file.'''
+    from sequence_packing import metadata_path
 
-    return job_response
+    packed = packed_squad_file(max_seq_length)
+    job_command = f"mkdir -p /mount/tuning_workspace/{SQUAD_DIR}/packed && " + \
+                  bundled_command(['sequence_packing.py'] + TOKENIZER_FILES, 'sequence_packing.py', \
+                                  f'--input /mount/tuning_workspace/{SQUAD_DIR}/squad_train.jsonl '
+                                  f'--output /mount/tuning_workspace/{packed} --max-seq-length {max_seq_length}')
 
-def get_squad_dataset(ti, ngc_api_key, org, ace, team, tuning_method):
+    #skipped when the same training file was already packed to the same length
+    return _plan_squad_job(ti, ngc_api_key, org, ace, workspace_id, 'squad_packing', 'airflow_pack_squad', \
+                           job_command, inputs={'preprocess': preprocess_hash}, \
+                           outputs=[packed, metadata_path(packed)])
+
+def get_squad_dataset(ti, ngc_api_key, org, ace, team, tuning_method, token_cache=False, packed_sequence=None):
 
     #get NGC workspace id where we plan to download squad into
-    workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
-
-    #check if squad files already exist in workspace
-    squad_files=['squad_train.jsonl', 'squad_val.jsonl', 'squad_test.jsonl', 'squad_test_ground_truth.jsonl']
-    num_existing_squad_files=0
-    for file in squad_files:
-        file_exists=find_file_in_workspace(ngc_api_key, org, workspace_id, file)
-        num_existing_squad_files+=int(file_exists)
-    
-    #all 4 files already exist - don't need to re-download
-    if num_existing_squad_files==4:
-        return
-    
-    #dataset does not exist - download and preprocess squad
-    download(ti, ngc_api_key, org, ace, team, workspace_id)
-    preprocess(ti, ngc_api_key, org, ace, team, workspace_id, tuning_method)
-    
-    return
\ No newline at end of file
+    workspace_id = get_workspace_id(ti)
+
+    #each stage is planned from the memo hash of the one before it, and all of them share one container,
+    #so those that are not current run as one fused NGC job; raises if it failed
+    stages = [plan_download(ti, ngc_api_key, org, ace, workspace_id)]
+    stages.append(plan_preprocess(ti, ngc_api_key, org, ace, workspace_id, tuning_method, stages[0].memo_hash))
+    preprocess = stages[-1]
+    if token_cache:
+        stages.append(plan_token_cache(ti, ngc_api_key, org, ace, workspace_id, preprocess.memo_hash))
+
+    #packing only applies to the SFT format; its memo hash covers the preprocessing too
+    packing = packed_sequence and tuning_method.lower() in ['sft', 'lora']
+    if packing:
+        stages.append(plan_packing(ti, ngc_api_key, org, ace, workspace_id, packed_sequence, preprocess.memo_hash))
+
+    #the preprocessing (or packing) result carries the memo hash of the whole dataset for the training stages
+    results = run_stages(ti, ngc_api_key, org, stages, team=team)
+    return results[-1] if packing else results[1]
@@ -0,0 +1,35 @@
+'''Ships Python files of this repository into NGC jobs through the job command.
+
+Stages that run code of this repository (the SQuAD preprocessor, the token cache, sequence
+packing) run it in an NGC job that mounts the workspace, like every other stage, rather than in
+the task process: the only ways the pipeline moves data in and out of a workspace are jobs that
+mount it and the listFiles endpoint. The files are packed into a gzipped tar, base64-encoded into
+the command and unpacked under /tmp before the script runs, so imports between shipped files work
+as they do here. The archive is deterministic (sorted members, no timestamps or owners), so the
+command, and with it the stage's memo hash, changes exactly when a shipped file does.'''
+
+import io, os, gzip, base64, hashlib, tarfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def bundle(paths):
+    '''Base64 of a gzipped tar holding *paths* (relative to the repository root)'''
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w', format=tarfile.USTAR_FORMAT) as tar:
+        for path in sorted(paths):
+            with open(os.path.join(ROOT, path), 'rb') as f:
+                content = f.read()
+            info = tarfile.TarInfo(path)
+            info.size, info.mode = len(content), 0o644
+            tar.addfile(info, io.BytesIO(content))
+    return base64.b64encode(gzip.compress(archive.getvalue(), mtime=0)).decode('ascii')
+
+
+def bundled_command(paths, script, args=''):
+    '''Job command that unpacks *paths* into a directory of its own and runs *script* (one of them)
+    with python3 and *args*'''
+    encoded = bundle(paths)
+    directory = f"/tmp/airflow_bundle_{hashlib.sha256(encoded.encode('ascii')).hexdigest()[:12]}"
+    return f"mkdir -p {directory} && echo {encoded} | base64 -d | tar -xz -C {directory} && \
+            python3 {directory}/{script} {args}"
@@ -0,0 +1,80 @@
+'''NGC job states and the adaptive polling schedule used while waiting on jobs'''
+
+import os, random
+from datetime import datetime
+
+#states after which an NGC job will never change again
+TERMINAL_STATES = frozenset([
+    'FINISHED_SUCCESS',
+    'FAILED',
+    'FAILED_RUN_LIMIT_EXCEEDED',
+    'KILLED_BY_USER',
+    'KILLED_BY_SYSTEM',
+    'KILLED_BY_ADMIN',
+    'CANCELED',
+    'TASK_LOST',
+    'IM_INTERNAL_ERROR',
+    'INFINITY_POOL_MISSING',
+    'RESOURCE_GRANT_DENIED',
+    'RESOURCE_LIMIT_EXCEEDED',
+    'RESOURCE_CONSUMPTION_REQUEST_DENIED',
+])
+
+#states where the job is about to start, so it is worth checking back quickly
+PENDING_STATES = frozenset([
+    'CREATED',
+    'QUEUED',
+    'STARTING',
+    'PENDING_STORAGE_CREATION',
+    'REQUESTING_RESOURCE',
+])
+
+#shortest delay between two status calls (seconds)
+MIN_POLL_INTERVAL = 5
+#growth factor of the delay for every consecutive poll that finds the job running
+BACKOFF_FACTOR = 2.0
+#multiplier applied to every delay; the local NGC emulator harness uses it to compress time
+POLL_TIME_SCALE = float(os.environ.get('NGC_POLL_TIME_SCALE', 1.0))
+
+
+def is_terminal(job_status):
+    return job_status in TERMINAL_STATES
+
+
+def next_poll_delay(job_status, running_polls, max_wait, min_wait=MIN_POLL_INTERVAL):
+    '''Seconds to sleep before the next status call.
+
+    Jobs that are still queued or starting are polled every *min_wait* seconds. Once a job is
+    running the delay grows exponentially with the number of consecutive running polls, with
+    jitter so many tasks don't poll in lockstep, and is capped at the task's *max_wait*.'''
+
+    min_wait = min(min_wait, max_wait)
+    if job_status in PENDING_STATES:
+        return min_wait * POLL_TIME_SCALE
+
+    delay = min(max_wait, min_wait * BACKOFF_FACTOR ** min(running_polls, 32))
+    return max(min_wait, random.uniform(delay / 2, delay)) * POLL_TIME_SCALE
+
+
+def _epoch(timestamp):
+    #NGC reports times like 2023-09-01T12:00:00.000Z; fromisoformat only accepts 'Z' from Python 3.11
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def status_transitions(job):
+    '''[[status, epoch seconds], ...] from an NGC job record's status history, oldest first'''
+    history = job.get('jobStatusHistory') or []
+    transitions = [[entry['status'], _epoch(entry['statusChangeTime'])] for entry in history
+                   if entry.get('statusChangeTime')]
+    return sorted(transitions, key=lambda transition: transition[1])
+
+
+def job_phases(transitions):
+    '''Seconds a job spent queued (from its first status until it left the pending states) and
+    running (from then until its terminal status), or None if the history doesn't cover both'''
+    if not transitions or not is_terminal(transitions[-1][0]):
+        return None
+    left_queue = next((changed for status, changed in transitions if status not in PENDING_STATES), None)
+    if left_queue is None:
+        return None
+    return {'queued': left_queue - transitions[0][1], 'running': transitions[-1][1] - left_queue}
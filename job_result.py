@@ -0,0 +1,78 @@
+'''Compact record of an NGC job that a task returns to XCom instead of the full job JSON.
+
+Downstream tasks read fields by name (`result.memo_hash`, `result.artifacts`) rather than
+unpacking tuples. The record implements Airflow's serialize/deserialize hooks, so it can be
+stored by the default XCom backend (with `job_result.JobResult` in
+`[core] allowed_deserialization_classes`). xcom_backend.CompactXCom stores it more compactly.'''
+
+import posixpath
+
+#status of a stage that was not run because its outputs were already current, see stage_manifest.py
+SKIPPED = 'SKIPPED'
+#timings kept in JobResult.timeline: epoch seconds of submission and of detecting the end, and the
+#job's [[status, epoch seconds], ...] transitions; pipeline_profile.py builds its timeline from them
+TIMELINE_KEYS = ('submitted', 'transitions', 'detected')
+
+
+class JobResult:
+    '''Outcome of a task that ran (or skipped) one NGC job: job id, final status, the workspace and
+    paths in it the job produced, how long it queued and ran, the stage's memo hash and the job's
+    timeline (when it was submitted, its status transitions and when its end was detected)'''
+
+    __slots__ = ('job_id', 'status', 'workspace_id', 'artifacts', 'queued_seconds', 'run_seconds', 'memo_hash',
+                 'timeline')
+    #version 1 records have no timeline; deserialize leaves it None
+    __version__ = 2
+
+    def __init__(self, job_id, status, workspace_id=None, artifacts=(), queued_seconds=None, run_seconds=None,
+                 memo_hash=None, timeline=None):
+        self.job_id = job_id
+        self.status = status
+        self.workspace_id = workspace_id
+        self.artifacts = tuple(artifacts)
+        self.queued_seconds = queued_seconds
+        self.run_seconds = run_seconds
+        self.memo_hash = memo_hash
+        self.timeline = timeline
+
+    @classmethod
+    def from_job(cls, job_response, status, timings=None, **fields):
+        '''Result of a job submitted with `ngc_job_request` and watched by `wait_for_job_completion`'''
+        timings = timings or {}
+        timeline = {key: timings[key] for key in TIMELINE_KEYS if key in timings} or None
+        return cls(job_response['job']['id'], status, queued_seconds=timings.get('queued_seconds'),
+                   run_seconds=timings.get('run_seconds'), timeline=timeline, **fields)
+
+    @classmethod
+    def skipped(cls, **fields):
+        '''Result of a stage whose outputs were already current'''
+        return cls(None, SKIPPED, **fields)
+
+    @property
+    def succeeded(self):
+        return self.status in ('FINISHED_SUCCESS', SKIPPED)
+
+    def artifact(self, suffix):
+        '''First artifact path ending in *suffix*, or None'''
+        return next((path for path in self.artifacts if path.endswith(suffix)), None)
+
+    def artifact_name(self, suffix):
+        '''File name of the first artifact ending in *suffix*, or None'''
+        path = self.artifact(suffix)
+        return posixpath.basename(path) if path else None
+
+    def serialize(self):
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    @classmethod
+    def deserialize(cls, data, version):
+        if version > cls.__version__:
+            raise TypeError(f'JobResult version {version} is newer than {cls.__version__}')
+        return cls(*data)
+
+    def __eq__(self, other):
+        return isinstance(other, JobResult) and self.serialize() == other.serialize()
+
+    def __repr__(self):
+        fields = ', '.join(f'{slot}={getattr(self, slot)!r}' for slot in self.__slots__)
+        return f'JobResult({fields})'
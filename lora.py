@@ -1,52 +1,80 @@
-from ngc_requests import find_file_in_workspace, ngc_job_request, wait_for_job_completion
+from stage_manifest import plan_stage, run_stages
+from nemo_checkpoint import get_base_model_name
+from task_workspace import get_workspace_id
+from sweep import sweep_point_id, sweep_results_dir
+from download_squad import packed_squad_file, packed_global_batch_size
 
-def lora_training_bcp(ti, ngc_api_key, org, ace, team=None):
-      '''Launches a LoRA training job on BCP via NeMo Framework Training container'''
+#training hyperparameters (and the NeMo config keys they set) that a sweep may vary
+LORA_HPARAMS = {
+      'max_epochs': ('trainer.max_epochs', 4),
+      'max_steps': ('trainer.max_steps', 100),
+      'global_batch_size': ('model.global_batch_size', 32),
+      'micro_batch_size': ('model.micro_batch_size', 8),
+      'lr': ('model.optim.lr', None),
+      'adapter_dim': ('model.peft.lora_tuning.adapter_dim', None),
+      'adapter_dropout': ('model.peft.lora_tuning.adapter_dropout', None),
+}
+
+def plan_lora_training(ti, ngc_api_key, org, ace, ace_instance="dgxa100.80g.2.norm", \
+                       tensor_parallel=2, pipeline_parallel=1, hparams=None, packed_sequence=None):
+      '''Plans a LoRA training job on BCP via NeMo Framework Training container. With *hparams* (one
+      point of a sweep, see sweep.py) the job trains with those settings into its own sweeps/<id>/ directory.
+      With *packed_sequence* (a sequence length) it trains on the packed SQuAD training set of that
+      length (see sequence_packing.py), one packed sequence per micro batch, and global_batch_size
+      counts examples: the batch is scaled down to the packed sequences holding that many.'''
+
+      unknown=set(hparams or {}) - set(LORA_HPARAMS)
+      if unknown:
+            raise ValueError(f'Unknown LoRA hyperparameters {sorted(unknown)}')
+      settings={name: (hparams or {}).get(name, default) for name, (_, default) in LORA_HPARAMS.items()}
+      #optional settings are only passed to NeMo when given, everything else keeps the NeMo config defaults
+      overrides=' '.join(f'{LORA_HPARAMS[name][0]}={settings[name]}' for name in ('lr', 'adapter_dim', 'adapter_dropout')
+                         if settings[name] is not None)
+      results_dir=sweep_results_dir(hparams) if hparams else ''
+      train_file='SQuAD/v1.1/squad_train.jsonl'
       
       #get workspace ids
       gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-      tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
+      tuning_workspace_id = get_workspace_id(ti)
 
-      #avoid retraining if job has already ran and we have our LoRA model
-      lora_model_exists=find_file_in_workspace(ngc_api_key, org, tuning_workspace_id, 'lora_gpt3_5b.nemo')
-      if lora_model_exists:
-            return
+      if packed_sequence:
+            #NeMo's packed dataset only takes micro batches of one packed sequence
+            train_file=packed_squad_file(packed_sequence)
+            settings['micro_batch_size']=1
+            #evaluated by the job from the packing statistics in the workspace
+            settings['global_batch_size']=packed_global_batch_size(packed_sequence, settings['global_batch_size'])
+            overrides+=f' model.data.train_ds.max_seq_length={packed_sequence} +model.data.train_ds.packed_sequence=True'
 
       #get the base LLM from upstream Airflow tasks
-      pretrain_decision=ti.xcom_pull(task_ids='get_base_model')
-      if pretrain_decision=='download_nemo_checkpoint':
-            _,_, gpt_base_model_name=ti.xcom_pull(task_ids='download_nemo_checkpoint') #.nemo file
-      else:
-            raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo checkpoint.')
+      gpt_base_model_name=get_base_model_name(ti) #.nemo file
 
       #ngc job parameters
-      job_name = "airflow_lora_gpt3_5b_train"
-      ace_instance = "dgxa100.80g.2.norm"
+      job_name = f"airflow_lora_gpt3_5b_train_{sweep_point_id(hparams)}" if hparams else "airflow_lora_gpt3_5b_train"
       ace_name = ace
       docker_image = f"{org}/nemofw-training:23.07-py3"
       replica_count = 1 #single node
       workspaces=[{"id":gpt_workspace_id, "mount": "/mount/gpt_workspace"}, 
                   {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
       
-      #note: these settings are currently for GPT 5B BF16 TP2
+      #note: batch sizes are for GPT 5B BF16; parallelism defaults to TP2 (see dag_profiles.yaml)
       job_command = f"python3 /opt/NeMo/examples/nlp/language_modeling/tuning/megatron_gpt_peft_tuning.py \
             name=lora_gpt3_5b \
-            trainer.devices=2 \
+            trainer.devices={tensor_parallel * pipeline_parallel} \
             trainer.accelerator=gpu \
             trainer.num_nodes=1 \
             trainer.precision=bf16 \
-            trainer.max_epochs=4 \
-            trainer.max_steps=100 \
+            trainer.max_epochs={settings['max_epochs']} \
+            trainer.max_steps={settings['max_steps']} \
             trainer.log_every_n_steps=10 \
             trainer.val_check_interval=1.0 \
             trainer.gradient_clip_val=1.0 \
-            exp_manager.explicit_log_dir=/mount/tuning_workspace/training_info \
-            exp_manager.exp_dir=/mount/tuning_workspace/peft_lora \
+            exp_manager.explicit_log_dir=/mount/tuning_workspace/{results_dir}training_info \
+            exp_manager.exp_dir=/mount/tuning_workspace/{results_dir}peft_lora \
             exp_manager.checkpoint_callback_params.save_nemo_on_train_end=True \
-            model.tensor_model_parallel_size=2 \
-            model.pipeline_model_parallel_size=1 \
-            model.global_batch_size=32 \
-            model.micro_batch_size=8 \
+            model.tensor_model_parallel_size={tensor_parallel} \
+            model.pipeline_model_parallel_size={pipeline_parallel} \
+            model.global_batch_size={settings['global_batch_size']} \
+            model.micro_batch_size={settings['micro_batch_size']} \
             model.data.train_ds.num_workers=0 \
             model.data.validation_ds.num_workers=0 \
             model.data.train_ds.concat_sampling_probabilities=[1.0] \
@@ -54,56 +82,49 @@ def lora_training_bcp(ti, ngc_api_key, org, ace, team=None):
             model.peft.peft_scheme='lora' \
             model.answer_only_loss=True \
             model.restore_from_path=/mount/gpt_workspace/gpt_models/{gpt_base_model_name} \
-            model.data.train_ds.file_names=[/mount/tuning_workspace/SQuAD/v1.1/squad_train.jsonl] \
+            model.data.train_ds.file_names=[/mount/tuning_workspace/{train_file}] \
             model.data.validation_ds.file_names=[/mount/tuning_workspace/SQuAD/v1.1/squad_val.jsonl]\
-            +model.data.chat=False"
+            +model.data.chat=False {overrides}"
       
-      #send ngc job request
-      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+      #plan the ngc job request, skipped if this model was already trained from the same inputs
+      return plan_stage(ti, ngc_api_key, org, 'lora_train', tuning_workspace_id, job_name, \
+                        ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                        wait_time=300, upstream=['download_nemo_checkpoint', 'download_squad_dataset'], \
+                        outputs=[f'{results_dir}training_info/checkpoints/lora_gpt3_5b.nemo'])
 
-      #wait for job to complete on BCP before allowing airflow to "finish" task
-      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=300, team=team)
 
-      return job_response
+def lora_training_bcp(ti, ngc_api_key, org, ace, team=None, **kwargs):
+      '''Runs the stage of `plan_lora_training` and waits for its job in the task process'''
+      return run_stages(ti, ngc_api_key, org, [plan_lora_training(ti, ngc_api_key, org, ace, **kwargs)], team=team)[0]
 
 
-def lora_inference_bcp(ti, ngc_api_key, org, ace, team=None):
-      '''Launches a LoRA inference job on BCP via inference/eval scripts in
+def plan_lora_inference(ti, ngc_api_key, org, ace, ace_instance="dgxa100.80g.2.norm", \
+                        tensor_parallel=2, pipeline_parallel=1):
+      '''Plans a LoRA inference job on BCP via inference/eval scripts in
       NeMo Framework Training container (yes - training container :) )'''
       
       #get workspace id
       gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-      tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
-
-      #avoid rerunning inference if we already have inference results for LoRA
-      lora_inference_txt_exists=find_file_in_workspace(ngc_api_key, org, tuning_workspace_id, 'lora_gpt3_5b_inference.txt')
-      if lora_inference_txt_exists:
-            return
+      tuning_workspace_id = get_workspace_id(ti)
 
       #get the base LLM from upstream Airflow tasks - LoRA model produced aftern training
       #isn't merged, so we still have to include the base LLM
-      pretrain_decision=ti.xcom_pull(task_ids='get_base_model')
-      if pretrain_decision=='download_nemo_checkpoint':
-            _,_, gpt_base_model_name=ti.xcom_pull(task_ids='download_nemo_checkpoint') #.nemo file
-      else:
-            raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo checkpoint.')
+      gpt_base_model_name=get_base_model_name(ti) #.nemo file
 
       #ngc job parameters
       job_name = "airflow_lora_gpt3_5b_inference"
-      ace_instance = "dgxa100.80g.2.norm"
       ace_name = ace
       docker_image = f"{org}/nemofw-training:23.07-py3"
       replica_count = 1
       workspaces=[{"id":gpt_workspace_id, "mount": "/mount/gpt_workspace"}, 
                   {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
       
-      #note: these settings are currently for GPT 5B BF16 TP2
+      #note: batch sizes are for GPT 5B BF16; parallelism defaults to TP2 (see dag_profiles.yaml)
       job_command = f"python3 /opt/NeMo/examples/nlp/language_modeling/tuning/megatron_gpt_peft_eval.py \
-            trainer.devices=2 \
+            trainer.devices={tensor_parallel * pipeline_parallel} \
             trainer.precision=bf16 \
             model.restore_from_path=/mount/gpt_workspace/gpt_models/{gpt_base_model_name} \
-            model.tensor_model_parallel_size=2 \
+            model.tensor_model_parallel_size={tensor_parallel} \
             model.global_batch_size=16 \
             model.micro_batch_size=4 \
             model.peft.peft_scheme='lora' \
@@ -116,11 +137,13 @@ def lora_inference_bcp(ti, ngc_api_key, org, ace, team=None):
             inference.greedy=True \
             inference.outfile_path=/mount/tuning_workspace/training_info/lora_gpt3_5b_inference.txt"
       
-      #send ngc job request
-      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+      #plan the ngc job request, skipped if this model's predictions are already in the workspace
+      return plan_stage(ti, ngc_api_key, org, 'lora_inference', tuning_workspace_id, job_name, \
+                        ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                        wait_time=30, upstream=['LoRA_train'], \
+                        outputs=['training_info/lora_gpt3_5b_inference.txt'])
 
-      #wait for job to complete on BCP before allowing airflow to "finish" task
-      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=30, team=team)
 
-      return job_response
\ No newline at end of file
+def lora_inference_bcp(ti, ngc_api_key, org, ace, team=None, **kwargs):
+      '''Runs the stage of `plan_lora_inference` and waits for its job in the task process'''
+      return run_stages(ti, ngc_api_key, org, [plan_lora_inference(ti, ngc_api_key, org, ace, **kwargs)], team=team)[0]
\ No newline at end of file
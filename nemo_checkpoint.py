@@ -1,17 +1,27 @@
-from ngc_requests import find_file_in_workspace, ngc_job_request, wait_for_job_completion
+from stage_manifest import run_stage
 
-def download_nemo_checkpoint(ti, ngc_api_key, org, ace, nemo_ckpt_file, team=None):
-      '''Download a pretrained .nemo checkpoint into an NGC workspace. Currently configured to download the 
-      nemo_gpt_5B_bf16_tp2.nemo checkpoint'''
+#Hugging Face repository the GPT 5B .nemo checkpoints are downloaded from
+CHECKPOINT_URL = "https://huggingface.co/nvidia/nemo-megatron-gpt-5B/resolve/main"
+
+
+def get_base_model_name(ti):
+      '''Returns the .nemo file name of the base LLM downloaded by the upstream checkpoint task'''
+      pretrain_decision=ti.xcom_pull(task_ids='get_base_model')
+      checkpoint=ti.xcom_pull(task_ids='download_nemo_checkpoint') #JobResult
+      #DAGs built by dag_factory have no branching task and always start from a checkpoint
+      if pretrain_decision in (None, 'download_nemo_checkpoint') and checkpoint:
+            return checkpoint.artifact_name('.nemo')
+      raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo checkpoint.')
+
+
+def download_nemo_checkpoint(ti, ngc_api_key, org, ace, nemo_ckpt_file, team=None, checkpoint_url=CHECKPOINT_URL):
+      '''Download a pretrained .nemo checkpoint into an NGC workspace. Defaults to the GPT 5B checkpoints
+      published on Hugging Face, e.g. nemo_gpt_5B_bf16_tp2.nemo. Returns a JobResult whose artifact
+      is the checkpoint's path in the GPT workspace.'''
 
       #get workspace id
       workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
 
-      # check if .nemo file already exists in ngc wksp to avoid redownloading
-      checkpoint_exists=find_file_in_workspace(ngc_api_key, org, workspace_id, nemo_ckpt_file)
-      if checkpoint_exists==True:
-            return None, workspace_id, nemo_ckpt_file
-      
       #ngc job parameters
       job_name = "airflow_download_gpt3_5b_nemo_ckpt"
       ace_instance = "dgxa100.80g.1.norm"
@@ -20,15 +30,14 @@ def download_nemo_checkpoint(ti, ngc_api_key, org, ace, nemo_ckpt_file, team=Non
       replica_count = 1
       workspaces=[{'id': workspace_id, 'mount': "/mount/gpt_workspace"}]
 
+      #download under a temporary name so DAGs sharing the workspace never see a partial checkpoint
       job_command = f"cd ../; cd /mount/gpt_workspace/; mkdir gpt_models; cd gpt_models;\
-                    wget https://huggingface.co/nvidia/nemo-megatron-gpt-5B/resolve/main/{nemo_ckpt_file}"
-      
-      #send ngc job request
-      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+                    wget -O {nemo_ckpt_file}.$$.part {checkpoint_url}/{nemo_ckpt_file} && mv {nemo_ckpt_file}.$$.part {nemo_ckpt_file}"
       
-      #wait for job to complete on BCP before allowing airflow to "finish" task
-      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=15, team=team)
+      #send ngc job request, unless this checkpoint was already downloaded from the same url
+      job_result = run_stage(ti, ngc_api_key, org, 'nemo_checkpoint', workspace_id, job_name, ace_instance, \
+                             ace_name, docker_image, replica_count, workspaces, job_command, wait_time=15, \
+                             team=team, outputs=[f'gpt_models/{nemo_ckpt_file}'])
 
-      return job_response, workspace_id, nemo_ckpt_file
+      return job_result
  
\ No newline at end of file
@@ -1,71 +1,33 @@
 from datetime import datetime
 from airflow import DAG
-from airflow.models import Variable
 from airflow.decorators import task_group
 from airflow.utils.trigger_rule import TriggerRule
 from airflow.operators.python import PythonOperator
 from airflow.operators.python import BranchPythonOperator
 
-from task_workspace import create_task_workspace
+# Variables from the Airflow UI, resolved at task runtime (see dag_settings.py)
+from dag_settings import key_, org_, team_, ace_, nemo_ckpt_, pretrain_decision_, tuning_method_, interactive_, \
+    prepare_pile_only_, tuning_workspace_name, gpt_workspace_name
+from task_workspace import create_task_workspace, name_tuning_workspace
 from branching import choose_tuning_method, get_base_model, choose_inference
 from nemo_checkpoint import download_nemo_checkpoint
 from pretrain_gpt import download_pile_dataset, train_gpt_model
+from pile_shards import prepare_pile_shards, verify_pile_dataset, shard_groups, PILE_POOL
 from download_squad import get_squad_dataset
-from p_tuning import p_tuning_training_bcp, p_tuning_inference_bcp
-from lora import lora_training_bcp, lora_inference_bcp
-from sft import sft_training_bcp, sft_inference_bcp
-from triton import merge_lora_weights, create_triton_model_repository, launch_triton_server
+from p_tuning import plan_p_tuning_training, plan_p_tuning_inference
+from lora import plan_lora_training, plan_lora_inference
+from sft import plan_sft_training, plan_sft_inference
+from ngc_operator import NGCStageOperator
+from triton import create_triton_model_repository, launch_triton_server
 from squad_eval import squad_metric_eval
 
-# Get variables from Airflow UI
-key_v = Variable.get("key_v", deserialize_json=True)
-org_v = Variable.get("org_v", deserialize_json=True)
-team_v = Variable.get("team_v", deserialize_json=True)
-ace_v = Variable.get("ace_v", deserialize_json=True)
-nemo_ckpt_v = Variable.get("nemo_ckpt_v", deserialize_json=True)
-pretrain_decision_v = Variable.get("pretrain_decision_v", deserialize_json=True)
-tuning_method_v = Variable.get("tuning_method_v", deserialize_json=True)
-interactive_v = Variable.get("interactive_inference_v", deserialize_json=True)
-unique_name_v = Variable.get("unique_name_v", deserialize_json=True)
-
-key_= str(key_v)
-org_=str(org_v)
-team_= str(team_v)
-ace_=str(ace_v)
-nemo_ckpt_=str(nemo_ckpt_v)
-pretrain_decision_ = str(pretrain_decision_v)
-tuning_method_ = str(tuning_method_v)
-interactive_ = str(interactive_v) == 'True' #convert deserialized str to bool
-unique_name_ = str(unique_name_v)
-
-# # Set-up names for our tuning method's workspace in NGC
-# def name_tuning_workspace(method, unique_name):
-#     if method =='lora':
-#         tuning_workspace_name = f'airflow_lora_nemo_workspace_{unique_name_}' 
-#     elif method == 'p_tuning':
-#         tuning_workspace_name = f'airflow_ptuning_nemo_workspace_{unique_name_}'
-#     elif method == 'sft':
-#         tuning_workspace_name = f'airflow_sft_nemo_workspace_{unique_name_}'
-#     return tuning_workspace_name
-
-def name_tuning_workspace(method, unique_name):
-    if method =='lora':
-        tuning_workspace_name = f'airflow_lora_nemo_workspace' 
-    elif method == 'p_tuning':
-        tuning_workspace_name = f'airflow_ptuning_nemo_workspace'
-    elif method == 'sft':
-        tuning_workspace_name = f'airflow_sft_nemo_workspace'
-    return tuning_workspace_name
-
-tuning_workspace_name=name_tuning_workspace(tuning_method_, unique_name_)
-gpt_workspace_name = f"airflow_gpt_nemo_workspace_{unique_name_}"
-
 ## Define Airflow DAG and Tasks
 with DAG(
          "NeMo_LLM_Workflow_DGX_Cloud", 
          schedule_interval='@once',
          start_date=datetime(2022, 1, 1),
-         catchup=False
+         catchup=False,
+         user_defined_macros={"name_tuning_workspace": name_tuning_workspace}
     ) as dag: 
 
     create_gpt_workspace_task = PythonOperator(
@@ -93,10 +55,30 @@ with DAG(
             op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "nemo_ckpt_file": nemo_ckpt_, "team": team_},
             dag = dag)
 
+    # fails fast while GPT pretraining is not implemented, unless the run's conf sets prepare_pile_only_v
     download_the_pile_task = PythonOperator(
             task_id = 'download_pile_dataset',
             python_callable= download_pile_dataset,
-            op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
+            op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_,
+                        "prepare_data_only": prepare_pile_only_},
+            dag = dag)
+
+    # one task per group of Pile shards, as many jobs at once as the pool allows; retries only redo unfinished shards.
+    # Create the pool before the first run (Airflow never schedules tasks of a missing pool), e.g.
+    #   airflow pools set pile_data_prep 4 "Concurrent Pile data preparation jobs"
+    prepare_pile_shards_task = PythonOperator.partial(
+            task_id = 'prepare_pile_shards',
+            python_callable= prepare_pile_shards,
+            pool= PILE_POOL,
+            retries= 2,
+            dag = dag
+        ).expand(op_kwargs=[{"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_, "shards": shards}
+                            for shards in shard_groups()])
+
+    verify_pile_task = PythonOperator(
+            task_id = 'verify_pile_dataset',
+            python_callable= verify_pile_dataset,
+            op_kwargs= {"ngc_api_key": key_, "org":org_},
             dag = dag)
 
     train_gpt_task = PythonOperator(
@@ -109,30 +91,32 @@ with DAG(
             task_id = 'download_squad_dataset',
             python_callable=get_squad_dataset,
             op_kwargs={"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_, "tuning_method": tuning_method_},
-            trigger_rule=TriggerRule.ONE_SUCCESS, 
             dag=dag)
 
+    # joins the dataset and base model stages; one of checkpoint download / GPT training is always skipped
     choose_tuning_task = BranchPythonOperator(
             task_id = 'choose_tuning_method',
             python_callable=choose_tuning_method,
             op_kwargs={"method": tuning_method_},
+            trigger_rule=TriggerRule.NONE_FAILED_MIN_ONE_SUCCESS,
             dag=dag)
 
-    p_tuning_train_task = PythonOperator(
+    # training and script inference jobs run for hours: the triggerer watches them instead of a worker slot
+    p_tuning_train_task = NGCStageOperator(
             task_id = 'p_tuning_train',
-            python_callable= p_tuning_training_bcp,
+            python_callable= plan_p_tuning_training,
             op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
             dag = dag)
 
-    lora_train_task = PythonOperator(
+    lora_train_task = NGCStageOperator(
             task_id = 'LoRA_train',
-            python_callable= lora_training_bcp,
+            python_callable= plan_lora_training,
             op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
             dag = dag)
     
-    sft_train_task = PythonOperator(
+    sft_train_task = NGCStageOperator(
             task_id = 'SFT_train',
-            python_callable= sft_training_bcp,
+            python_callable= plan_sft_training,
             op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
             dag = dag)
     
@@ -152,32 +136,27 @@ with DAG(
     
     @task_group(group_id='nemo_script_inference')
     def inference_scripts():
-        p_tuning_inference_task = PythonOperator(
+        p_tuning_inference_task = NGCStageOperator(
                 task_id = 'p_tuning_inference_script',
-                python_callable= p_tuning_inference_bcp,
+                python_callable= plan_p_tuning_inference,
                 op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
                 dag = dag)
         
-        lora_inference_task = PythonOperator(
+        lora_inference_task = NGCStageOperator(
                 task_id = 'LoRA_inference_script',
-                python_callable= lora_inference_bcp,
+                python_callable= plan_lora_inference,
                 op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
                 dag = dag)
         
-        sft_inference_task = PythonOperator(
+        sft_inference_task = NGCStageOperator(
                 task_id = 'SFT_inference_script',
-                python_callable= sft_inference_bcp,
+                python_callable= plan_sft_inference,
                 op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
                 dag = dag)
         
     @task_group(group_id='triton_inference')
     def triton_inference():
-        lora_merge_weights_task = PythonOperator(
-                task_id = 'merge_lora_adapter_weights',
-                python_callable= merge_lora_weights,
-                op_kwargs= {"ngc_api_key": key_, "org":org_, "ace": ace_, "team": team_},
-                dag = dag)
-
+        # for LoRA this also merges the adapter weights into the base LLM, fused into the same NGC job
         create_triton_model_repo_task = PythonOperator(
                 task_id = 'create_triton_model_repository',
                 python_callable= create_triton_model_repository,
@@ -192,20 +171,19 @@ with DAG(
                 trigger_rule=TriggerRule.ONE_SUCCESS,
                 dag = dag)
         
-        lora_merge_weights_task >> create_triton_model_repo_task >> launch_triton_task
         choose_inference_task >> create_triton_model_repo_task >> launch_triton_task
 
     # Put together the NeMo LLM workflow steps in order 
+    # base model and dataset stages only depend on their own workspace and run concurrently
     create_gpt_workspace_task >> pretrain_decision_task
-    create_tuning_workspace_task >> pretrain_decision_task
-    
     pretrain_decision_task >> [download_checkpoint_task, download_the_pile_task]
-    download_the_pile_task >> train_gpt_task >> download_squad_task
-    download_checkpoint_task >> download_squad_task
-    
-    download_squad_task >> choose_tuning_task >> lora_train_task
-    download_squad_task >> choose_tuning_task>> p_tuning_train_task
-    download_squad_task >> choose_tuning_task >> sft_train_task
+    download_the_pile_task >> prepare_pile_shards_task >> verify_pile_task >> train_gpt_task
+
+    create_tuning_workspace_task >> download_squad_task
+
+    # both stages join before training
+    [download_checkpoint_task, train_gpt_task, download_squad_task] >> choose_tuning_task
+    choose_tuning_task >> [lora_train_task, p_tuning_train_task, sft_train_task]
     
     lora_train_task >> choose_inference_task
     p_tuning_train_task >> choose_inference_task
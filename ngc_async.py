@@ -0,0 +1,193 @@
+'''Asyncio counterpart of ngc_requests for checking the status of many NGC jobs concurrently.
+
+One AsyncNGCClient shares a single auth token (from the worker-wide token cache) and a single
+aiohttp connection pool across every status call, with a bound on the number of calls in flight.
+Like the synchronous client, every call first takes a poll token from the worker-wide rate
+limiter, and a 429 pauses every process on the worker for its Retry-After.'''
+
+import json, time, asyncio, weakref, functools, aiohttp
+
+import ngc_requests
+from ngc_client import RETRY_STATUS_CODES
+from ngc_metrics import record_call
+from ngc_rate_limit import get_rate_limiter, parse_retry_after, PRIORITY_POLL
+from ngc_requests import get_token
+from job_polling import is_terminal, next_poll_delay, status_transitions, job_phases, PENDING_STATES
+
+
+class NGCHTTPError(Exception):
+    '''Non-200 response of the NGC API, with its status code'''
+
+    def __init__(self, status, url):
+        super().__init__("HTTP Error %d: from '%s'" % (status, url))
+        self.status = status
+
+
+def is_transient(error):
+    '''True for errors a later status call may not hit again: timeouts, dropped connections,
+    429 and 5xx responses. Anything else (a revoked key, an unknown job) will not go away.'''
+    if isinstance(error, NGCHTTPError):
+        return error.status in RETRY_STATUS_CODES or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class AsyncNGCClient:
+    '''Use as `async with AsyncNGCClient(key, org) as client: statuses = await client.poll_jobs(ids)`'''
+
+    def __init__(self, ngc_api_key, org, team=None, concurrency=20, connect_timeout=10, read_timeout=60, retries=3):
+        self.ngc_api_key = ngc_api_key
+        self.org = org
+        self.team = team
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.rate_limiter = get_rate_limiter()
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _token(self):
+        #served from the token cache after the first call; a refresh is a blocking request, so run it in a thread
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(get_token, self.ngc_api_key, self.org, self.team))
+
+    async def _get_json(self, url, token, endpoint):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {token}'
+        }
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async(PRIORITY_POLL)
+            async with self._semaphore:
+                start = time.perf_counter()
+                async with self.session.get(url, headers=headers) as response:
+                    body = await response.read()
+                    record_call(endpoint, response.status, time.perf_counter() - start, 0, len(body))
+                    if response.status == 200:
+                        return json.loads(body)
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'), default=2 ** attempt)
+                    if response.status not in RETRY_STATUS_CODES or attempt == self.retries:
+                        raise NGCHTTPError(response.status, url)
+            if response.status == 429 and self.rate_limiter:
+                await asyncio.get_running_loop().run_in_executor(None, self.rate_limiter.block, retry_after)
+            else:
+                await asyncio.sleep(retry_after)
+
+    async def job_info(self, job_id, token=None):
+        '''Full job JSON, as returned by `/v2/org/{org}/jobs/{job_id}`'''
+        await self.open()
+        token = token or await self._token()
+        return await self._get_json(f'{ngc_requests.NGC_API_URL}/v2/org/{self.org}/jobs/{job_id}', token, 'job_status')
+
+    async def job_status(self, job_id, token=None):
+        job_info = await self.job_info(job_id, token)
+        return job_info['job']['jobStatus']['status']
+
+    async def poll_jobs(self, job_ids):
+        '''Checks every job concurrently (at most `concurrency` calls in flight) and returns
+        {job_id: status}. Jobs whose status could not be fetched map to None.'''
+        token = await self._token()
+        job_ids = list(job_ids)
+        results = await asyncio.gather(*(self.job_status(job_id, token) for job_id in job_ids),
+                                       return_exceptions=True)
+
+        statuses = {}
+        for job_id, result in zip(job_ids, results):
+            if isinstance(result, Exception):
+                print(f'Could not get status of NGC job {job_id}: {result}')
+                result = None
+            statuses[job_id] = result
+        return statuses
+
+
+async def watch_job(client, job_id, max_poll_interval):
+    '''Asyncio counterpart of `wait_for_job_completion`: polls the job on the same adaptive
+    schedule until it reaches a terminal state and returns that state and the job's timings
+    (`transitions`, `detected`, `queued_seconds`, `run_seconds`). A status call that fails
+    transiently (see `is_transient`) is logged and retried after a backoff growing with the
+    failures in a row; any other error is raised.'''
+    running_polls = failed_polls = 0
+    while True:
+        try:
+            job_info = (await client.job_info(job_id))['job']
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            failed_polls += 1
+            delay = next_poll_delay('RUNNING', failed_polls, max_poll_interval)
+            print(f'Could not get status of NGC job {job_id} ({e!r}), retrying in {delay:.1f} s')
+            await asyncio.sleep(delay)
+            continue
+
+        failed_polls = 0
+        job_status = job_info['jobStatus']['status']
+        if is_terminal(job_status):
+            break
+        await asyncio.sleep(next_poll_delay(job_status, running_polls, max_poll_interval))
+        running_polls = 0 if job_status in PENDING_STATES else running_polls + 1
+
+    timings = {'detected': time.time(), 'transitions': status_transitions(job_info)}
+    phases = job_phases(timings['transitions'])
+    if phases:
+        timings['queued_seconds'] = round(phases['queued'], 1)
+        timings['run_seconds'] = round(phases['running'], 1)
+    return job_status, timings
+
+
+async def poll_jobs(ngc_api_key, org, job_ids, concurrency=20, team=None):
+    '''Returns {job_id: status} for many NGC jobs using one short-lived AsyncNGCClient'''
+    async with AsyncNGCClient(ngc_api_key, org, team, concurrency=concurrency) as client:
+        return await client.poll_jobs(job_ids)
+
+
+#event loop -> ({(key, org, team): client}, closer); entries go away with their loop
+_shared_clients = weakref.WeakKeyDictionary()
+
+
+async def _close_at_shutdown(clients):
+    '''Parked at its yield until the event loop shuts down its async generators (asyncio.run and
+    the triggerer do so before closing the loop), then closes *clients*'''
+    try:
+        yield
+    finally:
+        for client in list(clients.values()):
+            await client.close()
+        clients.clear()
+
+
+async def shared_client(ngc_api_key, org, team=None):
+    '''Returns an AsyncNGCClient shared by every caller on the running event loop, e.g. all
+    NGC triggers on a triggerer, so they use one token and one connection pool. The loop's
+    clients are closed when it shuts down.'''
+    loop = asyncio.get_running_loop()
+    if loop not in _shared_clients:
+        clients = {}
+        closer = _close_at_shutdown(clients)
+        await closer.__anext__()
+        #the entry keeps the generator alive; collecting it would close the clients early
+        _shared_clients[loop] = (clients, closer)
+    clients, _ = _shared_clients[loop]
+
+    key = (ngc_api_key, org, team)
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = AsyncNGCClient(ngc_api_key, org, team, concurrency=50)
+    return client
@@ -0,0 +1,114 @@
+'''Pooled, keep-alive HTTP session shared by every NGC REST call made from a task process'''
+
+import os, time, threading, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ngc_rate_limit import get_rate_limiter, parse_retry_after, PRIORITY_NORMAL
+from ngc_metrics import timed_call
+from ngc_token_cache import invalidate_token
+
+#transient responses that are safe to retry for idempotent requests
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+#429s are handled by the client itself so the Retry-After pause is shared through the rate limiter
+_ADAPTER_RETRY_STATUS_CODES = tuple(code for code in RETRY_STATUS_CODES if code != 429)
+#job submission (POST) is left out so a slow 5xx never launches a duplicate GPU job
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+
+class NGCClient:
+    '''Owns a pooled `requests.Session` so repeated calls to authn.nvidia.com and api.ngc.nvidia.com
+    reuse TLS connections instead of doing a new handshake per request.'''
+
+    def __init__(self, pool_size=10, connect_timeout=10, read_timeout=60, retries=5, backoff_factor=1.0,
+                 rate_limiter=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.rate_limiter = rate_limiter
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=_ADAPTER_RETRY_STATUS_CODES,
+            allowed_methods=RETRY_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pid = os.getpid()
+
+    def request(self, method, url, priority=PRIORITY_NORMAL, endpoint='other', token_scope=None, **kwargs):
+        '''Same signature as `requests.request`, with the client's default connect/read timeouts.
+        Each attempt first takes a token from the rate limiter at *priority*; a 429 pauses every
+        process on the worker for the response's Retry-After before the call is retried.
+        Latency, status code and bytes of every attempt are recorded in ngc_metrics under *endpoint*.
+        *token_scope* is the (api key, org[, team]) of the bearer token in the headers: a 401 drops
+        that token from the cache (see ngc_token_cache.py) and the call is retried once with a new one.'''
+        kwargs.setdefault('timeout', self.timeout)
+        response = self._send(method, url, priority, endpoint, kwargs)
+        if response.status_code == 401 and token_scope:
+            #the token was revoked or expired before its JWT said; the retry fetches a new one
+            from ngc_requests import get_token #ngc_requests imports this module
+            response.close()
+            invalidate_token(*token_scope)
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, Authorization=f'Bearer {get_token(*token_scope)}')
+            response = self._send(method, url, priority, endpoint, kwargs)
+        return response
+
+    def _send(self, method, url, priority, endpoint, kwargs):
+        '''One call, retried after 429s'''
+        bytes_sent = len(kwargs.get('data') or '')
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(priority)
+            with timed_call(endpoint, bytes_sent) as call:
+                response = call.response = self.session.request(method, url, **kwargs)
+            if response.status_code != 429 or attempt == self.retries:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After'), default=2 ** attempt)
+            if self.rate_limiter:
+                self.rate_limiter.block(retry_after)
+            else:
+                time.sleep(retry_after)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _client_from_env():
+    '''Builds the default client, allowing pool size and timeouts to be tuned per worker'''
+    return NGCClient(
+        pool_size=int(os.environ.get('NGC_HTTP_POOL_SIZE', 10)),
+        connect_timeout=float(os.environ.get('NGC_HTTP_CONNECT_TIMEOUT', 10)),
+        read_timeout=float(os.environ.get('NGC_HTTP_READ_TIMEOUT', 60)),
+        retries=int(os.environ.get('NGC_HTTP_RETRIES', 5)),
+        rate_limiter=get_rate_limiter(),
+    )
+
+
+def get_client():
+    '''Returns the process-wide NGCClient. A forked task process gets its own session
+    since pooled sockets must not be shared with the parent.'''
+    global _client
+    with _client_lock:
+        if _client is None or _client.pid != os.getpid():
+            _client = _client_from_env()
+        return _client
+
+
+def set_client(client):
+    '''Replaces the process-wide client (e.g. to use custom pool sizes or timeouts)'''
+    global _client
+    with _client_lock:
+        _client = client
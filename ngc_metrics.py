@@ -0,0 +1,200 @@
+'''Latency, status-code and byte counters for every NGC API call, labelled by endpoint and Airflow task,
+and the time calls waited on the client-side rate limiter (ngc_rate_limit.py), labelled by priority.
+
+Each call is recorded in an in-process registry and forwarded to Airflow's StatsD client (a no-op
+unless `[metrics] statsd_on` is set). The registry can also be rendered in the Prometheus text
+format or summarised at the end of a task.'''
+
+import os, time, bisect, threading
+
+from ngc_token_cache import token_cache_stats
+
+#upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_local = threading.local()
+_calls = {}
+_histograms = {}
+_bytes = {}
+_throttles = {}
+_stats_client = None
+
+
+def current_task_label():
+    '''Task the calls are attributed to: an explicit label for this thread, else the task Airflow
+    exported to the task process environment'''
+    return getattr(_local, 'task', None) or os.environ.get('AIRFLOW_CTX_TASK_ID', 'unknown')
+
+
+def set_task_label(task_id):
+    '''Attributes calls made from this thread to *task_id* (None reverts to the Airflow context)'''
+    _local.task = task_id
+
+
+def _statsd():
+    '''Airflow's StatsD client, or False outside an Airflow installation (looked up once)'''
+    global _stats_client
+    if _stats_client is None:
+        try:
+            from airflow.stats import Stats
+            _stats_client = Stats
+        except ImportError:
+            _stats_client = False
+    return _stats_client
+
+
+def record_call(endpoint, status_code, seconds, bytes_sent=0, bytes_received=0):
+    '''Records one NGC API call'''
+    task = current_task_label()
+    key = (endpoint, task)
+    with _lock:
+        calls = _calls.setdefault(key, {})
+        calls[status_code] = calls.get(status_code, 0) + 1
+
+        histogram = _histograms.setdefault(key, {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0})
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if bucket < len(LATENCY_BUCKETS):
+            histogram['buckets'][bucket] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+        transferred = _bytes.setdefault(key, {'sent': 0, 'received': 0})
+        transferred['sent'] += bytes_sent
+        transferred['received'] += bytes_received
+
+    stats = _statsd()
+    if stats:
+        stats.incr(f'ngc_api.{endpoint}.calls')
+        stats.incr(f'ngc_api.{endpoint}.status.{status_code}')
+        stats.timing(f'ngc_api.{endpoint}.latency', seconds * 1000)
+        stats.incr(f'ngc_api.{endpoint}.bytes_received', bytes_received)
+
+
+def record_throttle(priority, seconds):
+    '''Records one call that the rate limiter let through at *priority* after *seconds* of waiting'''
+    key = (priority, current_task_label())
+    with _lock:
+        throttle = _throttles.setdefault(key, {'calls': 0, 'throttled_calls': 0, 'throttled_seconds': 0.0})
+        throttle['calls'] += 1
+        throttle['throttled_calls'] += int(seconds > 0)
+        throttle['throttled_seconds'] += seconds
+
+    stats = _statsd()
+    if stats and seconds > 0:
+        stats.incr(f'ngc_api.throttle.{priority}.throttled_calls')
+        stats.timing(f'ngc_api.throttle.{priority}.throttled_seconds', seconds * 1000)
+
+
+def _bytes_received(response):
+    #reading .content of a streamed response would load the whole body; use its declared length
+    if not getattr(response, '_content_consumed', True):
+        return int(response.headers.get('Content-Length') or 0)
+    return len(response.content)
+
+
+class timed_call:
+    '''Context manager timing one call: `with timed_call('job_status') as call: call.response = ...`'''
+
+    def __init__(self, endpoint, bytes_sent=0):
+        self.endpoint = endpoint
+        self.bytes_sent = bytes_sent
+        self.response = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if self.response is not None:
+            record_call(self.endpoint, self.response.status_code, seconds, self.bytes_sent, _bytes_received(self.response))
+        else:
+            record_call(self.endpoint, 'error', seconds, self.bytes_sent)
+        return False
+
+
+def metrics_summary():
+    '''{endpoint: {calls, errors, seconds, bytes_received, by_task: {task: calls}}} for this process'''
+    summary = {}
+    with _lock:
+        for (endpoint, task), codes in _calls.items():
+            entry = summary.setdefault(endpoint, {'calls': 0, 'errors': 0, 'seconds': 0.0,
+                                                  'bytes_received': 0, 'by_task': {}})
+            count = sum(codes.values())
+            entry['calls'] += count
+            entry['errors'] += sum(n for code, n in codes.items() if code == 'error' or int(code) >= 400)
+            entry['seconds'] += _histograms[(endpoint, task)]['sum']
+            entry['bytes_received'] += _bytes[(endpoint, task)]['received']
+            entry['by_task'][task] = entry['by_task'].get(task, 0) + count
+    return summary
+
+
+def throttle_summary():
+    '''{priority: {calls, throttled_calls, throttled_seconds}} of the rate limiter in this process'''
+    summary = {}
+    with _lock:
+        for (priority, _), throttle in _throttles.items():
+            entry = summary.setdefault(priority, {'calls': 0, 'throttled_calls': 0, 'throttled_seconds': 0.0})
+            for name, value in throttle.items():
+                entry[name] += value
+    return summary
+
+
+def print_metrics_summary():
+    '''Prints how many calls this process made to each endpoint and what they cost, how long the
+    rate limiter held them back and how often the auth token came from the cache'''
+    for endpoint, entry in sorted(metrics_summary().items()):
+        print(f"NGC API {endpoint}: {entry['calls']} calls, {entry['errors']} errors, "
+              f"{entry['seconds']:.2f} s, {entry['bytes_received']} bytes received")
+    for priority, entry in sorted(throttle_summary().items()):
+        print(f"NGC API rate limit ({priority}): {entry['throttled_calls']} of {entry['calls']} calls throttled, "
+              f"{entry['throttled_seconds']:.2f} s")
+    tokens = token_cache_stats()
+    if any(tokens.values()):
+        print(f"NGC auth tokens: {tokens['hits']} cached, {tokens['shared_hits']} from another process, "
+              f"{tokens['misses']} fetched")
+
+
+def render_prometheus():
+    '''The registry in the Prometheus text exposition format'''
+    lines = [
+        '# HELP ngc_api_calls_total NGC API calls by endpoint, task and HTTP status code.',
+        '# TYPE ngc_api_calls_total counter',
+    ]
+    with _lock:
+        for (endpoint, task), codes in sorted(_calls.items()):
+            for code, count in sorted(codes.items(), key=lambda item: str(item[0])):
+                lines.append(f'ngc_api_calls_total{{endpoint="{endpoint}",task="{task}",code="{code}"}} {count}')
+
+        lines += ['# HELP ngc_api_latency_seconds NGC API call latency.',
+                  '# TYPE ngc_api_latency_seconds histogram']
+        for (endpoint, task), histogram in sorted(_histograms.items()):
+            labels = f'endpoint="{endpoint}",task="{task}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                cumulative += count
+                lines.append(f'ngc_api_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'ngc_api_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'ngc_api_latency_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+            lines.append(f'ngc_api_latency_seconds_count{{{labels}}} {histogram["count"]}')
+
+        lines += ['# HELP ngc_api_bytes_total Bytes sent to and received from the NGC API.',
+                  '# TYPE ngc_api_bytes_total counter']
+        for (endpoint, task), transferred in sorted(_bytes.items()):
+            for direction, count in transferred.items():
+                lines.append(f'ngc_api_bytes_total{{endpoint="{endpoint}",task="{task}",direction="{direction}"}} {count}')
+
+        lines += ['# HELP ngc_api_throttled_calls_total NGC API calls held back by the client-side rate limiter.',
+                  '# TYPE ngc_api_throttled_calls_total counter']
+        for (priority, task), throttle in sorted(_throttles.items()):
+            lines.append(f'ngc_api_throttled_calls_total{{priority="{priority}",task="{task}"}} '
+                         f'{throttle["throttled_calls"]}')
+
+        lines += ['# HELP ngc_api_throttled_seconds_total Time NGC API calls waited on the client-side rate limiter.',
+                  '# TYPE ngc_api_throttled_seconds_total counter']
+        for (priority, task), throttle in sorted(_throttles.items()):
+            lines.append(f'ngc_api_throttled_seconds_total{{priority="{priority}",task="{task}"}} '
+                         f'{throttle["throttled_seconds"]:.6f}')
+    return '\n'.join(lines) + '\n'
+
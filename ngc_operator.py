@@ -0,0 +1,126 @@
+'''Deferrable operators that submit an NGC job and release their worker slot while the job runs'''
+
+import time
+
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator, Variable
+
+from ngc_requests import ngc_job_request
+from ngc_trigger import NGCJobTrigger, API_KEY_VARIABLE
+from workspace_index import invalidate_workspace_index
+from job_result import JobResult
+
+
+class NGCJobOperator(BaseOperator):
+    '''Submits a job to BCP via `ngc_job_request` and defers to `NGCJobTrigger`, so the job is
+    watched by the triggerer instead of a worker sleeping in `wait_for_job_completion`.
+
+    `workspaces` is a list of {'id': ..., 'mount': ...} dicts and is templated, so workspace ids
+    can come from upstream tasks, e.g. "{{ ti.xcom_pull(task_ids='create_tuning_workspace') }}".
+    The trigger reads the API key from the JSON Airflow Variable `ngc_api_key_variable` (key_v by
+    default), which is therefore required even when the run's conf passes the key: the task fails
+    before submitting a job if the Variable is missing. The task fails unless the job ends in FINISHED_SUCCESS and returns the NGC job id.'''
+
+    template_fields = ('ngc_api_key', 'org', 'ace', 'team', 'job_name', 'ace_instance',
+                       'docker_image', 'workspaces', 'job_command')
+
+    def __init__(self, *, ngc_api_key, org, ace, job_name, ace_instance, docker_image, workspaces, job_command,
+                 replica_count=1, team=None, ports=None, max_poll_interval=300,
+                 ngc_api_key_variable=API_KEY_VARIABLE, **kwargs):
+        super().__init__(**kwargs)
+        self.ngc_api_key = ngc_api_key
+        self.org = org
+        self.ace = ace
+        self.team = team
+        self.job_name = job_name
+        self.ace_instance = ace_instance
+        self.docker_image = docker_image
+        self.workspaces = workspaces
+        self.job_command = job_command
+        self.replica_count = replica_count
+        self.ports = ports
+        self.max_poll_interval = max_poll_interval
+        self.ngc_api_key_variable = ngc_api_key_variable
+
+    def execute(self, context):
+        self.check_api_key_variable()
+        job_response = ngc_job_request(context['ti'], self.ngc_api_key, self.org, self.job_name, self.ace_instance,
+                                       self.ace, self.docker_image, self.replica_count, self.workspaces,
+                                       self.job_command, team=self.team, ports=self.ports)
+        self.defer_to_job(job_response, self.org, self.team, self.max_poll_interval)
+
+    def check_api_key_variable(self):
+        '''Fails the task if the triggerer could not read the API key, before a job is submitted'''
+        if Variable.get(self.ngc_api_key_variable, default_var=None) is None:
+            raise AirflowException(f'Airflow Variable {self.ngc_api_key_variable} is missing: the triggerer reads '
+                                   f'the NGC API key from it, a key in the run conf does not reach the triggerer')
+
+    def defer_to_job(self, job_response, org, team, max_poll_interval, **next_kwargs):
+        '''Hands the submitted job to the triggerer; `execute_complete` resumes with *next_kwargs*'''
+        job_id = job_response['job']['id']
+        self.log.info('Submitted NGC job %s, deferring until it finishes', job_id)
+        self.defer(
+            trigger=NGCJobTrigger(org, job_id, team=team, max_poll_interval=max_poll_interval,
+                                  api_key_variable=self.ngc_api_key_variable),
+            method_name='execute_complete',
+            kwargs=next_kwargs or None,
+        )
+
+    def execute_complete(self, context, event):
+        #the job wrote to its workspaces while we were deferred
+        invalidate_workspace_index()
+
+        job_id, job_status = event['job_id'], event['status']
+        if job_status != 'FINISHED_SUCCESS':
+            raise AirflowException(f"NGC job {job_id} ended with status {job_status}: {event.get('message', '')}")
+        self.log.info('NGC job %s finished successfully', job_id)
+        return job_id
+
+
+class NGCStageOperator(NGCJobOperator):
+    '''Deferrable counterpart of a PythonOperator running a memoized stage (see stage_manifest.py),
+    for long training and inference jobs. *python_callable* is called like a PythonOperator's,
+    with the task instance and the templated *op_kwargs* minus `team`, and returns the stage
+    planned by `plan_stage`. A current stage is skipped without a job; otherwise its job, which
+    writes the stage's marker, is submitted and the task defers until it ends. Returns a
+    JobResult like the PythonOperator tasks, and fails unless the job finished successfully.'''
+
+    template_fields = ('op_kwargs',)
+
+    def __init__(self, *, python_callable, op_kwargs=None, **kwargs):
+        #the job comes from the planned stage when the task runs
+        super().__init__(ngc_api_key=None, org=None, ace=None, job_name=None, ace_instance=None, docker_image=None,
+                         workspaces=None, job_command=None, **kwargs)
+        self.python_callable = python_callable
+        self.op_kwargs = op_kwargs or {}
+
+    def execute(self, context):
+        ti = context['ti']
+        stage_kwargs = dict(self.op_kwargs)
+        team = stage_kwargs.pop('team', None)
+        ngc_api_key, org = stage_kwargs['ngc_api_key'], stage_kwargs['org']
+        planned = self.python_callable(ti, **stage_kwargs)
+        if planned.current:
+            self.log.info('Stage %s already ran with the same inputs (%s), skipping.', planned.stage, planned.memo_hash)
+            return JobResult.skipped(**planned.result_fields())
+
+        self.check_api_key_variable()
+        submitted = time.time()
+        job_response = ngc_job_request(ti, ngc_api_key, org, planned.job_name, planned.ace_instance, planned.ace_name,
+                                       planned.docker_image, planned.replica_count, planned.workspaces,
+                                       planned.marked_command(), team=team, ports=planned.ports)
+        self.defer_to_job(job_response, org, team, planned.wait_time, stage=planned.stage, submitted=submitted,
+                          fields=planned.result_fields())
+
+    def execute_complete(self, context, event, stage, submitted, fields):
+        invalidate_workspace_index()
+
+        job_status = event['status']
+        self.log.info('Stage %s: %s', stage, job_status)
+        if job_status == 'ERROR':
+            raise AirflowException(f"Could not watch NGC job {event['job_id']}: {event.get('message', '')}")
+        timings = dict(event.get('timings') or {}, submitted=submitted)
+        result = JobResult.from_job({'job': {'id': event['job_id']}}, job_status, timings, **fields)
+        if not result.succeeded:
+            raise AirflowException(f"NGC job {event['job_id']} ({job_status}) did not finish stage {stage}")
+        return result
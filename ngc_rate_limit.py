@@ -0,0 +1,148 @@
+'''Client-side token-bucket limiter for NGC API traffic, shared by every process on an Airflow worker.
+
+The bucket lives in a small state file guarded by an fcntl lock, so all task processes on the
+worker draw from the same budget. A 429 response blocks the whole bucket until its Retry-After
+has passed. Job submissions may use the full bucket while status polls and listings leave a
+reserve untouched, so polling traffic never starves a submission.'''
+
+import os, json, time, asyncio, tempfile, threading
+from email.utils import parsedate_to_datetime
+
+from ngc_token_cache import file_lock
+from ngc_metrics import record_throttle
+
+PRIORITY_SUBMIT = 'submit'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_POLL = 'poll'
+
+#fraction of the bucket each priority has to leave untouched
+_RESERVE = {
+    PRIORITY_SUBMIT: 0.0,
+    PRIORITY_NORMAL: 0.25,
+    PRIORITY_POLL: 0.5,
+}
+
+
+def parse_retry_after(value, default=1.0):
+    '''Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)'''
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimiter:
+    '''Token bucket refilled at *rate* requests/second up to *burst* requests'''
+
+    def __init__(self, rate, burst, state_path):
+        self.rate = rate
+        self.burst = burst
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _load(self, now):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {'tokens': self.burst, 'updated': now, 'blocked_until': 0.0}
+        elapsed = max(0.0, now - state['updated'])
+        state['tokens'] = min(self.burst, state['tokens'] + elapsed * self.rate)
+        state['updated'] = now
+        return state
+
+    def _save(self, state):
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _try_acquire(self, priority):
+        '''Takes a token and returns 0, or returns how long to wait before trying again'''
+        with self._lock, file_lock(f'{self.state_path}.lock'):
+            now = time.time()
+            state = self._load(now)
+            if state['blocked_until'] > now:
+                wait = state['blocked_until'] - now
+            else:
+                needed = 1 + _RESERVE[priority] * self.burst
+                if state['tokens'] >= needed:
+                    state['tokens'] -= 1
+                    wait = 0.0
+                else:
+                    wait = (needed - state['tokens']) / self.rate
+            self._save(state)
+            return wait
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        '''Blocks until the bucket allows one more request at *priority*'''
+        throttled = 0.0
+        while True:
+            wait = self._try_acquire(priority)
+            if wait <= 0:
+                break
+            time.sleep(wait)
+            throttled += wait
+        self._record(priority, throttled)
+        return throttled
+
+    async def acquire_async(self, priority=PRIORITY_NORMAL):
+        '''`acquire` for coroutines: the state file is locked in a thread and waits are asyncio
+        sleeps, so the event loop (e.g. a triggerer's) keeps running while throttled'''
+        loop = asyncio.get_running_loop()
+        throttled = 0.0
+        while True:
+            wait = await loop.run_in_executor(None, self._try_acquire, priority)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+            throttled += wait
+        self._record(priority, throttled)
+        return throttled
+
+    def _record(self, priority, throttled):
+        with self._lock:
+            stats = self._stats.setdefault(priority, {'calls': 0, 'throttled_calls': 0, 'throttled_seconds': 0.0})
+            stats['calls'] += 1
+            stats['throttled_calls'] += int(throttled > 0)
+            stats['throttled_seconds'] += throttled
+        record_throttle(priority, throttled)
+
+    def block(self, seconds):
+        '''Stops every process from sending requests for *seconds* (after a 429)'''
+        with self._lock, file_lock(f'{self.state_path}.lock'):
+            now = time.time()
+            state = self._load(now)
+            state['blocked_until'] = max(state['blocked_until'], now + seconds)
+            state['tokens'] = 0.0
+            self._save(state)
+
+    def stats(self):
+        '''Per-priority counts of calls and of time spent throttled in this process'''
+        with self._lock:
+            return {priority: dict(stats) for priority, stats in self._stats.items()}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    '''Returns the worker-wide limiter, or None if NGC_RATE_LIMIT is set to 0'''
+    global _limiter
+    rate = float(os.environ.get('NGC_RATE_LIMIT', 10))
+    if rate <= 0:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            state_dir = os.environ.get('NGC_RATE_LIMIT_DIR') or tempfile.gettempdir()
+            state_path = os.path.join(state_dir, f'ngc_rate_limit_{os.getuid()}.json')
+            _limiter = RateLimiter(rate, float(os.environ.get('NGC_RATE_BURST', 20)), state_path)
+        return _limiter
@@ -1,7 +1,22 @@
-import json, base64, requests, time
+import os, json, base64, time, hashlib
+from ngc_client import get_client
+from ngc_rate_limit import PRIORITY_SUBMIT, PRIORITY_POLL
+from job_polling import is_terminal, next_poll_delay, status_transitions, job_phases, PENDING_STATES
+from ngc_token_cache import get_cached_token
+from ngc_metrics import print_metrics_summary
+from workspace_index import get_workspace_index, invalidate_workspace_index, workspace_item_path
+
+#NGC endpoints, overridable to point the client at another deployment or a local stub
+NGC_API_URL = os.environ.get('NGC_API_URL', 'https://api.ngc.nvidia.com')
+NGC_AUTHN_URL = os.environ.get('NGC_AUTHN_URL', 'https://authn.nvidia.com')
 
 
 def get_token(ngc_api_key, org=None, team=None):
+    '''Returns an auth token for the NGC API key, reusing a cached token until shortly before it expires'''
+    return get_cached_token(ngc_api_key, org, team, lambda: _fetch_token(ngc_api_key, org, team))
+
+
+def _fetch_token(ngc_api_key, org=None, team=None):
     '''Uses NGC API key to generate auth token'''
     scope_list = []
     scope = f'group/ngc:{org}'
@@ -22,8 +37,8 @@ def get_token(ngc_api_key, org=None, team=None):
         'Content-Type': 'application/json',
         'Cache-Control': 'no-cache',
     }
-    url = 'https://authn.nvidia.com/token'
-    response = requests.request("GET", url, headers=headers, params=querystring)
+    url = f'{NGC_AUTHN_URL}/token'
+    response = get_client().request("GET", url, headers=headers, params=querystring, endpoint='token')
     if response.status_code != 200:
         raise Exception("HTTP Error %d: from %s" % (response.status_code, url))
     return json.loads(response.text.encode('utf8'))["token"]
@@ -34,7 +49,7 @@ def create_workspace(ti, ngc_api_key, org, ace, workspace_name):
     
     token = get_token(ngc_api_key, org)
     
-    url = f'https://api.ngc.nvidia.com/v2/org/{org}/workspaces/'
+    url = f'{NGC_API_URL}/v2/org/{org}/workspaces/'
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {token}'
@@ -45,7 +60,8 @@ def create_workspace(ti, ngc_api_key, org, ace, workspace_name):
         'name': workspace_name
     }
     
-    response = requests.request("POST", url, headers=headers, data=json.dumps(data))
+    response = get_client().request("POST", url, headers=headers, data=json.dumps(data), priority=PRIORITY_SUBMIT,
+                                    endpoint='create_workspace', token_scope=(ngc_api_key, org))
     print(f'Workspace response: {response}')
 
     if response.status_code != 200:
@@ -58,13 +74,14 @@ def get_existing_workspace(ti, ngc_api_key, org, workspace_name):
 
     token = get_token(ngc_api_key, org)
 
-    url = f'https://api.ngc.nvidia.com/v2/org/{org}/workspaces/{workspace_name}'
+    url = f'{NGC_API_URL}/v2/org/{org}/workspaces/{workspace_name}'
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {token}'
     }
 
-    response = requests.request("GET", url, headers=headers)
+    response = get_client().request("GET", url, headers=headers, endpoint='get_workspace',
+                                    token_scope=(ngc_api_key, org))
 
     #ok if status code is 404. We use this later on to decide if we should create a new wksp
     if response.status_code != 200 and response.status_code != 404:
@@ -72,49 +89,168 @@ def get_existing_workspace(ti, ngc_api_key, org, workspace_name):
     return response.json()
 
 
-def get_workspace_contents(ngc_api_key, org, workspace_id, page_size=800):
-    '''Get all files in a workspace's directory from NGC. Limited up to *page_size* files.'''
+def get_workspace_contents(ngc_api_key, org, workspace_id, page_size=800, page_token=None, path=None):
+    '''Get one page of files in a workspace's directory from NGC (up to *page_size* files).
+    Pass the previous page's `nextPageToken` as *page_token* to fetch the following page.'''
 
     token = get_token(ngc_api_key, org)
-    url = f'https://api.ngc.nvidia.com/v2/org/{org}/workspaces/{workspace_id}/listFiles'
+    url = f'{NGC_API_URL}/v2/org/{org}/workspaces/{workspace_id}/listFiles'
     params={
         'flat-dir': True, 
         'page-size': page_size
     }
+    if page_token:
+        params['page-token'] = page_token
+    if path:
+        params['path'] = path
     
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {token}'
     }
 
-    response = requests.request("GET", url, headers=headers, params=params)
+    response = get_client().request("GET", url, headers=headers, params=params, priority=PRIORITY_POLL,
+                                    endpoint='list_files', token_scope=(ngc_api_key, org))
     if response.status_code != 200:
         raise Exception("HTTP Error %d: from '%s'" % (response.status_code, url))
     return response.json()
 
 
-def find_file_in_workspace(ngc_api_key, org, workspace_id, filename):
-    '''Goes through all contents in an NGC workspace to search for the file specified in filename parameter'''
+def iter_workspace_contents(ngc_api_key, org, workspace_id, prefix=None, page_size=800):
+    '''Lazily yields every storage object in an NGC workspace, following pagination tokens
+    one page at a time. If *prefix* is given (e.g. 'training_info/checkpoints/'), only objects
+    under that path are listed.'''
+
+    prefix = prefix.lstrip('/') if prefix else None
+    page_token = None
+    while True:
+        page = get_workspace_contents(ngc_api_key, org, workspace_id, page_size, page_token, prefix)
+        for workspace_item in page.get('storageObjects', []):
+            #the server-side path filter may be coarser than a prefix match, so filter here too
+            if prefix is None or workspace_item_path(workspace_item).startswith(prefix):
+                yield workspace_item
 
-    contents=get_workspace_contents(ngc_api_key, org, workspace_id)['storageObjects']
-    for workspace_item in contents:
-        if workspace_item['name'] == filename:
-            print(f"Found {filename} already existing in workspace.")
-            return True
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def find_file_in_workspace(ngc_api_key, org, workspace_id, filename, prefix=None):
+    '''Checks the workspace index for the file specified in filename parameter. The workspace is
+    listed at most once per index TTL no matter how many files are checked.'''
+
+    if get_workspace_index(ngc_api_key, org, workspace_id).exists(filename, prefix):
+        print(f"Found {filename} already existing in workspace.")
+        return True
     return False #file does not exist in workspace
 
 
+def get_workspace_file(ngc_api_key, org, workspace_id, path):
+    '''Downloads one file from an NGC workspace and returns its contents as bytes, or None if
+    the file does not exist. *path* is relative to the workspace root. NGC's API reference does
+    not document this endpoint: only the warm executor uses it, after probing it (see
+    warm_executor.py); stages move data through jobs that mount the workspace.'''
+
+    token = get_token(ngc_api_key, org)
+    url = f'{NGC_API_URL}/v2/org/{org}/workspaces/{workspace_id}/file/{path.lstrip("/")}'
+    headers = {
+        'Authorization': f'Bearer {token}'
+    }
+
+    response = get_client().request("GET", url, headers=headers, endpoint='get_workspace_file',
+                                    token_scope=(ngc_api_key, org))
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise Exception("HTTP Error %d: from '%s'" % (response.status_code, url))
+    return response.content
+
+
+def put_workspace_file(ngc_api_key, org, workspace_id, path, content):
+    '''Uploads *content* (bytes) as one file of an NGC workspace, through the same file endpoint
+    `get_workspace_file` downloads from, so the same caveat applies. *path* is relative to the
+    workspace root.'''
+
+    token = get_token(ngc_api_key, org)
+    url = f'{NGC_API_URL}/v2/org/{org}/workspaces/{workspace_id}/file/{path.lstrip("/")}'
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'Authorization': f'Bearer {token}'
+    }
+
+    response = get_client().request("PUT", url, headers=headers, data=content, priority=PRIORITY_SUBMIT,
+                                    endpoint='put_workspace_file', token_scope=(ngc_api_key, org))
+    if response.status_code not in (200, 201, 204):
+        raise Exception("HTTP Error %d: from '%s'" % (response.status_code, url))
+    invalidate_workspace_index(workspace_id)
+
+
+def job_idempotency_key(ti, job_spec):
+    '''Deterministic job label for one Airflow task in one DAG run and one job spec. It is the same
+    for every try of the task, so a retry can find the job an earlier try submitted.'''
+
+    spec_hash = hashlib.sha256(json.dumps(job_spec, sort_keys=True).encode('utf-8')).hexdigest()
+    task_key = f'{ti.dag_id}/{ti.run_id}/{ti.task_id}/{getattr(ti, "map_index", -1)}/{spec_hash}'
+    return 'airflow_' + hashlib.sha256(task_key.encode('utf-8')).hexdigest()[:24]
+
+
+def _job_labels(job):
+    job_definition = job.get('jobDefinition', {})
+    return job_definition.get('userLabels') or job.get('userLabels') or []
+
+
+def find_job_by_label(ngc_api_key, org, label, team=None, page_size=100):
+    '''Finds the most relevant NGC job carrying the user label *label*: an active job if there is one,
+    otherwise one that finished successfully. Returns it shaped like a job submission response, or None.
+    Every page of the job list is read, following pagination tokens as `iter_workspace_contents` does.'''
+
+    token = get_token(ngc_api_key, org, team)
+    if team:
+        url = f'{NGC_API_URL}/v2/org/{org}/team/{team}/jobs'
+    else:
+        url = f'{NGC_API_URL}/v2/org/{org}/jobs'
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {token}'
+    }
+    params = {
+        'user-labels': label,
+        'page-size': page_size
+    }
+
+    jobs = []
+    while True:
+        response = get_client().request("GET", url, headers=headers, params=params, priority=PRIORITY_SUBMIT,
+                                        endpoint='list_jobs', token_scope=(ngc_api_key, org, team))
+        if response.status_code != 200:
+            raise Exception("HTTP Error %d: from '%s'" % (response.status_code, url))
+        page = response.json()
+
+        #the label filter may not be applied server-side, so match labels here as well
+        jobs += [job for job in page.get('jobs', []) if label in _job_labels(job)]
+        if not page.get('nextPageToken'):
+            break
+        params['page-token'] = page['nextPageToken']
+
+    active = [job for job in jobs if not is_terminal(job['jobStatus']['status'])]
+    succeeded = [job for job in jobs if job['jobStatus']['status'] == 'FINISHED_SUCCESS']
+    matches = active + succeeded
+    return {'job': matches[0]} if matches else None
+
+
 def ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, replica_count, workspaces, \
                     job_command, team=None, multinode=False, array_type=None, total_runtime=None, ports=None):
     
-    '''Creates an NGC job request via API'''
+    '''Creates an NGC job request via API. When called from an Airflow task, the job is labelled
+    with a key derived from the DAG run, task and job spec. A retried task reattaches to an
+    active or successfully finished job with that key instead of launching a duplicate.'''
 
     #authentication 
     token = get_token(ngc_api_key, org, team)
     if team:
-        url = f'https://api.ngc.nvidia.com/v2/org/{org}/team/{team}/jobs/'
+        url = f'{NGC_API_URL}/v2/org/{org}/team/{team}/jobs/'
     else:
-        url = f'https://api.ngc.nvidia.com/v2/org/{org}/jobs/'
+        url = f'{NGC_API_URL}/v2/org/{org}/jobs/'
 
     headers = {
         'Content-Type': 'application/json', 
@@ -157,43 +293,91 @@ def ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, dock
     if multinode:
         data["arrayType"] = array_type
         data["totalRuntime"] = total_runtime
+
+    #look for a job submitted by an earlier try of this task before launching a new one
+    if getattr(ti, 'run_id', None):
+        job_key = job_idempotency_key(ti, data)
+        data["userLabels"] = [job_key]
+        existing_job = find_job_by_label(ngc_api_key, org, job_key, team)
+        if existing_job:
+            job = existing_job['job']
+            print(f"Reattaching to NGC job {job['id']} ({job['jobStatus']['status']}) submitted by an earlier try.")
+            return existing_job
     
-    response = requests.request("POST", url, headers=headers, data=json.dumps(data))
+    response = get_client().request("POST", url, headers=headers, data=json.dumps(data), priority=PRIORITY_SUBMIT,
+                                    endpoint='submit_job', token_scope=(ngc_api_key, org, team))
     if response.status_code != 200:
         raise Exception("HTTP Error %d: from '%s'" % (response.status_code, url))
+
+    #the job writes to its mounted workspaces, so cached listings of them are stale
+    for workspace in workspaces:
+        invalidate_workspace_index(workspace['id'])
     return response.json()
 
 
-def ngc_job_status(ti, ngc_api_key, org, job_id):
-    '''Gets status of NGC Job (e.g., SUCCESS, FAILED, CREATED, etc.)'''
+def ngc_job_info(ti, ngc_api_key, org, job_id):
+    '''Gets the NGC job record: status, status history and job definition'''
     
-    #get a new token each time to make sure the token doesn't expire 
-    #since we have to get NGC job status continously
+    #cached token is refreshed shortly before it expires, so long polling loops stay authenticated
     token = get_token(ngc_api_key, org)
 
-    url = f'https://api.ngc.nvidia.com/v2/org/{org}/jobs/{job_id}'
+    url = f'{NGC_API_URL}/v2/org/{org}/jobs/{job_id}'
     headers = {
         'Content-Type': 'application/json', 
         'Authorization': f'Bearer {token}'
     }
-    response = requests.request("GET", url, headers=headers)
+    response = get_client().request("GET", url, headers=headers, priority=PRIORITY_POLL, endpoint='job_status',
+                                    token_scope=(ngc_api_key, org))
     if response.status_code != 200:
         raise Exception("HTTP Error %d: from '%s'" % (response.status_code, url))
     
-    job_info = response.json()
-    return job_info['job']['jobStatus']['status']
+    return response.json()['job']
 
 
-def wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time, team=None):
-    '''Continually gets NGC job status every `wait_time` seconds until 
-    the job finishes, is killed, or fails'''
+def ngc_job_status(ti, ngc_api_key, org, job_id):
+    '''Gets status of NGC Job (e.g., SUCCESS, FAILED, CREATED, etc.)'''
+    return ngc_job_info(ti, ngc_api_key, org, job_id)['jobStatus']['status']
+
+
+def wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time, team=None, timings=None):
+    '''Continually gets NGC job status until the job reaches a terminal state (finishes, is killed, or fails).
+    Queued/starting jobs are polled every few seconds; running jobs are polled with exponential
+    backoff and jitter, never waiting more than `wait_time` seconds between two status calls.
+    If a *timings* dict is given, it receives the job's status transitions from its status history
+    (`transitions`, [[status, epoch seconds], ...]), when the terminal status was seen (`detected`)
+    and the seconds spent queued and running (`queued_seconds`, `run_seconds`).'''
     
     job_id = job_response['job']['id']
-    job_status = ngc_job_status(ti, ngc_api_key, org, job_id)
+    job_info = ngc_job_info(ti, ngc_api_key, org, job_id)
+    job_status = job_info['jobStatus']['status']
+    running_polls = 0
+    started = time.monotonic()
+    left_queue = None if job_status in PENDING_STATES else started
     
-    while job_status != 'FINISHED_SUCCESS' and job_status != 'FAILED' and job_status != 'KILLED_BY_USER':
-        time.sleep(wait_time)
-        job_status=ngc_job_status(ti, ngc_api_key, org, job_id)
+    while not is_terminal(job_status):
+        time.sleep(next_poll_delay(job_status, running_polls, wait_time))
+        running_polls = 0 if job_status in PENDING_STATES else running_polls + 1
+        job_info = ngc_job_info(ti, ngc_api_key, org, job_id)
+        job_status = job_info['jobStatus']['status']
+        if left_queue is None and job_status not in PENDING_STATES:
+            left_queue = time.monotonic()
         print(f'Job status: ', job_status)
-    
+
+    if timings is not None:
+        timings['detected'] = time.time()
+        timings['transitions'] = status_transitions(job_info)
+        phases = job_phases(timings['transitions'])
+        if phases:
+            timings['queued_seconds'] = round(phases['queued'], 1)
+            timings['run_seconds'] = round(phases['running'], 1)
+        else:
+            #no usable status history: fall back to what the polls saw
+            finished = time.monotonic()
+            left_queue = finished if left_queue is None else left_queue
+            timings['queued_seconds'] = round(left_queue - started, 1)
+            timings['run_seconds'] = round(finished - left_queue, 1)
+
+    #drop cached listings so skip checks downstream see the job's outputs
+    invalidate_workspace_index()
+    print_metrics_summary()
     return job_status
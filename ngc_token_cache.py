@@ -0,0 +1,125 @@
+'''Expiry-aware cache for NGC auth tokens shared by every thread and process on an Airflow worker.
+
+Tokens are keyed by (api key, org, team scope). Each process keeps an in-memory copy and a
+per-user cache directory holds the latest token for each key, so a token fetched by one task
+process is reused by the others until shortly before its JWT expiry.'''
+
+import os, json, time, base64, hashlib, tempfile, threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: #non-POSIX workers fall back to the in-process cache only
+    fcntl = None
+
+#refresh tokens this many seconds before they expire so in-flight requests never carry a stale token
+REFRESH_MARGIN = 120
+#lifetime assumed for tokens whose expiry cannot be decoded
+DEFAULT_TTL = 300
+
+_lock = threading.Lock()
+_tokens = {}
+_stats = {'hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+def token_expiry(token):
+    '''Decodes the `exp` claim (epoch seconds) of a JWT without verifying it. Returns None if it can't be read.'''
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _cache_key(ngc_api_key, org, team):
+    '''Hashes the token scope so the api key never appears in file names'''
+    scope = f'{ngc_api_key}\0{org}\0{team or ""}'
+    return hashlib.sha256(scope.encode('utf-8')).hexdigest()
+
+
+def _cache_dir():
+    path = os.environ.get('NGC_TOKEN_CACHE_DIR') or \
+        os.path.join(tempfile.gettempdir(), f'ngc_token_cache_{os.getuid()}')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+@contextmanager
+def file_lock(path):
+    '''Exclusive lock across the processes on the worker (e.g. so only one of them refreshes a given token)'''
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_entry(path):
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        return entry['token'], float(entry['expires_at'])
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _write_entry(path, token, expires_at):
+    '''Atomically replaces the shared cache file (readable by the current user only)'''
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'token': token, 'expires_at': expires_at}, f)
+    os.replace(tmp_path, path)
+
+
+def _is_fresh(entry, now):
+    return entry is not None and entry[1] - REFRESH_MARGIN > now
+
+
+def get_cached_token(ngc_api_key, org, team, fetch_token):
+    '''Returns a valid token for the (api key, org, team) scope, calling *fetch_token()* only
+    when neither this process nor another process on the worker holds a fresh one.'''
+
+    key = _cache_key(ngc_api_key, org, team)
+    with _lock:
+        if _is_fresh(_tokens.get(key), time.time()):
+            _stats['hits'] += 1
+            return _tokens[key][0]
+
+        path = os.path.join(_cache_dir(), key)
+        with file_lock(f'{path}.lock'):
+            #another process may have refreshed the token while we waited for the lock
+            entry = _read_entry(path)
+            if _is_fresh(entry, time.time()):
+                _stats['shared_hits'] += 1
+                _tokens[key] = entry
+                return entry[0]
+
+            _stats['misses'] += 1
+            token = fetch_token()
+            expires_at = token_expiry(token) or time.time() + DEFAULT_TTL
+            _write_entry(path, token, expires_at)
+            _tokens[key] = (token, expires_at)
+            return token
+
+
+def invalidate_token(ngc_api_key, org, team=None):
+    '''Drops a token (e.g. after the API rejected it) so the next call fetches a new one'''
+    key = _cache_key(ngc_api_key, org, team)
+    with _lock:
+        _tokens.pop(key, None)
+        try:
+            os.remove(os.path.join(_cache_dir(), key))
+        except FileNotFoundError:
+            pass
+
+
+def token_cache_stats():
+    '''Hit/miss counters for this process. `shared_hits` are tokens reused from another process.'''
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,53 @@
+'''Airflow trigger that watches an NGC job from the triggerer instead of a worker slot'''
+
+import asyncio, functools
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+
+from ngc_async import shared_client, watch_job
+
+#JSON Airflow Variable holding the NGC API key, the one dag_settings.key_ reads
+API_KEY_VARIABLE = 'key_v'
+
+
+class NGCJobTrigger(BaseTrigger):
+    '''Polls the status of an NGC job with the same adaptive schedule as `wait_for_job_completion`
+    and fires once the job reaches a terminal state, with the job's timings. Failed status calls
+    that may succeed later (5xx, 429, timeouts) are retried; other errors fire an 'ERROR' event.
+
+    Triggers are serialized to the metadata database, so the trigger holds the name of the JSON
+    Airflow Variable with the API key rather than the key, and reads it on the triggerer. A key
+    passed in the DAG run's conf does not reach the triggerer.'''
+
+    def __init__(self, org, job_id, team=None, max_poll_interval=300, api_key_variable=API_KEY_VARIABLE):
+        super().__init__()
+        self.org = org
+        self.job_id = job_id
+        self.team = team
+        self.max_poll_interval = max_poll_interval
+        self.api_key_variable = api_key_variable
+
+    def serialize(self):
+        return ('ngc_trigger.NGCJobTrigger', {
+            'org': self.org,
+            'job_id': self.job_id,
+            'team': self.team,
+            'max_poll_interval': self.max_poll_interval,
+            'api_key_variable': self.api_key_variable,
+        })
+
+    async def _api_key(self):
+        #Variable.get queries the metadata database, which must not block the triggerer's event loop
+        from airflow.models import Variable
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(Variable.get, self.api_key_variable,
+                                                                  deserialize_json=True))
+
+    async def run(self):
+        try:
+            #every NGC trigger on the triggerer shares one token and connection pool
+            client = await shared_client(await self._api_key(), self.org, self.team)
+            job_status, timings = await watch_job(client, self.job_id, self.max_poll_interval)
+        except Exception as e:
+            yield TriggerEvent({'job_id': self.job_id, 'status': 'ERROR', 'message': str(e)})
+            return
+        yield TriggerEvent({'job_id': self.job_id, 'status': job_status, 'timings': timings})
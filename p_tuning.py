@@ -1,35 +1,28 @@
-from ngc_requests import find_file_in_workspace, ngc_job_request, wait_for_job_completion
+from stage_manifest import plan_stage, run_stages
+from nemo_checkpoint import get_base_model_name
+from task_workspace import get_workspace_id
 
     
-def p_tuning_training_bcp(ti, ngc_api_key, org, ace, team=None):
-      '''Launches a p-tuning training job on BCP via NeMo Framework Training container'''
+def plan_p_tuning_training(ti, ngc_api_key, org, ace, ace_instance="dgxa100.80g.2.norm", \
+                           tensor_parallel=2, pipeline_parallel=1):
+      '''Plans a p-tuning training job on BCP via NeMo Framework Training container'''
 
       #get workspace id
       gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-      tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
-
-      #avoid retraining if job has already ran and we have our p-tuned model
-      p_tuned_model_exists=find_file_in_workspace(ngc_api_key, org, tuning_workspace_id, 'p_tuned_gpt3_5b.nemo')
-      if p_tuned_model_exists:
-            return
+      tuning_workspace_id = get_workspace_id(ti)
 
       #get the base LLM from upstream Airflow tasks
-      pretrain_decision=ti.xcom_pull(task_ids='get_base_model')
-      if pretrain_decision=='download_nemo_checkpoint':
-            _,_, gpt_base_model_name=ti.xcom_pull(task_ids='download_nemo_checkpoint') #.nemo file
-      else:
-            raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo checkpoint.')
+      gpt_base_model_name=get_base_model_name(ti) #.nemo file
 
       #ngc job parameters
       job_name = "airflow_p_tuning_gpt3_5b_train"
-      ace_instance = "dgxa100.80g.2.norm"
       ace_name = ace
       docker_image = f"{org}/nemofw-training:23.07-py3"
       replica_count = 1
       workspaces=[{"id":gpt_workspace_id, "mount": "/mount/gpt_workspace"}, 
                   {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
       
-      # Set-up for GPT 5B TP 2 BF16
+      # Set-up for GPT 5B BF16, TP2 unless the model profile says otherwise
       job_command = f"python3 /opt/NeMo-Megatron-Launcher/launcher_scripts/main.py \
             prompt_learning=gpt3/squad \
             stages=[prompt_learning] \
@@ -38,51 +31,44 @@ def p_tuning_training_bcp(ti, ngc_api_key, org, ace, team=None):
             data_dir=/mount/tuning_workspace \
             base_results_dir=/mount/tuning_workspace/p_tuning_results \
             prompt_learning.run.model_train_name=gpt3_5b \
-            prompt_learning.trainer.devices=2 \
+            prompt_learning.trainer.devices={tensor_parallel * pipeline_parallel} \
             prompt_learning.model.language_model_path=/mount/gpt_workspace/gpt_models/{gpt_base_model_name} \
             prompt_learning.model.nemo_path=/mount/tuning_workspace/p_tuning_results/gpt3_5b/prompt_learning_squad/results/p_tuned_gpt3_5b.nemo \
-            prompt_learning.model.tensor_model_parallel_size=2 \
+            prompt_learning.model.tensor_model_parallel_size={tensor_parallel} \
             >> /results/prompt_learning_gpt3_log.txt 2>&1"
       
-      #send ngc job request
-      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+      #plan the ngc job request, skipped if this model was already trained from the same inputs
+      return plan_stage(ti, ngc_api_key, org, 'p_tuning_train', tuning_workspace_id, job_name, \
+                        ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                        wait_time=300, upstream=['download_nemo_checkpoint', 'download_squad_dataset'], \
+                        outputs=['p_tuning_results/gpt3_5b/prompt_learning_squad/results/p_tuned_gpt3_5b.nemo'])
 
-      #wait for job to complete on BCP before allowing airflow to "finish" task
-      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=300, team=team)
 
-      return job_response
+def p_tuning_training_bcp(ti, ngc_api_key, org, ace, team=None, **kwargs):
+      '''Runs the stage of `plan_p_tuning_training` and waits for its job in the task process'''
+      return run_stages(ti, ngc_api_key, org, [plan_p_tuning_training(ti, ngc_api_key, org, ace, **kwargs)], team=team)[0]
 
     
-def p_tuning_inference_bcp(ti, ngc_api_key, org, ace, team=None):
-      '''Launches a p-tuning inference job on BCP via NeMo Framework Training container'''
+def plan_p_tuning_inference(ti, ngc_api_key, org, ace, ace_instance="dgxa100.80g.2.norm", \
+                            tensor_parallel=2, pipeline_parallel=1):
+      '''Plans a p-tuning inference job on BCP via NeMo Framework Training container'''
       
       #get workspace ids
       gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-      tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
-
-      #check if we already have p-tuning inference results in our workspace
-      ptuning_inference_results_exist=find_file_in_workspace(ngc_api_key, org, tuning_workspace_id, 'p_tuned_gpt3_5b_inference.txt')
-      if ptuning_inference_results_exist:
-            return
+      tuning_workspace_id = get_workspace_id(ti)
 
       #get the base LLM from upstream Airflow tasks
-      pretrain_decision=ti.xcom_pull(task_ids='get_base_model')
-      if pretrain_decision=='download_nemo_checkpoint':
-            _,_, gpt_base_model_name=ti.xcom_pull(task_ids='download_nemo_checkpoint') #.nemo file
-      else:
-            raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo checkpoint.')
+      gpt_base_model_name=get_base_model_name(ti) #.nemo file
 
       #ngc job parameters
       job_name = "airflow_p_tuning_gpt3_5b_inference"
-      ace_instance = "dgxa100.80g.2.norm"
       ace_name = ace
       docker_image = f"{org}/nemofw-training:23.07-py3"
       replica_count = 1
       workspaces=[{"id":gpt_workspace_id, "mount": "/mount/gpt_workspace"}, 
                   {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
       
-      # Set-up for GPT 5B TP 2 BF16 with SQuAD dataset
+      # Set-up for GPT 5B BF16 with SQuAD dataset, TP2 unless the model profile says otherwise
       job_command = f"cd ../; python3 opt/NeMo/examples/nlp/language_modeling/megatron_gpt_prompt_learning_eval.py \
                         --config-path=/opt/NeMo/examples/nlp/language_modeling/conf/ \
                         --config-name=megatron_gpt_prompt_learning_inference.yaml \
@@ -90,15 +76,17 @@ def p_tuning_inference_bcp(ti, ngc_api_key, org, ace, team=None):
                         virtual_prompt_model_file=/mount/tuning_workspace/p_tuning_results/gpt3_5b/prompt_learning_squad/results/p_tuned_gpt3_5b.nemo \
                         data_paths=['/mount/tuning_workspace/SQuAD/v1.1/squad_test.jsonl'] \
                         pred_file_path=/mount/tuning_workspace/p_tuning_results/gpt3_5b/prompt_learning_squad/results/p_tuned_gpt3_5b_inference.txt \
-                        trainer.devices=2 \
-                        tensor_model_parallel_size=2 \
-                        pipeline_model_parallel_size=1"
+                        trainer.devices={tensor_parallel * pipeline_parallel} \
+                        tensor_model_parallel_size={tensor_parallel} \
+                        pipeline_model_parallel_size={pipeline_parallel}"
       
-      #send ngc job request
-      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+      #plan the ngc job request, skipped if this model's predictions are already in the workspace
+      return plan_stage(ti, ngc_api_key, org, 'p_tuning_inference', tuning_workspace_id, job_name, \
+                        ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                        wait_time=300, upstream=['p_tuning_train'], \
+                        outputs=['p_tuning_results/gpt3_5b/prompt_learning_squad/results/p_tuned_gpt3_5b_inference.txt'])
 
-      #wait for job to complete on BCP before allowing airflow to "finish" task
-      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=300, team=team)
 
-      return job_response
\ No newline at end of file
+def p_tuning_inference_bcp(ti, ngc_api_key, org, ace, team=None, **kwargs):
+      '''Runs the stage of `plan_p_tuning_inference` and waits for its job in the task process'''
+      return run_stages(ti, ngc_api_key, org, [plan_p_tuning_inference(ti, ngc_api_key, org, ace, **kwargs)], team=team)[0]
\ No newline at end of file
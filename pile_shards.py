@@ -0,0 +1,177 @@
+'''Shard-level, resumable data preparation of The Pile for GPT pretraining.
+
+Instead of one multi-node launcher job over every file (data_preparation.file_numbers='0-29'),
+the shards are split into groups and each group is one mapped Airflow task running one NGC job,
+with the number of concurrent jobs capped by an Airflow pool. Inside a job the shards are
+pipelined: while one shard is tokenized, the next one downloads and extracts. At most two
+extracted shards are on disk at a time.
+
+    download      wget -c of <nn>.jsonl.zst (resumes a partial file), then its SHA-256
+    extract       zstd -d, removing the .zst
+    preprocess    NeMo's preprocess_data_for_megatron.py into my-gpt3_<nn>_text_document.bin/.idx
+                  (the names the launcher's gpt3 training configs read), removing the .jsonl
+
+A shard that finishes writes data/pile_checksums/<nn>.sha256 (sha256sum format: the download and
+both outputs) and its own stage marker (see stage_manifest.py). Its memo hash covers the URL, the
+preprocessing command, the container and the BPE vocabulary, so a rerun or a task retry only
+prepares the shards that are missing or failed; shards that finished in a failed job are kept.
+
+The pool (PILE_POOL) has to exist before the first run, since Airflow never schedules the tasks
+of a missing pool; size it to the concurrent CPU jobs the ACE should take, e.g.
+
+    airflow pools set pile_data_prep 4 "Concurrent Pile data preparation jobs"
+
+Until train_gpt_model is implemented, download_pile_dataset fails unless the run's conf sets
+prepare_pile_only_v (see pretrain_gpt.py).'''
+
+import time
+
+from ngc_requests import ngc_job_request, wait_for_job_completion
+from workspace_index import invalidate_workspace_index
+from stage_manifest import stage_hash, stage_is_current, marker_path, MANIFEST_DIR
+from job_result import JobResult
+
+PILE_URL = 'https://the-eye.eu/public/AI/pile/train/'
+FILE_NUMBERS = '0-29'
+#shards prepared one after another (pipelined) by each job, and the pool capping concurrent jobs
+SHARDS_PER_JOB = 3
+PILE_POOL = 'pile_data_prep'
+
+DATA_MOUNT = '/mount_workspace'
+DATA_DIR = 'data'
+CHECKSUM_DIR = f'{DATA_DIR}/pile_checksums'
+VOCAB_FILE = f'{DATA_DIR}/bpe/vocab.json'
+MERGES_FILE = f'{DATA_DIR}/bpe/merges.txt'
+DOCKER_IMAGE = 'nemofw-training:23.07-py3'
+
+
+def parse_file_numbers(file_numbers):
+    '''Shard numbers of a launcher-style file_numbers setting, e.g. '0-29' or '0,3,5-7' '''
+    shards = []
+    for part in str(file_numbers).split(','):
+        first, _, last = part.strip().partition('-')
+        shards += range(int(first), int(last or first) + 1)
+    return sorted(set(shards))
+
+
+def shard_groups(file_numbers=FILE_NUMBERS, shards_per_job=SHARDS_PER_JOB):
+    '''Shard numbers split into the groups each mapped task prepares'''
+    shards = parse_file_numbers(file_numbers)
+    return [shards[start:start + shards_per_job] for start in range(0, len(shards), shards_per_job)]
+
+
+def shard_outputs(shard):
+    '''Workspace paths a prepared shard leaves behind'''
+    prefix = f'{DATA_DIR}/my-gpt3_{shard:02d}_text_document'
+    return [f'{prefix}.bin', f'{prefix}.idx', f'{CHECKSUM_DIR}/{shard:02d}.sha256']
+
+
+def preprocess_command(shard):
+    data = f'{DATA_MOUNT}/{DATA_DIR}'
+    return f"python3 /opt/NeMo/scripts/nlp_language_modeling/preprocess_data_for_megatron.py \
+--input={data}/{shard:02d}.jsonl --json-keys=text --tokenizer-library=megatron --tokenizer-type=GPT2BPETokenizer \
+--vocab-file={DATA_MOUNT}/{VOCAB_FILE} --merge-file={DATA_MOUNT}/{MERGES_FILE} --dataset-impl=mmap \
+--output-prefix={data}/my-gpt3_{shard:02d} --append-eod --workers=$(nproc)"
+
+
+def shard_memo_hash(shard, pile_url, docker_image, vocab_hash):
+    '''Memo hash of one shard: everything that decides its .bin/.idx'''
+    return stage_hash({'shard': shard, 'url': f'{pile_url}{shard:02d}.jsonl.zst', 'command': preprocess_command(shard),
+                       'image': docker_image}, {'download_pile_dataset': vocab_hash})
+
+
+def pending_shards(ngc_api_key, org, workspace_id, shards, pile_url, docker_image, vocab_hash):
+    '''{shard: memo hash} of the shards whose marker or outputs are missing'''
+    hashes = {shard: shard_memo_hash(shard, pile_url, docker_image, vocab_hash) for shard in shards}
+    return {shard: memo_hash for shard, memo_hash in hashes.items()
+            if not stage_is_current(ngc_api_key, org, workspace_id, f'pile_shard_{shard:02d}', memo_hash,
+                                    shard_outputs(shard))}
+
+
+def fetch_command(shard, pile_url):
+    '''Downloads and extracts a shard, recording the download's checksum'''
+    data = f'{DATA_MOUNT}/{DATA_DIR}'
+    name = f'{shard:02d}.jsonl.zst'
+    return f"wget -q -c --tries=5 -O {data}/{name} {pile_url}{name} && \
+( cd {data} && sha256sum {name} ) > {DATA_MOUNT}/{CHECKSUM_DIR}/{shard:02d}.sha256.part && \
+zstd -d -q -f --rm {data}/{name} -o {data}/{shard:02d}.jsonl"
+
+
+def finish_command(shard, memo_hash):
+    '''Preprocesses an extracted shard, then records its checksums and marker'''
+    data = f'{DATA_MOUNT}/{DATA_DIR}'
+    checksums = f'{DATA_MOUNT}/{CHECKSUM_DIR}/{shard:02d}'
+    outputs = f'my-gpt3_{shard:02d}_text_document.bin my-gpt3_{shard:02d}_text_document.idx'
+    return f"{preprocess_command(shard)} && rm -f {data}/{shard:02d}.jsonl && \
+( cd {data} && sha256sum {outputs} ) >> {checksums}.sha256.part && mv {checksums}.sha256.part {checksums}.sha256 && \
+date -u > {DATA_MOUNT}/{marker_path(f'pile_shard_{shard:02d}', memo_hash)}"
+
+
+def group_command(shard_hashes, pile_url):
+    '''Job command preparing *shard_hashes* ({shard: memo hash}) in order. Each shard's
+    download and extraction overlaps the preprocessing of the shard before it, which runs in the
+    background. A failed shard does not stop the others; the job fails at the end if any did.'''
+    lines = [f"set -x; mkdir -p {DATA_MOUNT}/{CHECKSUM_DIR} {DATA_MOUNT}/{MANIFEST_DIR}; status=0; pid=''"]
+    for shard, memo_hash in shard_hashes.items():
+        lines.append(f"if {fetch_command(shard, pile_url)}; then \
+{{ [ -z \"$pid\" ] || wait $pid || status=1; }}; ( {finish_command(shard, memo_hash)} ) & pid=$!; \
+else status=1; fi")
+    lines.append("[ -z \"$pid\" ] || wait $pid || status=1; exit $status")
+    return '; '.join(lines)
+
+
+def prepare_pile_shards(ti, ngc_api_key, org, ace, shards, team=None, pile_url=PILE_URL,
+                        ace_instance="dgxa100.80g.1.norm"):
+    '''Mapped task: prepares the shards of one group that are not current in one NGC job, and
+    raises if any of them did not finish. A retry of the task only prepares those.'''
+
+    workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
+    vocab = ti.xcom_pull(task_ids='download_pile_dataset')
+    docker_image = f"{org}/{DOCKER_IMAGE}"
+    pending = pending_shards(ngc_api_key, org, workspace_id, shards, pile_url, docker_image, vocab.memo_hash)
+    artifacts = [path for shard in shards for path in shard_outputs(shard)]
+    if not pending:
+        print(f"Shards {', '.join(f'{shard:02d}' for shard in shards)} are already prepared, skipping.")
+        return JobResult.skipped(workspace_id=workspace_id, artifacts=artifacts)
+
+    job_name = f"airflow_prepare_pile_{'_'.join(f'{shard:02d}' for shard in pending)}"
+    workspaces = [{'id': workspace_id, 'mount': DATA_MOUNT}]
+    print(f"Preparing shards {', '.join(f'{shard:02d}' for shard in pending)}.")
+    submitted = time.time()
+    job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace, docker_image, 1, workspaces, \
+                                   group_command(pending, pile_url), team=team)
+
+    #a shard takes about an hour, so check every half hour at the latest
+    timings = {'submitted': submitted}
+    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=1800, team=team,
+                                               timings=timings)
+
+    #shards that finished left their marker, even if the job failed on another one
+    invalidate_workspace_index(workspace_id)
+    failed = pending_shards(ngc_api_key, org, workspace_id, pending, pile_url, docker_image, vocab.memo_hash)
+    if failed:
+        raise Exception(f"Job {job_response['job']['id']} ({final_job_status}) did not prepare shards "
+                        f"{', '.join(f'{shard:02d}' for shard in failed)}")
+    return JobResult.from_job(job_response, final_job_status, timings, workspace_id=workspace_id,
+                              artifacts=artifacts)
+
+
+def verify_pile_dataset(ti, ngc_api_key, org, file_numbers=FILE_NUMBERS, pile_url=PILE_URL):
+    '''Checks that every shard is prepared after the mapped tasks ran. Returns a JobResult whose
+    memo hash covers every shard, for the pretraining stage.'''
+
+    workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
+    vocab = ti.xcom_pull(task_ids='download_pile_dataset')
+    shards = parse_file_numbers(file_numbers)
+    docker_image = f"{org}/{DOCKER_IMAGE}"
+    invalidate_workspace_index(workspace_id)
+    missing = pending_shards(ngc_api_key, org, workspace_id, shards, pile_url, docker_image, vocab.memo_hash)
+    if missing:
+        raise Exception(f"Pile shards {', '.join(f'{shard:02d}' for shard in missing)} are not prepared; "
+                        f"clearing their prepare_pile_shards tasks reruns only those")
+
+    memo_hash = stage_hash({f'{shard:02d}': shard_memo_hash(shard, pile_url, docker_image, vocab.memo_hash)
+                            for shard in shards})
+    print(f'All {len(shards)} Pile shards are prepared ({memo_hash}).')
+    return JobResult.skipped(workspace_id=workspace_id, memo_hash=memo_hash,
+                             artifacts=[path for shard in shards for path in shard_outputs(shard)])
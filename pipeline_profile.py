@@ -0,0 +1,231 @@
+'''Critical-path profile of one DAG run: where the time between the first task starting and the
+last task ending went.
+
+Each NGC-backed task returns a JobResult whose timeline holds when the job was submitted, its
+status transitions from NGC's status history and when the task saw it end. Together with the
+task instances' start and end dates this splits every task into phases:
+
+    scheduling   the latest upstream task ending -> this task starting (Airflow's delay)
+    setup        the task starting -> its job being submitted (planning, skip checks, submission)
+    queue        submission -> the job leaving the queue (CREATED, QUEUED, ...)
+    startup      STARTING -> RUNNING (pulling the image, starting the container)
+    run          RUNNING -> the job's terminal status
+    detection    the terminal status -> the task noticing it (polling lag)
+    teardown     noticing it -> the task ending
+
+`profile_pipeline` runs as the last task of a DAG run and writes the profile as JSON and as a
+Gantt chart in HTML to NEMO_PROFILE_DIR. benchmarks/dag_harness.py builds the same profile for
+its emulated runs.'''
+
+import os, json, html, tempfile
+
+from job_result import JobResult
+from job_polling import PENDING_STATES, is_terminal
+
+PHASES = ('scheduling', 'setup', 'queue', 'startup', 'run', 'detection', 'teardown')
+PHASE_COLORS = {
+    'scheduling': '#bdbdbd',
+    'setup': '#90caf9',
+    'queue': '#ffcc80',
+    'startup': '#ffe082',
+    'run': '#66bb6a',
+    'detection': '#ef5350',
+    'teardown': '#b39ddb',
+}
+
+
+def job_segments(result):
+    '''[(phase, start, end), ...] of the NGC job behind a JobResult, in epoch seconds, or [] if
+    the result carries no timeline (skipped stages, results of older tasks)'''
+    timeline = getattr(result, 'timeline', None) or {}
+    submitted, detected = timeline.get('submitted'), timeline.get('detected')
+    if submitted is None or detected is None:
+        return []
+
+    transitions = timeline.get('transitions') or []
+    starting = next((changed for status, changed in transitions if status == 'STARTING'), None)
+    running = next((changed for status, changed in transitions
+                    if status not in PENDING_STATES and not is_terminal(status)), None)
+    ended = next((changed for status, changed in transitions if is_terminal(status)), None)
+    if ended is None:
+        #no status history (e.g. a command run on the warm executor): one run phase up to detection
+        return [('run', submitted, detected)]
+
+    left_queue = running if running is not None else ended
+    starting = starting if starting is not None else left_queue
+    points = [('queue', submitted), ('startup', max(submitted, starting)), ('run', max(submitted, left_queue)),
+              ('detection', max(submitted, ended)), (None, max(submitted, ended, detected))]
+    return [(phase, start, end) for (phase, start), (_, end) in zip(points, points[1:]) if end > start]
+
+
+def task_segments(record, upstream_end=None):
+    '''Phases of one task record (see `build_profile`), from the scheduling delay to the task ending'''
+    start, end = record['start'], record['end']
+    segments = []
+    if upstream_end is not None and start > upstream_end:
+        segments.append(('scheduling', upstream_end, start))
+
+    job = job_segments(record.get('result'))
+    if not job:
+        segments.append(('setup', start, end))
+        return segments
+    #the job ran within the task; clamp against clock skew between NGC and the worker
+    job = [(phase, min(max(seg_start, start), end), min(max(seg_end, start), end)) for phase, seg_start, seg_end in job]
+    segments.append(('setup', start, job[0][1]))
+    segments += job
+    segments.append(('teardown', job[-1][2], end))
+    return [segment for segment in segments if segment[2] > segment[1]]
+
+
+def critical_path(records):
+    '''Chain of tasks that determined the run's length: from the task that ended last, repeatedly
+    the upstream task that ended last before it started. Returns the task ids, first task first.'''
+    by_id = {record['task_id']: record for record in records if record['start'] is not None}
+    if not by_id:
+        return []
+    task_id = max(by_id, key=lambda task_id: by_id[task_id]['end'])
+    path = []
+    while task_id is not None:
+        path.append(task_id)
+        upstream = [by_id[upstream_id] for upstream_id in by_id[task_id]['upstream'] if upstream_id in by_id]
+        task_id = max(upstream, key=lambda record: record['end'])['task_id'] if upstream else None
+    return path[::-1]
+
+
+def build_profile(records, time_scale=1.0):
+    '''Profile of a run from one record per task: {task_id, state, start, end (epoch seconds or None),
+    upstream (task ids), result (the task's return value)}. Times in the profile are seconds from
+    the run's first task starting, divided by *time_scale* (the emulator harness compresses time).'''
+    ran = [record for record in records if record['start'] is not None and record['end'] is not None]
+    if not ran:
+        return {'tasks': [], 'critical_path': {'tasks': [], 'length': 0.0, 'phases': {}}, 'wall_time': 0.0,
+                'detection_lag': 0.0}
+    by_id = {record['task_id']: record for record in ran}
+    origin = min(record['start'] for record in ran)
+    to_run_time = lambda timestamp: round((timestamp - origin) / time_scale, 1)
+    to_seconds = lambda seconds: round(seconds / time_scale, 1)
+
+    tasks = []
+    for record in ran:
+        upstream_ends = [by_id[upstream_id]['end'] for upstream_id in record['upstream'] if upstream_id in by_id]
+        segments = task_segments(record, max(upstream_ends) if upstream_ends else None)
+        phases = {}
+        for phase, start, end in segments:
+            phases[phase] = phases.get(phase, 0.0) + end - start
+        result = record.get('result')
+        tasks.append({
+            'task_id': record['task_id'],
+            'state': record['state'],
+            'start': to_run_time(record['start']),
+            'end': to_run_time(record['end']),
+            'job_id': getattr(result, 'job_id', None),
+            'job_status': getattr(result, 'status', None),
+            'segments': [[phase, to_run_time(start), to_run_time(end)] for phase, start, end in segments],
+            'phases': {phase: to_seconds(seconds) for phase, seconds in phases.items()},
+        })
+
+    path = critical_path(ran)
+    on_path = [task for task in tasks if task['task_id'] in path]
+    path_phases = {phase: round(sum(task['phases'].get(phase, 0.0) for task in on_path), 1) for phase in PHASES}
+    first = by_id[path[0]]['start'] if path else origin
+    last = by_id[path[-1]]['end'] if path else origin
+    return {
+        'tasks': tasks,
+        'critical_path': {'tasks': path, 'length': to_seconds(last - first), 'phases': path_phases},
+        'wall_time': to_seconds(max(record['end'] for record in ran) - origin),
+        'detection_lag': round(sum(task['phases'].get('detection', 0.0) for task in tasks), 1),
+    }
+
+
+def render_html(profile, title='Pipeline profile'):
+    '''Self-contained Gantt chart of a profile: one row per task, one bar per phase'''
+    span = max([profile['wall_time']] + [task['end'] for task in profile['tasks']]) or 1.0
+    path = set(profile['critical_path']['tasks'])
+    rows = []
+    for task in sorted(profile['tasks'], key=lambda task: task['start']):
+        bars = ''.join(
+            f'<div class="bar" title="{phase}: {end - start:.1f} s" style="left:{100 * start / span:.3f}%;'
+            f'width:{max(100 * (end - start) / span, 0.05):.3f}%;background:{PHASE_COLORS[phase]}"></div>'
+            for phase, start, end in task['segments'])
+        label = html.escape(task['task_id'])
+        rows.append(f'<tr class="{"critical" if task["task_id"] in path else ""}"><th>{label}</th>'
+                    f'<td>{html.escape(str(task["state"]))}</td><td class="num">{task["end"] - task["start"]:.1f}</td>'
+                    f'<td class="lane">{bars}</td></tr>')
+    legend = ''.join(f'<span><i style="background:{color}"></i>{phase}</span>' for phase, color in PHASE_COLORS.items())
+    phases = ', '.join(f'{phase} {seconds:.1f} s' for phase, seconds in profile['critical_path']['phases'].items()
+                       if seconds)
+    return f'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+body {{font-family: sans-serif; font-size: 13px; margin: 20px}}
+table {{border-collapse: collapse; width: 100%}}
+th {{text-align: left; font-weight: normal; white-space: nowrap; padding-right: 12px}}
+td {{padding: 2px 8px 2px 0}}
+td.num {{text-align: right}}
+tr.critical th {{font-weight: bold}}
+td.lane {{position: relative; width: 70%; height: 16px; background: #f5f5f5}}
+.bar {{position: absolute; top: 2px; bottom: 2px}}
+.legend span {{margin-right: 12px}}
+.legend i {{display: inline-block; width: 10px; height: 10px; margin-right: 4px}}
+</style></head><body>
+<h2>{html.escape(title)}</h2>
+<p>Wall time {profile["wall_time"]:.1f} s. Critical path {profile["critical_path"]["length"]:.1f} s ({phases}):
+{html.escape(" -> ".join(profile["critical_path"]["tasks"]))}. Detection lag over all tasks
+{profile["detection_lag"]:.1f} s.</p>
+<p class="legend">{legend}</p>
+<table><tr><th>task</th><td>state</td><td class="num">seconds</td><td></td></tr>
+{"".join(rows)}
+</table></body></html>
+'''
+
+
+def write_profile(profile, output_dir, name, title=None):
+    '''Writes <name>.json and <name>.html to *output_dir*; returns their paths'''
+    os.makedirs(output_dir, exist_ok=True)
+    json_path, html_path = os.path.join(output_dir, f'{name}.json'), os.path.join(output_dir, f'{name}.html')
+    with open(json_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    with open(html_path, 'w') as f:
+        f.write(render_html(profile, title or name))
+    return json_path, html_path
+
+
+def profile_pipeline(ti, output_dir=None):
+    '''Profiles the DAG run this task belongs to from its task instances and their JobResults.
+    Writes the profile to *output_dir* (default: NEMO_PROFILE_DIR, or the temp directory),
+    prints the critical path and returns the path's phase totals.'''
+
+    dag = ti.task.dag
+    records = {}
+    for task_instance in ti.get_dagrun().get_task_instances():
+        if task_instance.task_id == ti.task_id or not task_instance.start_date or not task_instance.end_date:
+            continue
+        start, end = task_instance.start_date.timestamp(), task_instance.end_date.timestamp()
+        record = records.get(task_instance.task_id)
+        if record:
+            #mapped task instances are profiled as one task spanning all of them
+            record['start'], record['end'] = min(record['start'], start), max(record['end'], end)
+            continue
+        result = None
+        if getattr(task_instance, 'map_index', -1) < 0:
+            value = ti.xcom_pull(task_ids=task_instance.task_id)
+            result = value if isinstance(value, JobResult) else None
+        records[task_instance.task_id] = {
+            'task_id': task_instance.task_id,
+            'state': task_instance.state,
+            'start': start,
+            'end': end,
+            'upstream': sorted(dag.get_task(task_instance.task_id).upstream_task_ids),
+            'result': result,
+        }
+
+    profile = build_profile(list(records.values()))
+    name = f'{ti.dag_id}_{ti.run_id}'.replace(':', '_').replace('+', '_').replace('/', '_')
+    output_dir = output_dir or os.environ.get('NEMO_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'nemo_profiles')
+    json_path, html_path = write_profile(profile, output_dir, name, f'{ti.dag_id} {ti.run_id}')
+
+    critical = profile['critical_path']
+    print(f"Critical path {critical['length']} s: {' -> '.join(critical['tasks'])}")
+    print(', '.join(f'{phase} {seconds} s' for phase, seconds in critical['phases'].items()))
+    print(f'Profile written to {json_path} and {html_path}')
+    return critical
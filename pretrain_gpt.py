@@ -4,54 +4,39 @@ performing p-tuning on it'''
 import os, json, base64, requests, time
 from datetime import datetime
 from ngc_requests import create_workspace, ngc_job_request, wait_for_job_completion
+from stage_manifest import run_stage
+from pile_shards import VOCAB_FILE, MERGES_FILE, DATA_MOUNT, DOCKER_IMAGE
+
+VOCAB_URL = 'https://huggingface.co/gpt2/resolve/main/vocab.json'
+MERGES_URL = 'https://huggingface.co/gpt2/resolve/main/merges.txt'
     
 
-# NEEDS TO BE RUN + TESTED ON AIRFLOW
-def download_pile_dataset(ti, ngc_api_key, org, ace, team=None):
-     raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo checkpoint.')
-     
-     #create workspace to download the pile dataset into
-    #  workspace_name = 'the_pile_dataset_airflow'
-    #  pile_data_workspace = create_workspace(ti, ngc_api_key, org, ace, workspace_name)
-    #  workspace_id = pile_data_workspace['workspace']['id']
+def download_pile_dataset(ti, ngc_api_key, org, ace, team=None, prepare_data_only=False):
+     '''Fetches the GPT2 BPE vocabulary into the GPT workspace in an NGC job. The Pile itself
+     is prepared shard by shard by the mapped prepare_pile_shards tasks that follow (see pile_shards.py);
+     the returned memo hash is part of every shard's, so a new vocabulary re-tokenizes them all.
+
+     train_gpt_model is not implemented yet, so this fails before hours of data preparation unless
+     *prepare_data_only* is set (templated values arrive as 'True'/'False').'''
+
+     if str(prepare_data_only) != 'True':
+          raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo '
+                                    'checkpoint, or set prepare_pile_only_v in the run conf to only prepare The Pile.')
 
      workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
 
-     #job parameters
-     job_name = "download_the_pile_dataset_airflow"
-     ace_instance = "dgxa100.80g.8.norm"
-     ace_name = ace
-     docker_image = f"{org}/nemofw-training:23.07-py3" 
-     replica_count = 4 #number of nodes
-     total_runtime = "10h"
-     array_type = "PYTORCH"
-     multinode=True
-     workspaces=[{'id': workspace_id, 'mount': '/mount_workspace'}]
-     job_command = "\
-                    set -x && \
-                    mkdir -p /mount_workspace/data/bpe && \
-                    wget https://huggingface.co/gpt2/resolve/main/vocab.json -O /mount_workspace/data/bpe/vocab.json && \
-                    wget https://huggingface.co/gpt2/resolve/main/merges.txt -O /mount_workspace/data/bpe/merges.txt && \
-                    python3 /opt/NeMo-Megatron-Launcher/launcher_scripts/main.py \
-                    cluster_type=bcp \
-                    stages=[data_preparation] \
-                    launcher_scripts_path=/opt/NeMo-Megatron-Launcher/launcher_scripts \
-                    data_dir=/mount_workspace/data \
-                    base_results_dir=/mount_workspace/results \
-                    data_preparation.run.node_array_size=${NGC_ARRAY_SIZE} \
-                    data_preparation.the_pile_url=https://the-eye.eu/public/AI/pile/train/ \
-                    data_preparation.file_numbers='0-29' \
-                    data_preparation.rm_downloaded=True \
-                    data_preparation.rm_extracted=True \
-                    data_preparation.tokenizer_type=GPT2BPETokenizer"
-     
-     job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, replica_count, \
-                    workspaces, job_command, team, multinode, array_type, total_runtime)
-     
-     #get a job status update from ngc every hour
-     final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=3600, team=team)
+     #ngc job parameters; the container and mount match the shard preparation jobs
+     job_name = "airflow_download_pile_bpe"
+     ace_instance = "dgxa100.80g.1.norm"
+     docker_image = f"{org}/{DOCKER_IMAGE}"
+     workspaces = [{'id': workspace_id, 'mount': DATA_MOUNT}]
+     job_command = f"mkdir -p {DATA_MOUNT}/{os.path.dirname(VOCAB_FILE)} && \
+wget -q --tries=5 -O {DATA_MOUNT}/{VOCAB_FILE} {VOCAB_URL} && \
+wget -q --tries=5 -O {DATA_MOUNT}/{MERGES_FILE} {MERGES_URL}"
 
-     return job_response, workspace_id
+     #skipped when the vocabulary was already fetched from the same URLs
+     return run_stage(ti, ngc_api_key, org, 'pile_bpe', workspace_id, job_name, ace_instance, ace, docker_image, 1, \
+                      workspaces, job_command, wait_time=60, team=team, outputs=[VOCAB_FILE, MERGES_FILE])
 
 # NEEDS TO BE RUN + TESTED ON AIRFLOW
 def train_gpt_model(ti, ngc_api_key, org, ace, team=None):
@@ -91,10 +76,8 @@ def train_gpt_model(ti, ngc_api_key, org, ace, team=None):
      
      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, replica_count, \
                     workspaces, job_command, team, multinode, array_type, total_runtime)
-     #get a job status update from ngc twice a day
-     #NOTE: we should probably make this an external dag because of the risk of leaving the dag hanging
-     #for too long while we wait for the last status update
-     interval = 60 * 60 * 12 
+     #poll with backoff, checking at least every 30 minutes so a failure is noticed within the half hour
+     interval = 60 * 30 
      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=interval, team=team)
 
      return job_response
\ No newline at end of file
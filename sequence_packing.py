@@ -0,0 +1,179 @@
+'''Offline sequence packing of SFT-format SQuAD (squad_train.jsonl) for LoRA and SFT training.
+
+Examples are tokenized the way NeMo's SFT dataset does it: the prompt "{input} {output}" with the
+input and the answer tokenized separately, and an EOS token at the end. First-fit-decreasing then
+bin-packs them into sequences of at most `max_seq_length` tokens: longest example first, each into
+the first open sequence with room for it. A segment tree over the sequences' free space finds that
+sequence in O(log n), so packing the whole training set takes about a second.
+
+The output is NeMo's packed dataset format (GPTSFTPackedDataset, `packed_sequence=True`): an
+.npy object array with one record per packed sequence:
+
+    input_ids     token ids of the packed examples, back to back
+    loss_mask     1 for answer tokens (and EOS), 0 for prompt tokens
+    seq_start_id  start of each example in input_ids; the attention mask and position ids restart
+                  at every boundary, so packed examples never attend to each other
+
+A metadata file next to it reports the packing efficiency against padding every example to
+`max_seq_length`.
+
+    python sequence_packing.py --input SQuAD/v1.1/squad_train.jsonl --max-seq-length 2048
+        # writes SQuAD/v1.1/squad_train_packed_2048.npy and squad_train_packed_2048_metadata.json
+'''
+
+import os, json, argparse
+
+import numpy as np
+
+from token_cache import encode
+
+#bump when the packed format or the packing changes, so memoized packing stages rerun
+PACKING_VERSION = 1
+
+
+class _FreeSpaceTree:
+    '''Max segment tree over the free space of *size* bins that all start with *capacity*'''
+
+    def __init__(self, size, capacity):
+        self.leaves = 1
+        while self.leaves < size:
+            self.leaves *= 2
+        self.tree = [0] * (2 * self.leaves)
+        for leaf in range(size):
+            self.tree[self.leaves + leaf] = capacity
+        for node in range(self.leaves - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def first_fit(self, length):
+        '''Leftmost bin with at least *length* free, or None'''
+        if self.tree[1] < length:
+            return None
+        node = 1
+        while node < self.leaves:
+            node = 2 * node if self.tree[2 * node] >= length else 2 * node + 1
+        return node - self.leaves
+
+    def take(self, leaf, length):
+        node = self.leaves + leaf
+        self.tree[node] -= length
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+
+def first_fit_decreasing(lengths, capacity):
+    '''Bins of item indices such that no bin holds more than *capacity*. Items go in decreasing
+    length order, each into the first bin it fits; an unopened bin is just a bin with all of
+    *capacity* free, so opening one is the same first-fit query. Ties keep the input order.'''
+    if any(length > capacity for length in lengths):
+        raise ValueError(f'Items longer than the capacity {capacity} cannot be packed')
+    order = sorted(range(len(lengths)), key=lambda item: -lengths[item])
+    tree = _FreeSpaceTree(len(lengths), capacity)
+    bins = []
+    for item in order:
+        leaf = tree.first_fit(lengths[item])
+        tree.take(leaf, lengths[item])
+        if leaf == len(bins):
+            bins.append([])
+        bins[leaf].append(item)
+    return bins
+
+
+def _eos_id(tokenizer):
+    #NeMo tokenizers call it eos_id, HuggingFace's eos_token_id
+    eos_id = getattr(tokenizer, 'eos_id', None)
+    return eos_id if eos_id is not None else tokenizer.eos_token_id
+
+
+def tokenize_examples(jsonl_path, tokenizer, max_seq_length):
+    '''(token ids, answer start) of every {"input", "output"} record. Examples longer than
+    *max_seq_length* lose the end of their prompt, as NeMo truncates the context field; the
+    answer is kept whole unless it alone is too long. Returns the examples and how many were
+    truncated.'''
+    eos_id = _eos_id(tokenizer)
+    examples, truncated = [], 0
+    with open(jsonl_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            prompt = encode(tokenizer, record['input'])
+            answer = (encode(tokenizer, f" {record['output']}") + [eos_id])[:max_seq_length]
+            if len(prompt) + len(answer) > max_seq_length:
+                prompt = prompt[:max_seq_length - len(answer)]
+                truncated += 1
+            examples.append((np.asarray(prompt + answer, dtype=np.int32), len(prompt)))
+    return examples, truncated
+
+
+def pack_examples(examples, max_seq_length):
+    '''Packed sequences in NeMo's format, and the bins they came from'''
+    bins = first_fit_decreasing([len(ids) for ids, _ in examples], max_seq_length)
+    packs = []
+    for members in bins:
+        input_ids, loss_mask, seq_start_id = [], [], []
+        for item in members:
+            ids, answer_start = examples[item]
+            seq_start_id.append(len(input_ids))
+            input_ids += ids.tolist()
+            loss_mask += [0] * answer_start + [1] * (len(ids) - answer_start)
+        packs.append({'input_ids': input_ids, 'loss_mask': loss_mask, 'seq_start_id': seq_start_id})
+    return packs, bins
+
+
+def packing_stats(examples, bins, max_seq_length, truncated=0):
+    '''Share of the token slots that hold tokens, packed and padded one example per sequence'''
+    tokens = sum(len(ids) for ids, _ in examples)
+    per_pack = [len(members) for members in bins]
+    return {
+        'examples': len(examples),
+        'truncated_examples': truncated,
+        'tokens': tokens,
+        'max_seq_length': max_seq_length,
+        'packed_sequences': len(bins),
+        'examples_per_sequence': round(len(examples) / max(len(bins), 1), 2),
+        'max_examples_per_sequence': max(per_pack, default=0),
+        'packing_efficiency': round(tokens / max(len(bins) * max_seq_length, 1), 4),
+        'padded_efficiency': round(tokens / max(len(examples) * max_seq_length, 1), 4),
+    }
+
+
+def pack_sft_dataset(jsonl_path, output_path, tokenizer, max_seq_length=2048):
+    '''Tokenizes and packs *jsonl_path* into the .npy file *output_path*, with its statistics in
+    <output_path without .npy>_metadata.json. Returns the statistics.'''
+    examples, truncated = tokenize_examples(jsonl_path, tokenizer, max_seq_length)
+    packs, bins = pack_examples(examples, max_seq_length)
+
+    records = np.empty(len(packs), dtype=object)
+    records[:] = packs
+    np.save(output_path, records, allow_pickle=True)
+
+    stats = dict(packing_stats(examples, bins, max_seq_length, truncated), version=PACKING_VERSION)
+    with open(metadata_path(output_path), 'w') as f:
+        json.dump(stats, f, indent=2)
+    print(f"Packed {stats['examples']} examples into {stats['packed_sequences']} sequences of {max_seq_length} "
+          f"tokens: {stats['packing_efficiency']:.1%} of tokens are real, against "
+          f"{stats['padded_efficiency']:.1%} padded to {max_seq_length}.")
+    return stats
+
+
+def metadata_path(output_path):
+    return f"{output_path[:-len('.npy')] if output_path.endswith('.npy') else output_path}_metadata.json"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default='data/SQuAD/squad_train.jsonl', help='SFT-format JSONL file')
+    parser.add_argument('--output', help='defaults to <input>_packed_<length>.npy')
+    parser.add_argument('--max-seq-length', type=int, default=2048)
+    args = parser.parse_args()
+
+    from triton_inference.utils.tokenizer import get_tokenizer
+    tokenizer, _ = get_tokenizer(use_nemo=False, num_virtual_tokens=0)
+    output = args.output or f'{os.path.splitext(args.input)[0]}_packed_{args.max_seq_length}.npy'
+    pack_sft_dataset(args.input, output, tokenizer, args.max_seq_length)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,44 @@
-from ngc_requests import find_file_in_workspace, ngc_job_request, wait_for_job_completion
+from stage_manifest import plan_stage, run_stages
+from nemo_checkpoint import get_base_model_name
+from task_workspace import get_workspace_id
+from download_squad import packed_squad_file, packed_global_batch_size
 
-def sft_training_bcp(ti, ngc_api_key, org, ace, team=None):
-      '''Launches an SFT training job on BCP via NeMo Framework Training container'''
+def plan_sft_training(ti, ngc_api_key, org, ace, ace_instance="dgxa100.80g.2.norm", \
+                      tensor_parallel=2, pipeline_parallel=1, packed_sequence=None):
+      '''Plans an SFT training job on BCP via NeMo Framework Training container. With *packed_sequence*
+      (a sequence length) it trains on the packed SQuAD training set of that length, see sequence_packing.py,
+      with the global batch scaled down to the packed sequences holding 32 examples.'''
 
       #get workspace id
       gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-      tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
+      tuning_workspace_id = get_workspace_id(ti)
 
-      #avoid retraining if job has already ran and we have our sft model
-      sft_model_exists=find_file_in_workspace(ngc_api_key, org, tuning_workspace_id, 'megatron_gpt3_squad.nemo')
-      if sft_model_exists:
-            return
       
       #get the base LLM from upstream Airflow tasks
-      pretrain_decision=ti.xcom_pull(task_ids='get_base_model')
-      if pretrain_decision=='download_nemo_checkpoint':
-            _,_, gpt_base_model_name=ti.xcom_pull(task_ids='download_nemo_checkpoint') #.nemo file
-      else:
-            raise NotImplementedError('GPT pretraining not implemented. Consider rerunning with a pretrained .nemo checkpoint.')
+      gpt_base_model_name=get_base_model_name(ti) #.nemo file
 
       #ngc job parameters
       job_name = "airflow_sft_gpt3_5b_train"
-      ace_instance = "dgxa100.80g.2.norm"
       ace_name = ace
       docker_image = f"{org}/nemofw-training:23.07-py3"
       replica_count = 1
       workspaces=[{"id":gpt_workspace_id, "mount": "/mount/gpt_workspace"}, 
                   {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
       
-      # Configured for GPT3 5B BF16 TP2
+      train_file='SQuAD/v1.1/squad_train.jsonl'
+      micro_batch_size=4
+      global_batch_size=32
+      packing=''
+      if packed_sequence:
+            #NeMo's packed dataset only takes micro batches of one packed sequence
+            train_file=packed_squad_file(packed_sequence)
+            micro_batch_size=1
+            #evaluated by the job from the packing statistics in the workspace
+            global_batch_size=packed_global_batch_size(packed_sequence, global_batch_size)
+            packing=f' fine_tuning.model.data.train_ds.max_seq_length={packed_sequence} \
+            +fine_tuning.model.data.train_ds.packed_sequence=True'
+
+      # Configured for GPT3 5B BF16, TP2 unless the model profile says otherwise
       job_command = f"python3 /opt/NeMo-Megatron-Launcher/launcher_scripts/main.py \
             fine_tuning=gpt3/squad \
             stages=[fine_tuning] \
@@ -36,57 +46,54 @@ def sft_training_bcp(ti, ngc_api_key, org, ace, team=None):
             launcher_scripts_path=/opt/NeMo-Megatron-Launcher/launcher_scripts \
             data_dir=/mount/tuning_workspace/SQuAD/v1.1 \
             base_results_dir=/mount/tuning_workspace/sft_launcher_results \
-            fine_tuning.trainer.devices=2 \
+            fine_tuning.trainer.devices={tensor_parallel * pipeline_parallel} \
             fine_tuning.run.model_train_name=gpt3_5b_sft \
             fine_tuning.model.restore_from_path=/mount/gpt_workspace/gpt_models/{gpt_base_model_name} \
-            fine_tuning.model.tensor_model_parallel_size=2 \
-            fine_tuning.model.pipeline_model_parallel_size=1 \
-            fine_tuning.model.global_batch_size=32 \
-            fine_tuning.model.micro_batch_size=4 \
-            fine_tuning.model.data.train_ds.file_names=[/mount/tuning_workspace/SQuAD/v1.1/squad_train.jsonl] \
+            fine_tuning.model.tensor_model_parallel_size={tensor_parallel} \
+            fine_tuning.model.pipeline_model_parallel_size={pipeline_parallel} \
+            fine_tuning.model.global_batch_size={global_batch_size} \
+            fine_tuning.model.micro_batch_size={micro_batch_size} \
+            fine_tuning.model.data.train_ds.file_names=[/mount/tuning_workspace/{train_file}] \
             fine_tuning.model.data.train_ds.concat_sampling_probabilities=[1.0] \
             fine_tuning.model.data.validation_ds.file_names=[/mount/tuning_workspace/SQuAD/v1.1/squad_val.jsonl] \
             fine_tuning.model.data.validation_ds.names=[squad_validation_data] \
             fine_tuning.model.data.validation_ds.metric.name=loss \
-            fine_tuning.model.data.test_ds.file_names=[/mount/tuning_workspace/SQuAD/v1.1/squad_test.jsonl]"
+            fine_tuning.model.data.test_ds.file_names=[/mount/tuning_workspace/SQuAD/v1.1/squad_test.jsonl]{packing}"
 
       
-      #send ngc job request
-      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+      #plan the ngc job request, skipped if this model was already trained from the same inputs
+      return plan_stage(ti, ngc_api_key, org, 'sft_train', tuning_workspace_id, job_name, \
+                        ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                        wait_time=300, upstream=['download_nemo_checkpoint', 'download_squad_dataset'], \
+                        outputs=['sft_launcher_results/gpt3_5b_sft/squad/results/checkpoints/megatron_gpt3_squad.nemo'])
 
-      #wait for job to complete on BCP before allowing airflow to "finish" task
-      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=300, team=team)
 
-      return job_response
+def sft_training_bcp(ti, ngc_api_key, org, ace, team=None, **kwargs):
+      '''Runs the stage of `plan_sft_training` and waits for its job in the task process'''
+      return run_stages(ti, ngc_api_key, org, [plan_sft_training(ti, ngc_api_key, org, ace, **kwargs)], team=team)[0]
 
 
-def sft_inference_bcp(ti, ngc_api_key, org, ace, team=None):
-      '''Launches an SFT inference job on BCP via NeMo Framework Training container'''
+def plan_sft_inference(ti, ngc_api_key, org, ace, ace_instance="dgxa100.80g.2.norm", \
+                       tensor_parallel=2, pipeline_parallel=1):
+      '''Plans an SFT inference job on BCP via NeMo Framework Training container'''
 
       #get workspace id
       gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-      tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
-
-      #check if we already have SFT inference results in our workspace
-      sft_inference_results_exist=find_file_in_workspace(ngc_api_key, org, tuning_workspace_id, 'sft_gpt3_5b_inference.jsonl')
-      if sft_inference_results_exist:
-            return
+      tuning_workspace_id = get_workspace_id(ti)
 
       #ngc job parameters
       job_name = "airflow_sft_gpt3_5b_inference"
-      ace_instance = "dgxa100.80g.2.norm"
       ace_name = ace
       docker_image = f"{org}/nemofw-training:23.07-py3"
       replica_count = 1
       workspaces=[{"id":gpt_workspace_id, "mount": "/mount/gpt_workspace"}, 
                   {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
       
-      # GPT 5B BF16 TP2
+      # GPT 5B BF16, TP2 unless the model profile says otherwise
       job_command=f"python3 /opt/NeMo/examples/nlp/language_modeling/tuning/megatron_gpt_peft_eval.py \
             model.restore_from_path=/mount/tuning_workspace/sft_launcher_results/gpt3_5b_sft/squad/results/checkpoints/megatron_gpt3_squad.nemo \
             model.peft.restore_from_path=null \
-            trainer.devices=2 \
+            trainer.devices={tensor_parallel * pipeline_parallel} \
             model.data.test_ds.file_names=[/mount/tuning_workspace/SQuAD/v1.1/squad_test.jsonl] \
             model.data.test_ds.names=['squad_test'] \
             model.data.test_ds.global_batch_size=32 \
@@ -96,11 +103,13 @@ def sft_inference_bcp(ti, ngc_api_key, org, ace, team=None):
             inference.outfile_path=/mount/tuning_workspace/sft_launcher_results/gpt3_5b_sft/squad/results/sft_gpt3_5b_inference.jsonl"
 
       
-      #send ngc job request
-      job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+      #plan the ngc job request, skipped if this model's predictions are already in the workspace
+      return plan_stage(ti, ngc_api_key, org, 'sft_inference', tuning_workspace_id, job_name, \
+                        ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                        wait_time=300, upstream=['SFT_train'], \
+                        outputs=['sft_launcher_results/gpt3_5b_sft/squad/results/sft_gpt3_5b_inference.jsonl'])
 
-      #wait for job to complete on BCP before allowing airflow to "finish" task
-      final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=300, team=team)
 
-      return job_response
\ No newline at end of file
+def sft_inference_bcp(ti, ngc_api_key, org, ace, team=None, **kwargs):
+      '''Runs the stage of `plan_sft_inference` and waits for its job in the task process'''
+      return run_stages(ti, ngc_api_key, org, [plan_sft_inference(ti, ngc_api_key, org, ace, **kwargs)], team=team)[0]
\ No newline at end of file
@@ -1,11 +1,40 @@
-from ngc_requests import find_file_in_workspace, ngc_job_request, wait_for_job_completion
+from workspace_index import get_workspace_index
+from task_workspace import get_workspace_id
+from stage_manifest import run_stage
+from job_bundle import bundled_command
+from squad_scores import parse_scores_name
+
+#script inference task whose predictions each method is scored on; nemo_workflow_dag.py runs it in a task group
+INFERENCE_TASKS = {'lora': 'LoRA_inference_script', 'p_tuning': 'p_tuning_inference_script', 'sft': 'SFT_inference_script'}
+
+
+def squad_metrics_path(tuning_method):
+    '''Path of the metric calculation output in the tuning workspace'''
+    return f'squad_metrics/{tuning_method}.txt'
+
+
+def squad_scores_dir(tuning_method):
+    '''Directory of the tuning workspace holding the file named after the scores, see squad_scores.py'''
+    return f'squad_metrics/{tuning_method}_scores'
+
+
+def get_squad_metrics(ngc_api_key, org, workspace_id, tuning_method):
+    '''Reads the exact_match and F1 scores squad_metric_eval left in a file name under
+    `squad_scores_dir` from a listing of the workspace, or None if there are none'''
+    prefix = f'{squad_scores_dir(tuning_method)}/'
+    for path in get_workspace_index(ngc_api_key, org, workspace_id).by_path:
+        if path.startswith(prefix):
+            metrics = parse_scores_name(path[len(prefix):])
+            if metrics:
+                return metrics
+    return None
 
 def squad_metric_eval(ti, ngc_api_key, org, ace,tuning_method, team=None):
     '''Launches a job on BCP using the NeMo Framework training container to 
     quantify model performance by calculating F1 scores and exact_match metrics on the SQuAD results.'''
 
     #get workspace id
-    tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
+    tuning_workspace_id = get_workspace_id(ti)
 
     #ngc job parameters
     job_name = f"airflow_{tuning_method}_gpt3_5b_squad_metric_eval"
@@ -21,7 +50,7 @@ def squad_metric_eval(ti, ngc_api_key, org, ace,tuning_method, team=None):
         split_string= 'Assistant:'
         answer_field= 'output'
     elif tuning_method == 'lora':
-        inference_preds = '/mount/tuning_workspace/SQuAD/v1.1/squad_test_ground_truth.jsonl'
+        inference_preds = '/mount/tuning_workspace/training_info/lora_gpt3_5b_inference.txt'
         split_string= 'Assistant:'
         answer_field= 'output'
     elif tuning_method=='p_tuning':
@@ -30,16 +59,24 @@ def squad_metric_eval(ti, ngc_api_key, org, ace,tuning_method, team=None):
         answer_field= 'answer'
 
     #command to merge LoRA adapter weights with base LLM on BCP (DGX Cloud)
-    job_command=f"python3 /opt/NeMo/scripts/metric_calculation/squad_metric_calc.py \
+    #the scores are also kept in the workspace so they can be compared across tuning methods, and
+    #in the name of a file the listing shows (see squad_scores.py)
+    metrics_file=f"/mount/tuning_workspace/{squad_metrics_path(tuning_method)}"
+    scores_dir=f"/mount/tuning_workspace/{squad_scores_dir(tuning_method)}"
+    job_command=f"mkdir -p /mount/tuning_workspace/squad_metrics; \
+                python3 /opt/NeMo/scripts/metric_calculation/squad_metric_calc.py \
                 --ground-truth /mount/tuning_workspace/SQuAD/v1.1/squad_test_ground_truth.jsonl \
                 --preds {inference_preds} \
                 --split-string {split_string} \
-                --answer-field {answer_field}"
+                --answer-field {answer_field} > {metrics_file} && cat {metrics_file} && \
+                scores=$({bundled_command(['squad_scores.py'], 'squad_scores.py', metrics_file)}) && \
+                rm -rf {scores_dir} && mkdir -p {scores_dir} && touch {scores_dir}/$scores"
     
-    job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
-
-    #wait for job to complete on BCP before allowing airflow to "finish" task
-    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=30, team=team)
+    #send ngc job request, unless these predictions were already scored
+    inference_task = INFERENCE_TASKS[tuning_method]
+    job_result = run_stage(ti, ngc_api_key, org, f'squad_eval_{tuning_method}', tuning_workspace_id, job_name, \
+                           ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                           wait_time=30, team=team, upstream=[[inference_task, f'nemo_script_inference.{inference_task}']], \
+                           outputs=[squad_metrics_path(tuning_method)])
     
-    return job_response
\ No newline at end of file
+    return job_result
\ No newline at end of file
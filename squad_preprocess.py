@@ -0,0 +1,285 @@
+'''Streaming SQuAD v1.1 preprocessor, vendored from NeMo's
+scripts/dataset_processing/nlp/squad/prompt_learning_squad_preprocessing.py.
+
+It writes the same records in the same order as that script: squad_train.jsonl from the train
+file; squad_val.jsonl, squad_test_ground_truth.jsonl and squad_test.jsonl from the dev file. With
+`sft_format` (SFT and LoRA) records are {"input", "output"} prompts; otherwise (p-tuning) they are
+{"taskname", "context", "question", "answer"}. Dev records also carry every accepted answer in
+"original_answers", and p-tuning test records have no "answer". Lines are serialized with
+`json.dumps` defaults, as upstream does. tests/test_squad_preprocess.py compares the output with
+upstream's for a small fixture.
+
+Unlike the upstream script it never holds a whole dataset in memory. Topics are read one at a
+time from the JSON files, converted in shards by a process pool, and the lines are written (and
+hashed) in their original order, so the output is byte-for-byte the same for any worker count.
+A checksum file next to the outputs records the SHA-256, byte and line counts of every file.
+
+    python squad_preprocess.py --data-dir SQuAD/v1.1 --sft-format
+    python squad_preprocess.py --data-dir SQuAD/v1.1 --verify    # compare files to their checksums
+'''
+
+import os, sys, json, hashlib, argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+#bump when the output format changes, so memoized preprocessing stages rerun
+PREPROCESSOR_VERSION = 2
+
+TRAIN_FILE = 'train-v1.1.json'
+DEV_FILE = 'dev-v1.1.json'
+SAVE_NAME_BASE = 'squad'
+CHECKSUM_FILE = 'squad_checksums.json'
+
+#output splits written from each input file, in the order upstream writes them
+SPLITS = {TRAIN_FILE: ('train',), DEV_FILE: ('val', 'test_ground_truth', 'test')}
+
+#bytes read from a dataset file at a time, and topics converted per worker call
+CHUNK_SIZE = 1 << 20
+SHARD_TOPICS = 16
+
+
+def output_files(save_name_base=SAVE_NAME_BASE):
+    '''Output file names in the order they are written'''
+    return [f'{save_name_base}_{split}.jsonl' for splits in SPLITS.values() for split in splits]
+
+
+class _JSONStream:
+    '''Incremental reader over a JSON text file: decodes one value at a time from a buffer that
+    holds roughly one chunk plus the value being decoded'''
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.position, self.eof = '', 0, False
+
+    def _read(self):
+        chunk = self.f.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return bool(chunk)
+
+    def peek(self):
+        '''Next non-whitespace character, or '' at the end of the file'''
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.buffer) or not self._read():
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError(f'Expected {character!r} at {self.position} in {self.f.name}, got {self.peek()!r}')
+        self.position += 1
+
+    def skip(self, character):
+        if self.peek() == character:
+            self.position += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                #a number or literal cut off by the end of the buffer decodes too early
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+
+def iter_topics(path, chunk_size=CHUNK_SIZE):
+    '''Yields the topics of a SQuAD file's "data" list one at a time'''
+    with open(path, encoding='utf-8') as f:
+        stream = _JSONStream(f, chunk_size)
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.value()
+            stream.expect(':')
+            if key != 'data':
+                stream.value()
+            else:
+                stream.expect('[')
+                while stream.peek() != ']':
+                    yield stream.value()
+                    stream.skip(',')
+                stream.expect(']')
+            stream.skip(',')
+
+
+def iter_examples(topics, split, sft_format, include_topic=False):
+    '''Records of one output split, as upstream's extract_questions and gen_file build them'''
+    for topic in topics:
+        for paragraph in topic['paragraphs']:
+            context = paragraph['context']
+            for qa in paragraph['qas']:
+                #the dev set has several correct answers per question and all are kept
+                answers = [answer['text'] for answer in qa['answers']]
+                if not answers:
+                    continue
+                if split == 'train':
+                    answers = answers[:1]
+
+                #the p-tuning prompt template ends in "Answer:{answer}", hence the leading space
+                if sft_format:
+                    example = {'input': f"User: Context:{context} Question:{qa['question']}\n\nAssistant:",
+                               'output': answers[0]}
+                else:
+                    example = {'taskname': 'squad', 'context': context, 'question': qa['question'],
+                               'answer': f' {answers[0]}'}
+                #every accepted answer of the dev set, for squad_metric_calc.py's default --answer-field
+                if split != 'train':
+                    example['original_answers'] = answers
+                if include_topic:
+                    example['topic'] = topic['title']
+
+                #no p-tuning label in the test set; SFT-format records keep `output`, which NeMo's SFT
+                #dataset needs to load the file as test_ds
+                if split == 'test':
+                    example.pop('answer', None)
+                yield example
+
+
+def iter_lines(topics, split, sft_format, include_topic=False):
+    for example in iter_examples(topics, split, sft_format, include_topic):
+        yield json.dumps(example) + '\n'
+
+
+def _convert_shard(topics, splits, sft_format, include_topic):
+    '''Worker: the text of every split for a shard of topics'''
+    return [''.join(iter_lines(topics, split, sft_format, include_topic)) for split in splits]
+
+
+def _iter_shards(topics, size):
+    shard = []
+    for topic in topics:
+        shard.append(topic)
+        if len(shard) == size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def _iter_converted(path, splits, sft_format, include_topic, pool, workers):
+    '''Converted shards of a dataset file in file order, with at most 2 x *workers* shards in flight'''
+    shards = _iter_shards(iter_topics(path), SHARD_TOPICS)
+    if pool is None:
+        for shard in shards:
+            yield _convert_shard(shard, splits, sft_format, include_topic)
+        return
+
+    pending = deque()
+    for shard in shards:
+        pending.append(pool.submit(_convert_shard, shard, splits, sft_format, include_topic))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class _HashingWriter:
+    '''Writes a file under a temporary name, hashing as it goes; `commit` moves it into place'''
+
+    def __init__(self, path):
+        self.path, self.partial = path, f'{path}.part'
+        self.f = open(self.partial, 'wb')
+        self.sha256, self.bytes, self.lines = hashlib.sha256(), 0, 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.f.write(data)
+        self.sha256.update(data)
+        self.bytes += len(data)
+        self.lines += data.count(b'\n')
+
+    def commit(self):
+        self.f.close()
+        os.replace(self.partial, self.path)
+        return {'sha256': self.sha256.hexdigest(), 'bytes': self.bytes, 'lines': self.lines}
+
+    def discard(self):
+        self.f.close()
+        if os.path.exists(self.partial):
+            os.remove(self.partial)
+
+
+def preprocess_squad(data_dir, output_dir=None, sft_format=False, include_topic=False, workers=None,
+                     save_name_base=SAVE_NAME_BASE):
+    '''Writes the four SQuAD splits from train-v1.1.json and dev-v1.1.json in *data_dir* to
+    *output_dir* (default: *data_dir*) plus the checksum file, and returns the checksums.
+    *workers* processes convert the topics (default: the CPU count, at most 8, or none on a single
+    CPU); 0 converts them in this process.'''
+    output_dir = output_dir or data_dir
+    if workers is None:
+        cpus = os.cpu_count() or 1
+        workers = min(8, cpus) if cpus > 1 else 0
+    pool = ProcessPoolExecutor(workers) if workers > 0 else None
+    checksums = {}
+    try:
+        for input_file, splits in SPLITS.items():
+            writers = [_HashingWriter(os.path.join(output_dir, f'{save_name_base}_{split}.jsonl')) for split in splits]
+            try:
+                for texts in _iter_converted(os.path.join(data_dir, input_file), splits, sft_format, include_topic,
+                                             pool, workers):
+                    for writer, text in zip(writers, texts):
+                        writer.write(text)
+            except BaseException:
+                for writer in writers:
+                    writer.discard()
+                raise
+            for split, writer in zip(splits, writers):
+                checksums[os.path.basename(writer.path)] = writer.commit()
+                print(f'Saved {split} split to {writer.path} ({writer.lines} records)')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    manifest = {'version': PREPROCESSOR_VERSION, 'sft_format': sft_format, 'files': checksums}
+    with open(os.path.join(output_dir, CHECKSUM_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def verify_checksums(output_dir):
+    '''Names of the files in *output_dir* that are missing or differ from its checksum file'''
+    with open(os.path.join(output_dir, CHECKSUM_FILE)) as f:
+        manifest = json.load(f)
+    return [name for name, expected in manifest['files'].items()
+            if not os.path.exists(os.path.join(output_dir, name))
+            or file_checksum(os.path.join(output_dir, name)) != expected['sha256']]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data/SQuAD')
+    parser.add_argument('--output-dir', help='defaults to --data-dir')
+    parser.add_argument('--save-name-base', default=SAVE_NAME_BASE)
+    parser.add_argument('--sft-format', action='store_true')
+    parser.add_argument('--include-topic-name', action='store_true')
+    parser.add_argument('--workers', type=int, help='conversion processes; 0 converts in this process')
+    parser.add_argument('--verify', action='store_true', help='check existing outputs against their checksums')
+    args = parser.parse_args()
+
+    if args.verify:
+        mismatched = verify_checksums(args.output_dir or args.data_dir)
+        print('\n'.join(f'Checksum mismatch: {name}' for name in mismatched) or 'All checksums match.')
+        sys.exit(1 if mismatched else 0)
+    preprocess_squad(args.data_dir, args.output_dir, args.sft_format, args.include_topic_name, args.workers,
+                     args.save_name_base)
+
+
+if __name__ == '__main__':
+    main()
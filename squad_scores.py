@@ -0,0 +1,49 @@
+'''SQuAD scores of a metric evaluation, carried in a file name.
+
+NeMo's squad_metric_calc.py prints the exact_match and F1 scores, which the evaluation job saves
+to squad_metrics/<method>.txt in the tuning workspace. The pipeline learns what a workspace holds
+only from listings (and jobs that mount it), so the job also runs this script on that file and
+creates an empty file named after the scores, e.g. squad_metrics/lora_scores/exact_match=81.2,f1=88.4,
+which `get_squad_metrics` (squad_eval.py) reads back from a listing of the workspace.
+
+    python squad_scores.py squad_metrics/lora.txt    # prints exact_match=81.2,f1=88.4
+'''
+
+import re, sys, argparse
+
+METRIC_PATTERN = re.compile(r'["\']?(exact_match|f1)["\']?\s*[:=]\s*([0-9.]+)')
+_NAME_PATTERN = re.compile(r'(exact_match|f1)=([0-9.]+)')
+
+
+def parse_scores(text):
+    '''{metric: score} of the scores printed by squad_metric_calc.py'''
+    return {name: float(value) for name, value in METRIC_PATTERN.findall(text)}
+
+
+def scores_name(metrics):
+    '''File name carrying *metrics*'''
+    return ','.join(f'{name}={value}' for name, value in sorted(metrics.items()))
+
+
+def parse_scores_name(name):
+    '''{metric: score} carried by a file name of `scores_name`, or None if it is not one'''
+    matches = [_NAME_PATTERN.fullmatch(part) for part in name.split(',')]
+    if not all(matches):
+        return None
+    return {match.group(1): float(match.group(2)) for match in matches}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('metrics_file', help='output of squad_metric_calc.py')
+    args = parser.parse_args()
+
+    with open(args.metrics_file) as f:
+        metrics = parse_scores(f.read())
+    if not metrics:
+        sys.exit(f'No exact_match or f1 score in {args.metrics_file}')
+    print(scores_name(metrics))
+
+
+if __name__ == '__main__':
+    main()
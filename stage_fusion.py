@@ -0,0 +1,43 @@
+'''Fusion of consecutive pipeline stages into one NGC job.
+
+Every NGC job pays ACE queue time plus a multi-GB container pull and start before its command
+runs. Consecutive stages that would get identical containers (same image, instance, ACE, replica
+count and workspace mounts, no exposed ports) are therefore submitted as a single job running
+their commands back to back. Each stage's command is followed by its own manifest marker (see
+stage_manifest.py) and chained with `&&`, so a failing stage stops the job and only the stages
+before it count as done.'''
+
+#NGC job names are limited in length; fused names longer than this are cut
+MAX_JOB_NAME = 128
+
+
+def container_spec(stage):
+    '''What a planned stage needs from its container; stages with equal specs can share one job'''
+    mounts = frozenset((workspace['id'], workspace['mount']) for workspace in stage.workspaces)
+    return (stage.docker_image, stage.ace_instance, stage.ace_name, stage.replica_count, mounts)
+
+
+def fusible(first, second):
+    '''True if *second* can run in the same job, right after *first*'''
+    return not first.ports and not second.ports and container_spec(first) == container_spec(second)
+
+
+def fuse_stages(stages):
+    '''Groups consecutive fusible stages, keeping their order: [[stage, ...], ...]'''
+    groups = []
+    for stage in stages:
+        if groups and fusible(groups[-1][-1], stage):
+            groups[-1].append(stage)
+        else:
+            groups.append([stage])
+    return groups
+
+
+def fused_command(group):
+    '''Job command running the stages of *group* in order, each writing its marker'''
+    return ' && '.join(stage.marked_command() for stage in group)
+
+
+def fused_job_name(group):
+    '''Job name of a fused group: the stage job names joined by `__`'''
+    return '__'.join(stage.job_name for stage in group)[:MAX_JOB_NAME]
@@ -0,0 +1,161 @@
+'''Content-addressed memoization of pipeline stages.
+
+Each stage hashes its inputs: the job command (which carries every path and hyperparameter),
+the container image, the replica count and the memo hashes of the upstream stages it consumes.
+A job that finishes successfully leaves a marker `.stage_manifest/<stage>-<hash>` in the
+workspace holding the stage's outputs. A stage is skipped only if the marker for its current
+hash exists and its expected outputs are still present; any change to the inputs, upstream
+included, reruns it and everything downstream of it.'''
+
+import json, time, hashlib
+
+from ngc_requests import ngc_job_request, wait_for_job_completion
+from workspace_index import get_workspace_index
+from task_workspace import xcom_pull_from_group
+from job_result import JobResult
+from stage_fusion import fuse_stages, fused_command, fused_job_name
+from warm_executor import get_executor, can_run, dispatch
+
+MANIFEST_DIR = '.stage_manifest'
+
+
+def stage_hash(job_inputs, upstream=None):
+    '''Memo hash of a stage from its job inputs and the memo hashes of its upstream stages'''
+    payload = json.dumps({'job': job_inputs, 'upstream': upstream or {}}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def marker_path(stage, memo_hash):
+    '''Path of a stage's marker relative to the workspace root'''
+    return f'{MANIFEST_DIR}/{stage}-{memo_hash}'
+
+
+def upstream_hashes(ti, task_ids):
+    '''{task id: memo hash} of the JobResults returned by upstream tasks; each entry may list
+    alternative task ids (e.g. the same task inside and outside a task group)'''
+    hashes = {}
+    for task_id in task_ids:
+        key = task_id if isinstance(task_id, str) else task_id[0]
+        result = xcom_pull_from_group(ti, task_id)
+        hashes[key] = result.memo_hash if isinstance(result, JobResult) else None
+    return hashes
+
+
+def stage_is_current(ngc_api_key, org, workspace_id, stage, memo_hash, outputs=()):
+    '''True if the stage already ran with these inputs and its outputs are still in the workspace'''
+    index = get_workspace_index(ngc_api_key, org, workspace_id)
+    if index.stat(marker_path(stage, memo_hash)) is None:
+        return False
+    return all(index.stat(path) is not None for path in outputs)
+
+
+def with_marker(job_command, mount, stage, memo_hash):
+    '''Job command that writes the stage's marker only if the original command succeeds'''
+    return f"( {job_command} ) && mkdir -p {mount}/{MANIFEST_DIR} && date -u > {mount}/{marker_path(stage, memo_hash)}"
+
+
+class PlannedStage:
+    '''A stage with its memo hash resolved, ready to be submitted alone or fused with its neighbours
+    (see stage_fusion.py). *current* is True if its outputs are already up to date.'''
+
+    __slots__ = ('stage', 'memo_hash', 'current', 'manifest_workspace_id', 'job_name', 'ace_instance', 'ace_name',
+                 'docker_image', 'replica_count', 'workspaces', 'job_command', 'wait_time', 'outputs', 'ports')
+
+    def __init__(self, **fields):
+        for slot in self.__slots__:
+            setattr(self, slot, fields[slot])
+
+    def marked_command(self):
+        '''The stage's job command, followed by writing its marker'''
+        mount = next(workspace['mount'] for workspace in self.workspaces
+                     if workspace['id'] == self.manifest_workspace_id)
+        return with_marker(self.job_command, mount, self.stage, self.memo_hash)
+
+    def result_fields(self):
+        return dict(workspace_id=self.manifest_workspace_id, artifacts=self.outputs, memo_hash=self.memo_hash)
+
+
+def plan_stage(ti, ngc_api_key, org, stage, manifest_workspace_id, job_name, ace_instance, ace_name, docker_image, \
+               replica_count, workspaces, job_command, wait_time, upstream=(), inputs=None, outputs=(), ports=None):
+    '''Resolves the memo hash of a stage and whether the manifest in *manifest_workspace_id* shows it
+    already ran with identical inputs. *upstream* lists the tasks whose memo hashes feed into this
+    stage's hash and *inputs* any further values to hash (e.g. the memo hash of a stage planned
+    earlier in the same task); *outputs* are paths (relative to the manifest workspace) that must
+    exist for a skip and become the result's artifacts.'''
+
+    job_inputs = dict(inputs or {}, command=job_command, image=docker_image, replica_count=replica_count)
+    memo_hash = stage_hash(job_inputs, upstream_hashes(ti, upstream))
+    current = stage_is_current(ngc_api_key, org, manifest_workspace_id, stage, memo_hash, outputs)
+    return PlannedStage(stage=stage, memo_hash=memo_hash, current=current,
+                        manifest_workspace_id=manifest_workspace_id, job_name=job_name, ace_instance=ace_instance,
+                        ace_name=ace_name, docker_image=docker_image, replica_count=replica_count,
+                        workspaces=workspaces, job_command=job_command, wait_time=wait_time,
+                        outputs=tuple(outputs), ports=ports)
+
+
+def run_stages(ti, ngc_api_key, org, stages, team=None):
+    '''Runs planned stages in order, skipping current ones. Consecutive stages that can share a
+    container are submitted as one fused NGC job; each still writes its own marker, so a later
+    rerun skips the stages that finished even if the fused job failed. Groups the DAG run's warm
+    executor can run (see warm_executor.py) are dispatched to it instead. Returns one JobResult
+    per stage; stages of one fused job share its job id and timings. Raises once a job ends with
+    a stage that did not finish, so later stages never run on its missing outputs and the task
+    fails (and can be retried) instead of passing a failed result downstream.'''
+    results = {}
+    for stage in stages:
+        if stage.current:
+            print(f'Stage {stage.stage} already ran with the same inputs ({stage.memo_hash}), skipping.')
+            results[stage.stage] = JobResult.skipped(**stage.result_fields())
+
+    executor = get_executor(ti)
+    for group in fuse_stages([stage for stage in stages if not stage.current]):
+        first = group[0]
+        wait_time = min(stage.wait_time for stage in group)
+        if len(group) > 1:
+            print(f"Fusing stages {', '.join(stage.stage for stage in group)} into one job.")
+
+        #a warm executor started for this DAG run skips the queue and container start
+        final_job_status = None
+        if executor and can_run(executor, group):
+            final_job_status, timings = dispatch(ti, ngc_api_key, org, executor, fused_job_name(group), \
+                                                 fused_command(group), wait_time)
+            job_response = {'job': {'id': executor['job_id']}}
+
+        if final_job_status is None:
+            submitted = time.time()
+            job_response = ngc_job_request(ti, ngc_api_key, org, fused_job_name(group), first.ace_instance, \
+                                           first.ace_name, first.docker_image, first.replica_count, first.workspaces, \
+                                           fused_command(group), team=team, ports=first.ports)
+
+            #wait for job to complete on BCP before allowing airflow to "finish" task
+            timings = {'submitted': submitted}
+            final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=wait_time,
+                                                       team=team, timings=timings)
+
+        for stage in group:
+            #stages of a failed fused job that left their marker did finish
+            status = final_job_status
+            if len(group) > 1 and status != 'FINISHED_SUCCESS' and \
+                    stage_is_current(ngc_api_key, org, stage.manifest_workspace_id, stage.stage, stage.memo_hash):
+                status = 'FINISHED_SUCCESS'
+            print(f'Stage {stage.stage}: {status}')
+            results[stage.stage] = JobResult.from_job(job_response, status, timings, **stage.result_fields())
+
+        failed = [stage.stage for stage in group if not results[stage.stage].succeeded]
+        if failed:
+            raise Exception(f"Job {job_response['job']['id']} ({final_job_status}) did not finish stages "
+                            f"{', '.join(failed)}")
+
+    return [results[stage.stage] for stage in stages]
+
+
+def run_stage(ti, ngc_api_key, org, stage, manifest_workspace_id, job_name, ace_instance, ace_name, docker_image, \
+              replica_count, workspaces, job_command, wait_time, team=None, upstream=(), inputs=None, outputs=(), \
+              ports=None):
+    '''Launches the stage's NGC job and waits for it, unless it already ran with identical inputs
+    (see `plan_stage`). Returns a JobResult carrying the memo hash, which downstream stages read
+    from the task's return value; raises if the job did not finish successfully.'''
+    planned = plan_stage(ti, ngc_api_key, org, stage, manifest_workspace_id, job_name, ace_instance, ace_name, \
+                         docker_image, replica_count, workspaces, job_command, wait_time, upstream=upstream, \
+                         inputs=inputs, outputs=outputs, ports=ports)
+    return run_stages(ti, ngc_api_key, org, [planned], team=team)[0]
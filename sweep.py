@@ -0,0 +1,94 @@
+'''Hyperparameter sweeps over LoRA training: point generation and the ranked summary.
+
+A sweep space maps each hyperparameter to a list of values, or to {low, high, log} for a
+continuous range (random sweeps only). Every point gets a stable id derived from its values, so
+a rerun of the same point finds its earlier outputs in sweeps/<id>/ and skips retraining.'''
+
+import re, json, math, random, hashlib, itertools
+
+from workspace_index import get_workspace_index
+from task_workspace import get_workspace_id
+
+#validation loss in NeMo checkpoint file names, e.g. lora_gpt3_5b--validation_loss=1.234-step=99.ckpt
+_VAL_LOSS_PATTERN = re.compile(r'val(?:idation)?_loss=([0-9]+(?:\.[0-9]+)?)')
+
+
+def grid(space):
+    '''Every combination of the listed values, in a stable order'''
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_points(space, points, seed=0):
+    '''*points* random combinations; lists are sampled uniformly, {low, high, log} ranges
+    uniformly or log-uniformly. Seeded so the DAG has the same tasks on every parse.'''
+    rng = random.Random(seed)
+    sampled = []
+    for _ in range(points):
+        point = {}
+        for name in sorted(space):
+            values = space[name]
+            if isinstance(values, dict):
+                low, high = float(values['low']), float(values['high'])
+                if values.get('log'):
+                    point[name] = math.exp(rng.uniform(math.log(low), math.log(high)))
+                else:
+                    point[name] = rng.uniform(low, high)
+            else:
+                point[name] = rng.choice(values)
+        sampled.append(point)
+    return sampled
+
+
+def sweep_points(sweep):
+    '''Points of a sweep configuration (strategy grid or random)'''
+    if sweep.get('strategy', 'grid') == 'grid':
+        return grid(sweep['space'])
+    return random_points(sweep['space'], sweep['points'], sweep.get('seed', 0))
+
+
+def sweep_point_id(hparams):
+    '''Short stable id of one point, used for its job name and output directory'''
+    return hashlib.sha256(json.dumps(hparams, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+
+
+def sweep_results_dir(hparams):
+    '''Directory (relative to the tuning workspace) a sweep point writes its outputs to'''
+    return f'sweeps/{sweep_point_id(hparams)}/'
+
+
+def best_validation_loss(index, hparams):
+    '''Lowest validation loss among a point's saved checkpoints, or None'''
+    checkpoints = f'{sweep_results_dir(hparams)}training_info/checkpoints/'
+    losses = [float(match.group(1)) for path in index.by_path if path.startswith(checkpoints)
+              for match in [_VAL_LOSS_PATTERN.search(path)] if match]
+    return min(losses) if losses else None
+
+
+def summarize_sweep(ti, ngc_api_key, org, points, train_task_id='LoRA_sweep_train'):
+    '''Ranks the sweep points by best validation loss from one listing of the tuning workspace.
+    Each row also has the point's training task state and duration. Returns the ranked table.'''
+
+    index = get_workspace_index(ngc_api_key, org, get_workspace_id(ti))
+    task_instances = {task_instance.map_index: task_instance for task_instance in ti.get_dagrun().get_task_instances()
+                      if task_instance.task_id == train_task_id}
+
+    rows = []
+    for map_index, hparams in enumerate(points):
+        task_instance = task_instances.get(map_index)
+        rows.append({
+            'point': sweep_point_id(hparams),
+            'hparams': hparams,
+            'state': task_instance.state if task_instance else None,
+            'duration_seconds': task_instance.duration if task_instance else None,
+            'validation_loss': best_validation_loss(index, hparams),
+        })
+    #points without a validation loss (failed or still missing) go last
+    rows.sort(key=lambda row: (row['validation_loss'] is None, row['validation_loss'] or 0.0))
+
+    print(f"{'rank':>4}  {'point':<10}  {'val loss':>8}  {'hours':>6}  {'state':<8}  hparams")
+    for rank, row in enumerate(rows, 1):
+        loss = '-' if row['validation_loss'] is None else f"{row['validation_loss']:.4f}"
+        hours = '-' if row['duration_seconds'] is None else f"{row['duration_seconds'] / 3600:.2f}"
+        print(f"{rank:>4}  {row['point']:<10}  {loss:>8}  {hours:>6}  {str(row['state']):<8}  {row['hparams']}")
+    return rows
@@ -1,5 +1,15 @@
 from ngc_requests import get_existing_workspace, create_workspace
 
+def name_tuning_workspace(method, unique_name):
+    '''Name of the NGC workspace the *method* tuning task writes to'''
+    if method =='lora':
+        tuning_workspace_name = f'airflow_lora_nemo_workspace' 
+    elif method == 'p_tuning':
+        tuning_workspace_name = f'airflow_ptuning_nemo_workspace'
+    elif method == 'sft':
+        tuning_workspace_name = f'airflow_sft_nemo_workspace'
+    return tuning_workspace_name
+
 def create_task_workspace(ti, ngc_api_key, org, ace, workspace_name):
     '''Creates a NGC workspace in the specied NGC org and ace under the name *workspace_name*.
     Returns workspace ID for created workspace to be used in downstream tasks.'''
@@ -15,4 +25,32 @@ def create_task_workspace(ti, ngc_api_key, org, ace, workspace_name):
         print(f'Workspace {workspace_name} exists already.')
     
     workspace_id = workspace_response['workspace']['id']
-    return workspace_id
\ No newline at end of file
+    return workspace_id
+
+
+def xcom_pull_from_group(ti, task_ids, key='return_value'):
+    '''Pulls the XCom *key* from the first of *task_ids* (a task id or a list of alternatives) that
+    pushed one. Copies of those tasks in the caller's own task group, then in the groups enclosing
+    it, take precedence over top-level ones.'''
+    if isinstance(task_ids, str):
+        task_ids = [task_ids]
+    prefixes = []
+    group = ti.task_id
+    while '.' in group:
+        group = group.rsplit('.', 1)[0]
+        prefixes.append(f'{group}.')
+    prefixes.append('')
+
+    for prefix in prefixes:
+        for task_id in task_ids:
+            value = ti.xcom_pull(task_ids=f'{prefix}{task_id}', key=key)
+            if value is not None:
+                return value
+    return None
+
+
+def get_workspace_id(ti, task_id='create_tuning_workspace'):
+    '''Returns the workspace ID pushed by the workspace task *task_id*. A copy of that task in the
+    caller's own task group (e.g. `lora.create_tuning_workspace` when fanning out tuning methods)
+    takes precedence over a top-level one.'''
+    return xcom_pull_from_group(ti, task_id)
@@ -0,0 +1,34 @@
+'''Rate limiter waits recorded by ngc_metrics.py.
+
+    python -m pytest -q tests
+'''
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ngc_metrics
+from ngc_rate_limit import RateLimiter, PRIORITY_SUBMIT
+
+
+def test_throttled_calls_are_recorded(tmp_path, capsys):
+    ngc_metrics.set_task_label('test_throttle')
+    try:
+        limiter = RateLimiter(rate=50, burst=1, state_path=str(tmp_path / 'bucket.json'))
+        limiter.acquire(PRIORITY_SUBMIT)
+        throttled = limiter.acquire(PRIORITY_SUBMIT)
+    finally:
+        ngc_metrics.set_task_label(None)
+
+    assert throttled > 0
+    throttle = ngc_metrics._throttles[(PRIORITY_SUBMIT, 'test_throttle')]
+    assert throttle['calls'] == 2 and throttle['throttled_calls'] == 1
+    assert throttle['throttled_seconds'] == throttled
+
+    prometheus = ngc_metrics.render_prometheus()
+    assert 'ngc_api_throttled_calls_total{priority="submit",task="test_throttle"} 1' in prometheus
+    assert 'ngc_api_throttled_seconds_total{priority="submit",task="test_throttle"}' in prometheus
+
+    ngc_metrics.print_metrics_summary()
+    assert 'NGC API rate limit (submit):' in capsys.readouterr().out
@@ -0,0 +1,75 @@
+'''Job lookups and token refreshes of ngc_requests.py and the warm executor's probe of the workspace
+file endpoint against the local NGC emulator of benchmarks/ngc_emulator.py.
+
+    python -m pytest -q tests
+'''
+
+import os, sys, time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import ngc_requests
+from ngc_requests import find_job_by_label
+from ngc_emulator import NGCEmulator
+
+LABEL = 'airflow_0123456789abcdef01234567'
+
+
+@pytest.fixture
+def emulator(monkeypatch, tmp_path):
+    emulator = NGCEmulator(queue_time=0, job_duration=0, time_scale=0.01).start()
+    monkeypatch.setattr(ngc_requests, 'NGC_API_URL', emulator.url)
+    monkeypatch.setattr(ngc_requests, 'NGC_AUTHN_URL', emulator.url)
+    monkeypatch.setenv('NGC_TOKEN_CACHE_DIR', str(tmp_path))
+    monkeypatch.setenv('NGC_RATE_LIMIT', '0')
+    yield emulator
+    emulator.stop()
+
+
+def submit(emulator, labels=()):
+    return emulator.submit_job({'name': 'test_job', 'command': 'true', 'workspaceMounts': [],
+                                'userLabels': list(labels)})['id']
+
+
+def test_finds_a_job_past_the_first_page(emulator):
+    #an API ignoring the label filter lists the newer, unlabelled jobs first
+    emulator.filter_labels = False
+    job_id = submit(emulator, [LABEL])
+    for _ in range(5):
+        submit(emulator)
+    time.sleep(0.1)
+
+    job = find_job_by_label('test-key', 'test-org', LABEL, page_size=2)
+    assert job['job']['id'] == job_id
+    assert emulator.call_counts()['list_jobs'] == 3
+
+
+def test_probes_the_workspace_file_endpoint(emulator):
+    from warm_executor import file_endpoint_available
+
+    workspace_id = emulator.create_workspace('tuning')['id']
+    assert file_endpoint_available('test-key', 'test-org', workspace_id, '.executor/run')
+
+    #without the endpoint, no warm executor is started
+    emulator.file_endpoint = False
+    assert not file_endpoint_available('test-key', 'test-org', workspace_id, '.executor/run')
+
+
+def test_rejected_token_is_replaced_once(emulator):
+    job_id = submit(emulator)
+    ngc_requests.get_token('test-key', 'test-org')
+    fetched = emulator.call_counts().get('token', 0)
+    emulator.inject_errors('job_status', 401)
+
+    assert ngc_requests.ngc_job_status(None, 'test-key', 'test-org', job_id)
+    assert emulator.call_counts()['token'] == fetched + 1
+
+    #a token the API keeps rejecting fails the call instead of looping
+    emulator.inject_errors('job_status', 401, 401)
+    with pytest.raises(Exception, match='HTTP Error 401'):
+        ngc_requests.ngc_job_status(None, 'test-key', 'test-org', job_id)
+    assert emulator.call_counts()['token'] == fetched + 2
@@ -0,0 +1,142 @@
+'''NGCJobTrigger and the asyncio job watcher behind it (ngc_async.watch_job), against the local
+NGC emulator of benchmarks/ngc_emulator.py. The trigger tests need Airflow and are skipped
+without it; the watcher tests do not.
+
+    python -m pytest -q tests
+'''
+
+import os, sys, asyncio
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import job_polling
+import ngc_requests
+import ngc_rate_limit
+from ngc_async import AsyncNGCClient, NGCHTTPError, shared_client, watch_job
+from ngc_emulator import NGCEmulator
+
+#emulated jobs queue for 0.1 s, start for 0.01 s and run for 0.3 s; polls are 100 times shorter
+TIME_SCALE = 0.01
+
+
+@pytest.fixture
+def emulator(monkeypatch, tmp_path):
+    emulator = NGCEmulator(queue_time=10, job_duration=30, time_scale=TIME_SCALE).start()
+    monkeypatch.setattr(ngc_requests, 'NGC_API_URL', emulator.url)
+    monkeypatch.setattr(ngc_requests, 'NGC_AUTHN_URL', emulator.url)
+    monkeypatch.setattr(job_polling, 'POLL_TIME_SCALE', TIME_SCALE)
+    monkeypatch.setenv('NGC_TOKEN_CACHE_DIR', str(tmp_path))
+    monkeypatch.setenv('NGC_RATE_LIMIT', '0')
+    yield emulator
+    emulator.stop()
+
+
+def submit(emulator, name='test_job'):
+    return emulator.submit_job({'name': name, 'command': 'true', 'workspaceMounts': []})['id']
+
+
+async def watch(job_id, max_poll_interval=1, retries=0):
+    #without client retries every failed call reaches watch_job
+    async with AsyncNGCClient('test-key', 'test-org', retries=retries) as client:
+        return await watch_job(client, job_id, max_poll_interval)
+
+
+def test_watch_job_returns_final_status_and_timings(emulator):
+    job_id = submit(emulator)
+    job_status, timings = asyncio.run(watch(job_id))
+
+    assert job_status == 'FINISHED_SUCCESS'
+    assert [status for status, _ in timings['transitions']] == \
+        ['CREATED', 'QUEUED', 'STARTING', 'RUNNING', 'FINISHED_SUCCESS']
+    assert timings['run_seconds'] == pytest.approx(0.3, abs=0.1)
+    assert timings['detected'] >= timings['transitions'][-1][1]
+
+
+def test_watch_job_reports_failed_jobs(emulator):
+    emulator.failure_rate = 1.0
+    job_status, _ = asyncio.run(watch(submit(emulator)))
+    assert job_status == 'FAILED'
+
+
+def test_watch_job_keeps_polling_through_transient_errors(emulator):
+    job_id = submit(emulator)
+    emulator.inject_errors('job_status', 503, 500, 502, 429, 504)
+    job_status, _ = asyncio.run(watch(job_id))
+
+    assert job_status == 'FINISHED_SUCCESS'
+    assert emulator.injected_errors['job_status'] == []
+
+
+def test_watch_job_raises_on_errors_that_do_not_go_away(emulator):
+    with pytest.raises(NGCHTTPError) as error:
+        asyncio.run(watch(424242))
+    assert error.value.status == 404
+    assert emulator.call_counts()['job_status'] == 1
+
+
+def test_watch_job_takes_poll_tokens_from_the_rate_limiter(emulator, monkeypatch, tmp_path):
+    monkeypatch.setenv('NGC_RATE_LIMIT', '1000')
+    monkeypatch.setenv('NGC_RATE_LIMIT_DIR', str(tmp_path))
+    monkeypatch.setattr(ngc_rate_limit, '_limiter', None)
+    job_id = submit(emulator)
+    emulator.inject_errors('job_status', 429)
+    asyncio.run(watch(job_id, retries=1))
+
+    assert ngc_rate_limit.get_rate_limiter().stats()['poll']['calls'] == emulator.call_counts()['job_status']
+
+
+def test_shared_client_is_closed_with_its_loop(emulator):
+    async def use():
+        client = await shared_client('test-key', 'test-org')
+        assert await shared_client('test-key', 'test-org') is client
+        assert (await watch_job(client, submit(emulator), 1))[0] == 'FINISHED_SUCCESS'
+        return client
+
+    client = asyncio.run(use())
+    assert client.session is None
+
+
+class TestNGCJobTrigger:
+
+    @pytest.fixture(autouse=True)
+    def api_key_variable(self, monkeypatch):
+        pytest.importorskip('airflow')
+        from airflow.models import Variable
+        variables = {'key_v': 'test-key'}
+        monkeypatch.setattr(Variable, 'get', staticmethod(lambda key, deserialize_json=False: variables[key]))
+
+    def events(self, trigger):
+        async def collect():
+            return [event.payload async for event in trigger.run()]
+        return asyncio.run(collect())
+
+    def test_serialize_keeps_team_and_not_the_api_key(self):
+        from ngc_trigger import NGCJobTrigger
+        classpath, kwargs = NGCJobTrigger('test-org', 1000, team='test-team', max_poll_interval=60).serialize()
+
+        assert classpath == 'ngc_trigger.NGCJobTrigger'
+        assert kwargs == {'org': 'test-org', 'job_id': 1000, 'team': 'test-team', 'max_poll_interval': 60,
+                          'api_key_variable': 'key_v'}
+        assert 'test-key' not in repr(kwargs)
+        assert NGCJobTrigger(**kwargs).serialize() == (classpath, kwargs)
+
+    def test_fires_once_with_the_final_status(self, emulator):
+        from ngc_trigger import NGCJobTrigger
+        job_id = submit(emulator)
+        emulator.inject_errors('job_status', 503)
+        events = self.events(NGCJobTrigger('test-org', job_id, team='test-team', max_poll_interval=1))
+
+        assert len(events) == 1
+        assert events[0]['job_id'] == job_id
+        assert events[0]['status'] == 'FINISHED_SUCCESS'
+        assert events[0]['timings']['transitions'][-1][0] == 'FINISHED_SUCCESS'
+
+    def test_fires_error_for_an_unknown_job(self, emulator):
+        from ngc_trigger import NGCJobTrigger
+        events = self.events(NGCJobTrigger('test-org', 424242, max_poll_interval=1))
+        assert [event['status'] for event in events] == ['ERROR']
+        assert '404' in events[0]['message']
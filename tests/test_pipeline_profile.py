@@ -0,0 +1,34 @@
+'''Run profiles of pipeline_profile.py, built from hand-written task records.
+
+    python -m pytest -q tests
+'''
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pipeline_profile import build_profile, render_html, write_profile
+
+
+def record(task_id, start, end, upstream=(), state='success'):
+    return {'task_id': task_id, 'state': state, 'start': start, 'end': end, 'upstream': list(upstream),
+            'result': None}
+
+
+def test_run_without_tasks_renders(tmp_path):
+    #e.g. a run whose first task failed before any record had a start and end
+    profile = build_profile([record('create_gpt_workspace', None, None, state='failed')])
+
+    assert profile['tasks'] == [] and profile['detection_lag'] == 0.0
+    assert 'Pipeline profile' in render_html(profile)
+    write_profile(profile, str(tmp_path), 'empty')
+
+
+def test_critical_path_follows_the_latest_upstream():
+    profile = build_profile([record('a', 100.0, 110.0), record('b', 100.0, 130.0),
+                             record('c', 130.0, 140.0, upstream=['a', 'b'])])
+
+    assert profile['critical_path']['tasks'] == ['b', 'c']
+    assert profile['critical_path']['length'] == 40.0
+    assert profile['wall_time'] == 40.0
@@ -0,0 +1,52 @@
+'''Scores of squad_eval.py: the file name the evaluation job creates (squad_scores.py) and reading
+it back from a workspace listing of the local NGC emulator of benchmarks/ngc_emulator.py.
+
+    python -m pytest -q tests
+'''
+
+import os, sys, subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import ngc_requests
+from job_bundle import bundled_command
+from squad_eval import get_squad_metrics, squad_scores_dir
+from workspace_index import invalidate_workspace_index
+from ngc_emulator import NGCEmulator
+
+#what squad_metric_calc.py prints
+METRIC_OUTPUT = "{'exact_match': 81.2, 'f1': 88.4}\n"
+
+
+@pytest.fixture
+def emulator(monkeypatch, tmp_path):
+    emulator = NGCEmulator(queue_time=0, job_duration=0, time_scale=0.01).start()
+    monkeypatch.setattr(ngc_requests, 'NGC_API_URL', emulator.url)
+    monkeypatch.setattr(ngc_requests, 'NGC_AUTHN_URL', emulator.url)
+    monkeypatch.setenv('NGC_TOKEN_CACHE_DIR', str(tmp_path))
+    monkeypatch.setenv('NGC_RATE_LIMIT', '0')
+    invalidate_workspace_index()
+    yield emulator
+    emulator.stop()
+
+
+def test_job_names_the_scores_file(tmp_path):
+    metrics_file = tmp_path / 'lora.txt'
+    metrics_file.write_text(METRIC_OUTPUT)
+    command = bundled_command(['squad_scores.py'], 'squad_scores.py', str(metrics_file))
+
+    output = subprocess.run(['bash', '-c', command], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == 'exact_match=81.2,f1=88.4'
+
+
+def test_reads_the_scores_from_a_listing(emulator):
+    workspace_id = emulator.create_workspace('tuning')['id']
+    emulator.add_file(workspace_id, '/squad_metrics/lora.txt')
+    emulator.add_file(workspace_id, f"/{squad_scores_dir('lora')}/exact_match=81.2,f1=88.4", size=0)
+
+    assert get_squad_metrics('test-key', 'test-org', workspace_id, 'lora') == {'exact_match': 81.2, 'f1': 88.4}
+    assert get_squad_metrics('test-key', 'test-org', workspace_id, 'sft') is None
@@ -0,0 +1,44 @@
+'''squad_preprocess.py against upstream's output. fixtures/squad holds a small SQuAD v1.1 train and
+dev file and, under sft/ and p_tuning/, the four splits NeMo's
+scripts/dataset_processing/nlp/squad/prompt_learning_squad_preprocessing.py writes for them, as of
+the NeMo v1.20.0 tag shipped in the nemofw-training:23.07 container. To regenerate them there:
+
+    python3 /opt/NeMo/scripts/dataset_processing/nlp/squad/prompt_learning_squad_preprocessing.py \
+        --data-dir tests/fixtures/squad [--sft-format]
+
+and move the squad_*.jsonl files into sft/ or p_tuning/.
+
+    python -m pytest -q tests
+'''
+
+import os, sys, json
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from squad_preprocess import preprocess_squad, output_files, verify_checksums
+
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures', 'squad')
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+@pytest.mark.parametrize('sft_format', [True, False])
+def test_output_matches_upstream(tmp_path, sft_format, workers):
+    preprocess_squad(FIXTURES, str(tmp_path), sft_format=sft_format, workers=workers)
+    expected_dir = os.path.join(FIXTURES, 'sft' if sft_format else 'p_tuning')
+
+    for name in output_files():
+        with open(os.path.join(expected_dir, name), 'rb') as expected, open(tmp_path / name, 'rb') as output:
+            assert output.read() == expected.read(), name
+    assert verify_checksums(str(tmp_path)) == []
+
+
+def test_sft_test_split_keeps_its_label(tmp_path):
+    #sft.py and lora.py load squad_test.jsonl as test_ds, whose records need `output`
+    preprocess_squad(FIXTURES, str(tmp_path), sft_format=True, workers=0)
+    with open(tmp_path / 'squad_test.jsonl') as f:
+        records = [json.loads(line) for line in f]
+
+    assert records and all(record['output'] for record in records)
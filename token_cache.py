@@ -0,0 +1,238 @@
+'''Pre-tokenized, memory-mapped cache of JSONL datasets.
+
+Each record's text fields are tokenized once, with the GPT2 BPE tokenizer the Triton clients use
+(triton_inference/utils/tokenizer.py). A cache is a directory of three files:
+
+    tokens.bin    every token id back to back (uint16, or int32 for vocabularies over 65536)
+    offsets.bin   int64 start of each field of each record in tokens.bin, plus the end; field f
+                  of record r spans offsets[r * fields + f] : offsets[r * fields + f + 1]
+    meta.json     dtype, fields, record and token counts, tokenizer hash and data checksum
+
+Both binary files open with `np.memmap`, so `TokenCache` hands out zero-copy views of any record
+without reading the rest. Caches are content-addressed: the directory name is derived from the
+tokenizer's hash and the JSONL file's SHA-256, so a changed vocabulary or dataset never reuses a
+stale cache and an unchanged one is never rebuilt. The command line builds the caches of several
+files under one root, with an index.json naming each file's cache directory:
+
+    python token_cache.py --input SQuAD/v1.1/squad_*.jsonl --cache-root SQuAD/v1.1/token_cache
+'''
+
+import os, json, shutil, hashlib, argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CACHE_VERSION = 1
+TOKENS_FILE = 'tokens.bin'
+OFFSETS_FILE = 'offsets.bin'
+META_FILE = 'meta.json'
+CACHE_FILES = [TOKENS_FILE, OFFSETS_FILE, META_FILE]
+#{file name: cache directory name} of the caches built under one root by the command line
+INDEX_FILE = 'index.json'
+
+#records tokenized per worker call
+BATCH_RECORDS = 512
+
+
+def tokenizer_fingerprint(tokenizer):
+    '''Hash of everything that decides a tokenizer's output: class, vocabulary (added tokens
+    included) and BPE merges'''
+    inner = getattr(tokenizer, 'tokenizer', tokenizer) #NeMo wraps the HuggingFace tokenizer
+    sha256 = hashlib.sha256(type(inner).__name__.encode('utf-8'))
+    sha256.update(json.dumps(sorted(inner.get_vocab().items())).encode('utf-8'))
+    merges = getattr(inner, 'bpe_ranks', None)
+    if merges:
+        sha256.update(json.dumps(sorted(merges.items(), key=lambda merge: merge[1])).encode('utf-8'))
+    return sha256.hexdigest()[:16]
+
+
+def cache_key(tokenizer_hash, data_sha256, fields=None):
+    '''Directory name of the cache of one dataset file under one tokenizer. Without *fields* the
+    cache holds the file's text fields, which its contents already determine.'''
+    key = f'{CACHE_VERSION}/{tokenizer_hash}/{data_sha256}' + (f"/{','.join(fields)}" if fields else '')
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def encode(tokenizer, text):
+    '''Token ids of *text* without special tokens, from a NeMo or a HuggingFace tokenizer'''
+    #NeMo tokenizers call it text_to_ids; HuggingFace's GPT2 encode adds no special tokens
+    text_to_ids = getattr(tokenizer, 'text_to_ids', None)
+    return text_to_ids(text) if text_to_ids else tokenizer.encode(text)
+
+
+def _tokenize_batch(tokenizer, lines, fields):
+    '''Worker: one token id list per field of every JSONL line'''
+    batch = []
+    for line in lines:
+        record = json.loads(line)
+        batch.append([encode(tokenizer, record.get(field) or '') for field in fields])
+    return batch
+
+
+def _iter_batches(f):
+    batch = []
+    for line in f:
+        if line.strip():
+            batch.append(line)
+        if len(batch) == BATCH_RECORDS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_tokenized(f, tokenizer, fields, pool, workers):
+    '''Tokenized batches in file order, with at most 2 x *workers* batches in flight'''
+    if pool is None:
+        for batch in _iter_batches(f):
+            yield _tokenize_batch(tokenizer, batch, fields)
+        return
+    pending = deque()
+    for batch in _iter_batches(f):
+        pending.append(pool.submit(_tokenize_batch, tokenizer, batch, fields))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def text_fields(jsonl_path):
+    '''String fields of the first record, in order: the fields a cache of the file holds'''
+    with open(jsonl_path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                return [field for field, value in json.loads(line).items() if isinstance(value, str)]
+    return []
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def build_token_cache(jsonl_path, cache_dir, tokenizer, fields=None, data_sha256=None, tokenizer_hash=None,
+                      workers=0):
+    '''Tokenizes *fields* (default: the string fields of the first record) of every record of
+    *jsonl_path* into a cache at *cache_dir*. The files are written to a sibling directory and
+    moved into place at the end, so a cache directory is either complete or absent. *workers*
+    processes tokenize batches of records; 0 tokenizes in this process. Returns the metadata.'''
+    fields = list(fields or text_fields(jsonl_path))
+    tokenizer_hash = tokenizer_hash or tokenizer_fingerprint(tokenizer)
+    data_sha256 = data_sha256 or file_sha256(jsonl_path)
+    dtype = '<u2' if len(tokenizer.get_vocab()) <= np.iinfo(np.uint16).max + 1 else '<i4'
+
+    partial = f"{cache_dir.rstrip('/')}.part"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    offsets, total = [0], 0
+    pool = ProcessPoolExecutor(workers) if workers > 0 else None
+    try:
+        with open(jsonl_path, encoding='utf-8') as f, open(os.path.join(partial, TOKENS_FILE), 'wb') as tokens:
+            for batch in _iter_tokenized(f, tokenizer, fields, pool, workers):
+                for record in batch:
+                    for ids in record:
+                        tokens.write(np.asarray(ids, dtype=dtype).tobytes())
+                        total += len(ids)
+                        offsets.append(total)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    np.asarray(offsets, dtype='<i8').tofile(os.path.join(partial, OFFSETS_FILE))
+
+    meta = {
+        'version': CACHE_VERSION,
+        'dtype': dtype,
+        'fields': fields,
+        'records': (len(offsets) - 1) // max(len(fields), 1),
+        'tokens': total,
+        'tokenizer': tokenizer_hash,
+        'data_sha256': data_sha256,
+        'source': os.path.basename(jsonl_path),
+    }
+    with open(os.path.join(partial, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(partial, cache_dir)
+    return meta
+
+
+def ensure_token_cache(jsonl_path, cache_root, tokenizer, fields=None, data_sha256=None, workers=0):
+    '''Directory of the cache of *jsonl_path* under *cache_root*, building it only if no cache for
+    this tokenizer and file contents exists yet'''
+    tokenizer_hash = tokenizer_fingerprint(tokenizer)
+    data_sha256 = data_sha256 or file_sha256(jsonl_path)
+    cache_dir = os.path.join(cache_root, cache_key(tokenizer_hash, data_sha256, fields))
+    if not os.path.exists(os.path.join(cache_dir, META_FILE)):
+        build_token_cache(jsonl_path, cache_dir, tokenizer, fields, data_sha256, tokenizer_hash, workers)
+    return cache_dir
+
+
+class TokenCache:
+    '''Read-only view of a cache directory. `cache[i]` is {field: token ids} of record i, as
+    views into the memory-mapped token file.'''
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.fields = self.meta['fields']
+        self._width = max(len(self.fields), 1)
+        self._columns = {field: column for column, field in enumerate(self.fields)}
+        #plain ndarray views of the maps: still zero-copy, without np.memmap's per-slice overhead
+        self.offsets = np.memmap(os.path.join(cache_dir, OFFSETS_FILE), dtype='<i8', mode='r').view(np.ndarray)
+        #np.memmap cannot map an empty file
+        self.tokens = (np.memmap(os.path.join(cache_dir, TOKENS_FILE), dtype=self.meta['dtype'], mode='r')
+                       .view(np.ndarray) if self.meta['tokens'] else np.empty(0, dtype=self.meta['dtype']))
+
+    def __len__(self):
+        return self.meta['records']
+
+    def field(self, index, field):
+        '''Token ids of one field of record *index*'''
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        position = index * self._width + self._columns[field]
+        start, end = self.offsets[position:position + 2]
+        return self.tokens[start:end]
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        bounds = self.offsets[index * self._width:(index + 1) * self._width + 1].tolist()
+        return {field: self.tokens[bounds[column]:bounds[column + 1]] for column, field in enumerate(self.fields)}
+
+    def lengths(self, field=None):
+        '''Token count of every record, or of one field of every record'''
+        per_field = np.diff(self.offsets).reshape(-1, self._width)
+        return per_field.sum(axis=1) if field is None else per_field[:, self._columns[field]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', nargs='+', required=True, help='JSONL files to cache')
+    parser.add_argument('--cache-root', required=True)
+    parser.add_argument('--workers', type=int, help='tokenizing processes; 0 tokenizes in this process')
+    args = parser.parse_args()
+
+    from triton_inference.utils.tokenizer import get_tokenizer
+    tokenizer, _ = get_tokenizer(use_nemo=False, num_virtual_tokens=0)
+    workers = args.workers
+    if workers is None:
+        cpus = os.cpu_count() or 1
+        workers = min(8, cpus) if cpus > 1 else 0
+
+    index = {}
+    for jsonl_path in args.input:
+        cache_dir = ensure_token_cache(jsonl_path, args.cache_root, tokenizer, workers=workers)
+        index[os.path.basename(jsonl_path)] = os.path.basename(cache_dir)
+        print(f'Token cache of {jsonl_path}: {cache_dir}')
+    #written last: its presence marks every cache complete
+    with open(os.path.join(args.cache_root, INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,17 @@
-from ngc_requests import find_file_in_workspace, ngc_job_request, wait_for_job_completion
+import time
+from ngc_requests import ngc_job_request, wait_for_job_completion
+from nemo_checkpoint import get_base_model_name
+from task_workspace import get_workspace_id
+from stage_manifest import plan_stage, run_stages
+from job_result import JobResult
 
+#task producing the tuned model each method serves through Triton; LoRA models are merged first
+TUNED_MODEL_TASKS = {'lora': 'LoRA_train', 'p_tuning': 'p_tuning_train', 'sft': 'SFT_train'}
 
-def merge_lora_weights(ti, ngc_api_key, org, ace, team=None):
-    '''Launches a job on BCP using NeMo Framework Training container
+
+def plan_lora_merge(ti, ngc_api_key, org, ace, ace_instance="dgxa100.80g.2.norm", tensor_parallel=2, \
+                    pipeline_parallel=1):
+    '''Plans a job on BCP using NeMo Framework Training container
     to merge the adapter layer weights from our trained LoRA model with the 
     weights from the GPT model acting as our base LLM. The final merged model gets
     saved in the NGC workspace for LoRA Airflow tasks. This will be the model that gets 
@@ -10,16 +19,13 @@ def merge_lora_weights(ti, ngc_api_key, org, ace, team=None):
 
     #get workspace id
     gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-    tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
+    tuning_workspace_id = get_workspace_id(ti)
 
-    #avoid merging if file already exists in our workspace
-    merged_model_exists=find_file_in_workspace(ngc_api_key, org, tuning_workspace_id, 'lora_gpt_5B_merged.nemo')
-    if merged_model_exists:
-        return
+    #get the base LLM from upstream Airflow tasks
+    gpt_base_model_name=get_base_model_name(ti) #.nemo file
     
     #ngc job parameters
     job_name = f"airflow_lora_gpt3_5b_merge_weights"
-    ace_instance = "dgxa100.80g.2.norm"
     ace_name = ace
     docker_image = f"{org}/nemofw-training:23.07-py3"
     replica_count = 1
@@ -27,35 +33,42 @@ def merge_lora_weights(ti, ngc_api_key, org, ace, team=None):
                 {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
 
     #command to merge LoRA adapter weights with base LLM on BCP (DGX Cloud)
-    job_command="python3 /opt/NeMo/scripts/nlp_language_modeling/merge_lora_weights/merge.py \
-                trainer.devices=2 \
+    job_command=f"python3 /opt/NeMo/scripts/nlp_language_modeling/merge_lora_weights/merge.py \
+                trainer.devices={tensor_parallel * pipeline_parallel} \
                 trainer.precision=bf16 \
-                tensor_model_parallel_size=2 \
-                pipeline_model_parallel_size=1 \
-                gpt_model_file=/mount/gpt_workspace/gpt_models/nemo_gpt5B_bf16_tp2.nemo \
+                tensor_model_parallel_size={tensor_parallel} \
+                pipeline_model_parallel_size={pipeline_parallel} \
+                gpt_model_file=/mount/gpt_workspace/gpt_models/{gpt_base_model_name} \
                 lora_model_path=/mount/tuning_workspace/training_info/checkpoints/lora_gpt_airflow_tuning.nemo \
                 merged_model_path=/mount/tuning_workspace/training_info/checkpoints/lora_gpt_5B_merged.nemo"
     
-    job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
+    #skipped when these weights were already merged from the same LoRA model
+    return plan_stage(ti, ngc_api_key, org, 'lora_merge', tuning_workspace_id, job_name, ace_instance, ace_name, \
+                      docker_image, replica_count, workspaces, job_command, wait_time=30, \
+                      upstream=[TUNED_MODEL_TASKS['lora']], \
+                      outputs=['training_info/checkpoints/lora_gpt_5B_merged.nemo'])
 
-    #wait for job to complete on BCP before allowing airflow to "finish" task
-    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=30, team=team)
-    
-    return job_response
+
+def merge_lora_weights(ti, ngc_api_key, org, ace, team=None, ace_instance="dgxa100.80g.2.norm", tensor_parallel=2, \
+                       pipeline_parallel=1):
+    '''Merges the trained LoRA adapter weights into the base LLM as a job of its own.
+    `create_triton_model_repository` already does this for LoRA, fused with its own job.'''
+    merge = plan_lora_merge(ti, ngc_api_key, org, ace, ace_instance, tensor_parallel, pipeline_parallel)
+    return run_stages(ti, ngc_api_key, org, [merge], team=team)[0]
 
 
-def create_triton_model_repository(ti, ngc_api_key, org, ace, team=None, method=None):
+def create_triton_model_repository(ti, ngc_api_key, org, ace, team=None, method=None, ace_instance="dgxa100.80g.2.norm", \
+                                   tensor_parallel=2, pipeline_parallel=1):
     '''Converts .nemo file into Faster Transformer format + creates the model 
-    repository necessary to serve the model through Triton inference server'''
+    repository necessary to serve the model through Triton inference server.
+    For LoRA, the adapter weights are merged into the base LLM first, in the same job.'''
     
     #get workspace id
     gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
-    tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
+    tuning_workspace_id = get_workspace_id(ti)
     
     #ngc job parameters
     job_name = f"airflow_create_triton_model_repository_{method}"
-    ace_instance = "dgxa100.80g.2.norm"
     ace_name = ace
     docker_image = f"{org}/nemofw-training:23.07-py3"
     replica_count = 1
@@ -64,7 +77,7 @@ def create_triton_model_repository(ti, ngc_api_key, org, ace, team=None, method=
     
     #declare paths to our tuned models that will need to be converted + run on Triton
     if method=="p_tuning":
-        nemo_file_path="/mount/gpt_workspace/gpt_models/nemo_gpt5B_bf16_tp2.nemo"
+        nemo_file_path=f"/mount/gpt_workspace/gpt_models/{get_base_model_name(ti)}"
         model_train_name="gpt3_5B"
     elif method == "lora":
         nemo_file_path="/mount/tuning_workspace/training_info/checkpoints/lora_gpt_5B_merged.nemo"
@@ -79,37 +92,45 @@ def create_triton_model_repository(ti, ngc_api_key, org, ace, team=None, method=
         cd /opt && \
         python3 /opt/FasterTransformer/examples/pytorch/gpt/utils/nemo_ckpt_convert.py \
             --in-file {nemo_file_path} \
-            --infer-gpu-num 2 \
+            --infer-gpu-num {tensor_parallel * pipeline_parallel} \
             --saved-dir /mount/tuning_workspace/model_repository/{model_train_name} \
             --weight-data-type fp16 \
             --load-checkpoints-to-cpu 0 && \
         python3 /opt/NeMo-Megatron-Launcher/launcher_scripts/nemo_launcher/collections/export_scripts/prepare_triton_model_config.py \
             --model-train-name {model_train_name} \
             --template-path /opt/fastertransformer_backend/all_models/gpt/fastertransformer/config.pbtxt \
-            --ft-checkpoint /mount/tuning_workspace/model_repository/{model_train_name}/2-gpu \
+            --ft-checkpoint /mount/tuning_workspace/model_repository/{model_train_name}/{tensor_parallel * pipeline_parallel}-gpu \
             --config-path /mount/tuning_workspace/model_repository/{model_train_name}/config.pbtxt \
             --max-batch-size 256 \
-            --tensor-model-parallel-size 2 \
-            --pipeline-model-parallel-size 1 \
+            --tensor-model-parallel-size {tensor_parallel} \
+            --pipeline-model-parallel-size {pipeline_parallel} \
             --data-type fp16' "
     
-    job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
-                                     replica_count, workspaces, job_command, team=team)
-
-    #wait for job to complete on BCP before allowing airflow to "finish" task
-    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=30, team=team)
-
-    return job_response
-
-def launch_triton_server(ti, ngc_api_key, org, ace, team=None, method=None):
+    #LoRA weights are merged right before conversion; both stages share a container, so they run as one job
+    stages = []
+    if method == "lora":
+        stages.append(plan_lora_merge(ti, ngc_api_key, org, ace, ace_instance, tensor_parallel, pipeline_parallel))
+        tuned_model = {'inputs': {'merge': stages[0].memo_hash}}
+    else:
+        tuned_model = {'upstream': [TUNED_MODEL_TASKS[method]]}
+
+    #each stage is skipped when it already ran from the same tuned model
+    stages.append(plan_stage(ti, ngc_api_key, org, f'triton_repository_{method}', tuning_workspace_id, job_name, \
+                             ace_instance, ace_name, docker_image, replica_count, workspaces, job_command, \
+                             wait_time=30, outputs=[f'model_repository/{model_train_name}/config.pbtxt'], \
+                             **tuned_model))
+
+    return run_stages(ti, ngc_api_key, org, stages, team=team)[-1]
+
+def launch_triton_server(ti, ngc_api_key, org, ace, team=None, method=None, ace_instance="dgxa100.80g.2.norm", \
+                         tensor_parallel=2, pipeline_parallel=1):
     '''Launches an interactive Triton Inference server on BCP using ports 8000, 8001, 8002'''
 
     #get workspace id
-    tuning_workspace_id = ti.xcom_pull(task_ids='create_tuning_workspace')
+    tuning_workspace_id = get_workspace_id(ti)
     
     #ngc job parameters
     job_name = f"airflow_triton_server_{method}"
-    ace_instance = "dgxa100.80g.2.norm"
     ace_name = ace
     docker_image = f"{org}/bignlp-inference:22.08-py3"
     replica_count = 1
@@ -119,13 +140,16 @@ def launch_triton_server(ti, ngc_api_key, org, ace, team=None, method=None):
            {"protocol": "HTTPS", "containerPort": 8001},
            {"protocol": "HTTPS", "containerPort": 8002}]
 
-    job_command = "bash -c 'export CUDA_VISIBLE_DEVICES=0,1 && \
+    visible_devices = ",".join(str(gpu) for gpu in range(tensor_parallel * pipeline_parallel))
+    job_command = f"bash -c 'export CUDA_VISIBLE_DEVICES={visible_devices} && \
                     tritonserver --model-repository /mount/tuning_workspace/model_repository'" 
     
+    timings = {'submitted': time.time()}
     job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace_name, docker_image, \
                                      replica_count, workspaces, job_command, team=team, ports=ports)
 
     #wait for job to complete on BCP before allowing airflow to "finish" task
-    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=60, team=team)
+    final_job_status = wait_for_job_completion(ti, ngc_api_key, org, job_response, wait_time=60, team=team, \
+                                               timings=timings)
 
-    return job_response
+    return JobResult.from_job(job_response, final_job_status, timings, workspace_id=tuning_workspace_id)
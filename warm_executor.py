@@ -0,0 +1,190 @@
+'''Long-lived "warm executor" NGC job that runs short pipeline stages for a whole DAG run.
+
+Short stages (SQuAD download, metric evaluation) spend most of their time in
+the ACE queue and starting their container. `start_executor` submits one job early in the DAG
+run; it mounts the GPT and tuning workspaces and runs a shell loop that executes command files
+dropped into `.executor/<run key>/queue/` of the tuning workspace, one at a time, writing each
+command's log and exit code to `done/`. `run_stages` (stage_manifest.py) dispatches a stage group
+there instead of submitting a job when the executor has the same image, instance and ACE and
+mounts every workspace the stages need. If the executor job has ended, the group is submitted
+as a regular job instead. `stop_executor` ends the loop; so does `idle_timeout` seconds without
+work, in case the DAG run never reaches it.
+
+The executor holds a GPU instance for as long as it runs, busy or not. The default idle timeout
+only bridges gaps of a few minutes between short stages, such as on a rerun whose training and
+inference are current; during a training run it exits, and the metric evaluation after it is
+submitted as a job of its own. An idle timeout longer than training keeps the evaluation warm
+at the cost of an idle instance for the whole training. No executor is started when none of
+the short stages it could run is pending.
+
+Commands reach the executor, and their exit codes and logs come back, through the workspace file
+endpoint of ngc_requests.py, which NGC's API reference does not document. `start_executor`
+therefore writes a probe file through it and reads it back first; if that fails, no executor is
+started and every stage runs as a job of its own, as without `warm_executor`.'''
+
+import time, hashlib
+
+from ngc_requests import ngc_job_request, ngc_job_status, get_workspace_file, put_workspace_file
+from job_polling import is_terminal, next_poll_delay
+from task_workspace import get_workspace_id, xcom_pull_from_group
+from workspace_index import get_workspace_index, invalidate_workspace_index
+
+EXECUTOR_DIR = '.executor'
+#task id of `start_executor` in the DAGs; stages look its XCom up to find the executor
+EXECUTOR_TASK_ID = 'start_warm_executor'
+#polls of a dispatched command between two status checks of the executor job itself
+EXECUTOR_CHECK_EVERY = 6
+
+
+def executor_dir(ti):
+    '''Queue directory of the DAG run, relative to the tuning workspace'''
+    run_key = hashlib.sha256(f'{ti.dag_id}/{ti.run_id}'.encode('utf-8')).hexdigest()[:12]
+    return f'{EXECUTOR_DIR}/{run_key}'
+
+
+def executor_command(directory, idle_timeout):
+    '''Shell loop run by the executor job: executes queued command files in name order'''
+    return f"bash -c 'dir={directory}; mkdir -p $dir/queue $dir/done; idle=0; \
+        while [ ! -e $dir/stop ] && [ $idle -lt {idle_timeout} ]; do \
+            next=$(ls $dir/queue/*.sh 2>/dev/null | head -n 1); \
+            if [ -z \"$next\" ]; then sleep 2; idle=$((idle + 2)); continue; fi; \
+            idle=0; name=$(basename $next .sh); mv $next $dir/running.sh; \
+            bash $dir/running.sh > $dir/done/$name.log 2>&1; \
+            echo $? > $dir/done/$name.part && mv $dir/done/$name.part $dir/done/$name.status; \
+        done'"
+
+
+def file_endpoint_available(ngc_api_key, org, workspace_id, directory):
+    '''True if a file written through the workspace file endpoint reads back the same'''
+    probe = f'{directory}/probe'
+    try:
+        put_workspace_file(ngc_api_key, org, workspace_id, probe, b'probe\n')
+        return get_workspace_file(ngc_api_key, org, workspace_id, probe) == b'probe\n'
+    except Exception as e:
+        print(f'Probing the workspace file endpoint failed: {e}')
+        return False
+
+
+def short_stages_pending(ti, ngc_api_key, org, ace, tuning_workspace_id, eval_method=None):
+    '''Names of the short stages of this DAG run that still have to run: the SQuAD download unless
+    it is current, and the metric evaluation of *eval_method* unless its scores are already in the
+    workspace. The evaluation's memo hash depends on inference that has not run yet, so scores
+    from an earlier run count as current here; if they turn out stale, the evaluation simply runs
+    as a job of its own.'''
+    #imported here: download_squad imports stage_manifest, which imports this module
+    from download_squad import plan_download
+    from squad_eval import squad_metrics_path
+
+    pending = []
+    if not plan_download(ti, ngc_api_key, org, ace, tuning_workspace_id).current:
+        pending.append('squad_download')
+    if eval_method and get_workspace_index(ngc_api_key, org, tuning_workspace_id).stat(
+            squad_metrics_path(eval_method)) is None:
+        pending.append(f'squad_eval_{eval_method}')
+    return pending
+
+
+def start_executor(ti, ngc_api_key, org, ace, team=None, ace_instance="dgxa100.80g.1.norm", idle_timeout=900,
+                   eval_method=None):
+    '''Submits the executor job of this DAG run without waiting for it to start, if any short stage
+    is pending (see `short_stages_pending`; *eval_method* is the tuning method whose metric
+    evaluation follows, if any) and the workspace file endpoint works. Returns what `run_stages` needs to dispatch to it: job id, tuning
+    workspace id, queue directory and the container the executor offers; or None if no executor
+    was started, so every stage runs as a job of its own.'''
+
+    gpt_workspace_id = ti.xcom_pull(task_ids='create_gpt_workspace')
+    tuning_workspace_id = get_workspace_id(ti)
+    directory = executor_dir(ti)
+
+    pending = short_stages_pending(ti, ngc_api_key, org, ace, tuning_workspace_id, eval_method)
+    if not pending:
+        print('No short stage is pending, not starting a warm executor.')
+        return None
+    if not file_endpoint_available(ngc_api_key, org, tuning_workspace_id, directory):
+        print('The workspace file endpoint is not available, not starting a warm executor.')
+        return None
+    print(f"Starting a warm executor for {', '.join(pending)}.")
+
+    #ngc job parameters; the container matches the short stages it replaces
+    job_name = "airflow_warm_executor"
+    docker_image = f"{org}/nemofw-training:23.07-py3"
+    workspaces=[{"id":gpt_workspace_id, "mount": "/mount/gpt_workspace"},
+                {"id":tuning_workspace_id, "mount": "/mount/tuning_workspace"}]
+    job_command = executor_command(f'/mount/tuning_workspace/{directory}', idle_timeout)
+
+    job_response = ngc_job_request(ti, ngc_api_key, org, job_name, ace_instance, ace, docker_image, 1, \
+                                   workspaces, job_command, team=team)
+    return {
+        'job_id': job_response['job']['id'],
+        'workspace_id': tuning_workspace_id,
+        'directory': directory,
+        'docker_image': docker_image,
+        'ace_instance': ace_instance,
+        'ace_name': ace,
+        'mounts': [[workspace['id'], workspace['mount']] for workspace in workspaces],
+    }
+
+
+def stop_executor(ti, ngc_api_key, org):
+    '''Asks the executor job of this DAG run to exit once its current command is done'''
+    executor = get_executor(ti)
+    if executor:
+        put_workspace_file(ngc_api_key, org, executor['workspace_id'], f"{executor['directory']}/stop", b'')
+
+
+def get_executor(ti):
+    '''The executor started for this DAG run, or None'''
+    return xcom_pull_from_group(ti, EXECUTOR_TASK_ID)
+
+
+def can_run(executor, group):
+    '''True if every stage of *group* could run in the executor's container'''
+    mounts = {tuple(mount) for mount in executor['mounts']}
+    return all(stage.docker_image == executor['docker_image'] and stage.ace_instance == executor['ace_instance']
+               and stage.ace_name == executor['ace_name'] and stage.replica_count == 1 and not stage.ports
+               and {(workspace['id'], workspace['mount']) for workspace in stage.workspaces} <= mounts
+               for stage in group)
+
+
+def dispatch(ti, ngc_api_key, org, executor, job_name, job_command, wait_time):
+    '''Queues *job_command* on the executor and waits for its exit code. Returns the final status
+    (FINISHED_SUCCESS or FAILED) and timings like `wait_for_job_completion` (without status
+    transitions), or (None, None) if
+    the executor job ended before running the command.'''
+
+    #an executor that has already exited (idle timeout, failure) would never pick the command up
+    executor_status = ngc_job_status(ti, ngc_api_key, org, executor['job_id'])
+    if is_terminal(executor_status):
+        print(f'Warm executor job ended ({executor_status}), submitting {job_name} as a job of its own.')
+        return None, None
+
+    name = f'{time.time_ns()}-{job_name}'
+    directory, workspace_id = executor['directory'], executor['workspace_id']
+    started, submitted = time.monotonic(), time.time()
+    put_workspace_file(ngc_api_key, org, workspace_id, f'{directory}/queue/{name}.sh',
+                       f'set -e\n{job_command}\n'.encode('utf-8'))
+    print(f"Dispatched {job_name} to warm executor job {executor['job_id']}.")
+
+    polls = 0
+    while True:
+        exit_code = get_workspace_file(ngc_api_key, org, workspace_id, f'{directory}/done/{name}.status')
+        if exit_code is not None:
+            break
+        polls += 1
+        if polls % EXECUTOR_CHECK_EVERY == 0:
+            executor_status = ngc_job_status(ti, ngc_api_key, org, executor['job_id'])
+            if is_terminal(executor_status):
+                print(f'Warm executor job ended ({executor_status}) before running {job_name}.')
+                return None, None
+        time.sleep(next_poll_delay('RUNNING', polls, wait_time))
+
+    #the command wrote to the executor's workspaces
+    for mounted_workspace_id, _ in executor['mounts']:
+        invalidate_workspace_index(mounted_workspace_id)
+
+    log = get_workspace_file(ngc_api_key, org, workspace_id, f'{directory}/done/{name}.log') or b''
+    print(log.decode('utf-8', 'replace')[-4000:])
+    job_status = 'FINISHED_SUCCESS' if exit_code.strip() == b'0' else 'FAILED'
+    #the executor reports no per-command status history, only the exit code the polls found
+    return job_status, {'queued_seconds': None, 'run_seconds': round(time.monotonic() - started, 1),
+                        'submitted': submitted, 'transitions': [], 'detected': time.time()}
@@ -0,0 +1,82 @@
+'''In-memory index of NGC workspace contents so many skip checks are answered from one listing'''
+
+import time, threading
+
+#seconds an index stays valid before the workspace is listed again
+DEFAULT_TTL = 30
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def workspace_item_path(workspace_item):
+    '''Path of a storage object relative to the workspace root, without a leading slash'''
+    return workspace_item.get('path', workspace_item['name']).lstrip('/')
+
+
+class WorkspaceIndex:
+    '''Set/dict view over one listing of a workspace, keyed by file name and by path.
+    Each entry keeps the storage object's size and modified time.'''
+
+    def __init__(self, workspace_id, storage_objects):
+        self.workspace_id = workspace_id
+        self.created = time.monotonic()
+        self.by_path = {}
+        self.by_name = {}
+        for workspace_item in storage_objects:
+            path = workspace_item_path(workspace_item)
+            entry = {
+                'path': path,
+                'size': workspace_item.get('size'),
+                'mtime': workspace_item.get('lastModified'),
+            }
+            self.by_path[path] = entry
+            self.by_name.setdefault(workspace_item['name'], []).append(entry)
+
+    def __contains__(self, filename):
+        return self.exists(filename)
+
+    def __len__(self):
+        return len(self.by_path)
+
+    def exists(self, filename, prefix=None):
+        '''True if a file called *filename* exists (optionally under the directory *prefix*)'''
+        entries = self.by_name.get(filename, [])
+        if prefix:
+            prefix = prefix.lstrip('/')
+            return any(entry['path'].startswith(prefix) for entry in entries)
+        return bool(entries)
+
+    def missing(self, filenames, prefix=None):
+        '''Returns the subset of *filenames* that are not in the workspace, in the given order'''
+        return [filename for filename in filenames if not self.exists(filename, prefix)]
+
+    def stat(self, path):
+        '''Size/mtime entry for an exact workspace path, or None'''
+        return self.by_path.get(path.lstrip('/'))
+
+    def expired(self, ttl):
+        return time.monotonic() - self.created > ttl
+
+
+def get_workspace_index(ngc_api_key, org, workspace_id, ttl=DEFAULT_TTL):
+    '''Returns a WorkspaceIndex for the workspace, reusing one built in the last *ttl* seconds'''
+    from ngc_requests import iter_workspace_contents #ngc_requests imports this module
+
+    key = (org, workspace_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is None or index.expired(ttl):
+            index = WorkspaceIndex(workspace_id, iter_workspace_contents(ngc_api_key, org, workspace_id))
+            _indexes[key] = index
+        return index
+
+
+def invalidate_workspace_index(workspace_id=None):
+    '''Forgets the cached index of a workspace (or of every workspace) after a job wrote to it'''
+    with _lock:
+        if workspace_id is None:
+            _indexes.clear()
+        else:
+            for key in [key for key in _indexes if key[1] == workspace_id]:
+                del _indexes[key]
@@ -0,0 +1,29 @@
+'''XCom backend that stores JobResult values as short tagged JSON lists.
+
+Enable it with `AIRFLOW__CORE__XCOM_BACKEND=xcom_backend.CompactXCom` (the DAGs folder is on the
+Python path of every Airflow component). Every other value is stored by the default backend.'''
+
+import json
+from airflow.models.xcom import BaseXCom
+
+from job_result import JobResult
+
+#key marking a serialized JobResult: {"__job_result__": [version, [field values]]}
+_TAG = '__job_result__'
+
+
+class CompactXCom(BaseXCom):
+
+    @staticmethod
+    def serialize_value(value, **kwargs):
+        if isinstance(value, JobResult):
+            return json.dumps({_TAG: [JobResult.__version__, value.serialize()]}, separators=(',', ':')).encode('utf-8')
+        return BaseXCom.serialize_value(value, **kwargs)
+
+    @staticmethod
+    def deserialize_value(result):
+        value = result.value
+        if isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:len(_TAG) + 3]) == b'{"%s"' % _TAG.encode():
+            version, data = json.loads(bytes(value).decode('utf-8'))[_TAG]
+            return JobResult.deserialize(data, version)
+        return BaseXCom.deserialize_value(result)